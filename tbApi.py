@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbApi
+=====
+
+In-process interface for build tools. Sources are given as text and
+testbenches returned as text: nothing is printed, written or exited, and
+the functions may be called from several threads at once or from a process
+pool (their arguments and results pickle; models in the compact form of
+vSerial)::
+
+    import tbApi
+
+    with open("full_adder.vhd") as f:
+        testbench = tbApi.generate_testbench(f.read(), {"clock_period": 20})
+
+Failures are raised:
+
+- vhdl.VHDLError, or its subclass vhdl.ParseError for sources that can't be
+  parsed, with the ``filename`` and ``offset`` of the problem when known
+- tbTemplate.TemplateError for invalid templates
+- ValueError for invalid settings
+
+The exceptions are also available from this module. A work package file
+that can't be read or parsed counts as a problem of the source using it.
+
+Problems that don't stop generation, such as ignored declarations or ports
+left without stimulus, are added to the list 'diagnostics' when one is
+given, and dropped otherwise.
+
+Work packages are parsed once per file content into a vParser.PackageCache:
+the bounded one of the process unless one is given as 'package_cache'.
+"""
+
+import copy, os
+
+import tb_gen
+from vhdl import VHDLError, ParseError, collecting
+from vParser import parseVHDL, reparseVHDL, resolvePackages
+from tbSettings import Settings
+from tbTemplate import TemplateError
+
+__all__ = ["VHDLError", "ParseError", "TemplateError", "parse", "reparse", "generate_testbench", "generate_files"]
+
+def _settings(settings):
+    """
+    Returns the Settings of a call: 'settings' may be Settings, a dict of
+    setting values or None for the defaults. Calls never prompt.
+    """
+    if isinstance(settings, Settings):
+        settings = copy.copy(settings)
+        settings.interactive = False
+        return settings
+    return Settings(settings)
+
+def _entity(model, name):
+    if name is None:
+        return None
+    for arch in model.getArchitectures():
+        if arch.getEntity().getName().lower() == name.lower():
+            return arch.getEntity()
+    raise VHDLError("no entity '%s' was found" % name)
+
+def parse(source_text, headers_only=False, search_paths=None, diagnostics=None, package_cache=None):
+    """
+    Parses the VHDL source 'source_text' (text or bytes) and returns its
+    vhdl.VHDL model. With 'headers_only' only the library clauses, entity
+    headers and architecture names are read. The work packages it uses are
+    looked up in the sources of the directories 'search_paths', if given.
+    """
+    with collecting() as messages:
+        try:
+            model = parseVHDL(source_text, headers_only)
+            if search_paths:
+                try:
+                    resolvePackages(model, search_paths, package_cache)
+                except VHDLError:
+                    raise
+                except Exception as e:
+                    raise VHDLError("failed to resolve the work packages: %s" % e) from e
+        finally:
+            if diagnostics is not None:
+                diagnostics.extend(messages)
+    return model
+
+def reparse(model, source_text, offset, removed, inserted, headers_only=False, diagnostics=None):
+    """
+    Applies an edit to 'source_text', the source 'model' was parsed from
+    (with the same 'headers_only'): 'removed' characters at 'offset' are
+    replaced by the text 'inserted'. Returns the edited text and its model,
+    for which only the design units touched by the edit are parsed again.
+    The libraries, entities, ports, generics and architectures of models
+    know their span in the text (getSpan). 'model' must not be used
+    afterwards.
+    """
+    with collecting() as messages:
+        try:
+            return reparseVHDL(model, source_text, offset, removed, inserted, headers_only)
+        finally:
+            if diagnostics is not None:
+                diagnostics.extend(messages)
+
+def generate_testbench(source_text, settings=None, entity=None, search_paths=None, diagnostics=None,
+                       package_cache=None):
+    """
+    Returns the testbench of the entity 'entity' of 'source_text', or of all
+    of its entities. See generate_files for the vector files of testbenches
+    with stimulus.
+    """
+    settings = _settings(settings)
+    model = parse(source_text, True, search_paths, diagnostics, package_cache)
+    with collecting() as messages:
+        try:
+            tb_gen.useModel(model, settings)
+            return "".join(tb_gen.testbenchTb(_entity(model, entity)))
+        finally:
+            if diagnostics is not None:
+                diagnostics.extend(messages)
+
+def generate_files(source_text, vhd_path, settings=None, search_paths=None, diagnostics=None, package_cache=None):
+    """
+    Returns what tb_gen would write for the source file 'vhd_path' holding
+    'source_text', as (filename, content) pairs: the testbench of each
+    entity, followed by its vector file if it gets stimulus. Work packages
+    are looked up next to 'vhd_path' unless 'search_paths' is given.
+    """
+    settings = _settings(settings)
+    if search_paths is None:
+        search_paths = [os.path.dirname(vhd_path)]
+    model = parse(source_text, True, search_paths, diagnostics, package_cache)
+    with collecting() as messages:
+        try:
+            tb_gen.useModel(model, settings)
+            outputs = []
+            for entity, tb_filename in tb_gen.testbenchFilenames(vhd_path, model):
+                outputs += tb_gen.renderOutputs(entity, tb_filename)
+            return outputs
+        finally:
+            if diagnostics is not None:
+                diagnostics.extend(messages)
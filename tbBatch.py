@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbBatch
+=======
+
+Generates the testbenches of a whole source tree: files are read and written
+on an asyncio pipeline while a process pool parses them and renders their
+testbenches.
+"""
+
+import asyncio, copy, glob, io, os, sys, time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext, redirect_stdout
+
+import tb_gen, tbProfile
+from vParser import SOURCE_EXTENSIONS
+
+# 'testbenches' also lists the vector files, each after its testbench, and
+# 'dependencies' the files of the work packages the source uses; once
+# generated, they map to their stamps (see tb_gen.packageStamps)
+Result = namedtuple("Result", ["source", "testbenches", "ok", "messages", "cached", "profile", "dependencies"],
+                    defaults=[False, None, ()])
+
+def findSources(paths):
+    """
+    Expands files, directories (recursively) and glob patterns into a sorted
+    list of .vhd and .vhdl files. Testbenches generated by a previous run are skipped
+    unless named explicitly.
+    """
+    sources = set()
+    for path in paths:
+        if os.path.isfile(path):
+            sources.add(os.path.normpath(path))
+            continue
+        matches = [path] if os.path.isdir(path) else glob.glob(path, recursive=True)
+        if not matches:
+            print("warning: '%s' did not match any file" % path)
+        for match in matches:
+            if os.path.isfile(match):
+                if _isSource(match):
+                    sources.add(os.path.normpath(match))
+                continue
+            for root, dirs, files in os.walk(match):
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                sources.update(os.path.normpath(os.path.join(root, f)) for f in files if _isSource(f))
+    return sorted(sources)
+
+def _isSource(filename):
+    filename = os.path.basename(filename)
+    return filename.lower().endswith(SOURCE_EXTENSIONS) and not filename.startswith("tb_")
+
+def renderOne(source, text=None, settings=None, headers_only=False, profile=False):
+    """
+    Parses 'source', given its 'text' (or reading it when None), and renders
+    its testbenches without writing them. Never raises: failures, including
+    the parser calling sys.exit, are reported in the returned Result together
+    with everything that was printed. Returns the Result and the list of
+    (filename, content) of its testbenches and vector files. With 'profile'
+    the Result holds the tbProfile report of the file.
+    """
+    if settings is not None:
+        settings = copy.copy(settings)
+        settings.interactive = False
+
+    out = io.StringIO()
+    outputs, ok, report, dependencies = [], False, None, []
+    with redirect_stdout(out):
+        try:
+            with tbProfile.profiling(source) if profile else nullcontext() as p:
+                if text is None:
+                    model = tb_gen.parseFile(source, headers_only)
+                else:
+                    tbProfile.count("bytes", len(text.encode()))
+                    with tbProfile.phase("parse"):
+                        model = tb_gen.parseVHDL(text, headers_only)
+                    with tbProfile.phase("packages"):
+                        tb_gen.resolvePackages(model, [os.path.dirname(source)])
+                tb_gen.useModel(model, settings)
+                for entity, testbench in tb_gen.testbenchFilenames(source, model):
+                    outputs += tb_gen.renderOutputs(entity, testbench)
+                dependencies = tb_gen.packageStamps(model)
+            report = p.report() if profile else None
+            ok = True
+        except SystemExit:
+            pass
+        except Exception as e:
+            print("error: %s" % e)
+    return Result(source, [t for t, _ in outputs], ok, out.getvalue().strip(), False, report, dependencies), outputs
+
+def _read(source):
+    """
+    Returns the text of 'source', the time it took to read and an error
+    message, if any.
+    """
+    start = time.perf_counter()
+    try:
+        with open(source, "r") as f:
+            return f.read(), time.perf_counter() - start, ""
+    except (OSError, UnicodeDecodeError) as e:
+        return None, 0.0, "error: failed to open file '%s': %s" % (source, e)
+
+def _write(outputs):
+    """
+    Writes the (filename, content) pairs 'outputs' and returns the time it
+    took and the number of bytes written.
+    """
+    start, written = time.perf_counter(), 0
+    for filename, content in outputs:
+        if tb_gen.write_file(filename, content):
+            written += len(content.encode())
+    return time.perf_counter() - start, written
+
+async def _pipeline(sources, jobs, settings, cache, headers_only, profile, in_flight):
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(in_flight)
+    # with a single job, files are rendered on one thread beside the event
+    # loop; more threads would not help, as rendering holds the GIL, and
+    # renderOne captures the output with redirect_stdout, which is process-wide
+    cpu = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else ThreadPoolExecutor(max_workers=1)
+    io_pool = ThreadPoolExecutor(max_workers=in_flight)
+    claimed = {} # testbench -> the source it is written for
+
+    def claim(source, testbenches):
+        """
+        Returns an error if a testbench of 'source' is already written for
+        another source declaring an entity of the same name.
+        """
+        for t in testbenches:
+            owner = claimed.setdefault(os.path.normcase(os.path.abspath(t)), source)
+            if owner != source:
+                return "error: '%s' is also the testbench of an entity of '%s', it was not written" % (t, owner)
+        return None
+
+    async def one(source):
+        async with limit:
+            state = await loop.run_in_executor(io_pool, cache.check, source) if cache is not None else {}
+            if state is None:
+                claim(source, cache.testbenches(source))
+                return Result(source, cache.testbenches(source), True, "", True, None, cache.dependencies(source)), state
+
+            text, read_time = None, 0.0
+            if not headers_only: # memory-mapped sources are read by the parser
+                text, read_time, error = await loop.run_in_executor(io_pool, _read, source)
+                if text is None:
+                    return Result(source, [], False, error), state
+
+            result, outputs = await loop.run_in_executor(cpu, renderOne, source, text, settings, headers_only, profile)
+            if not result.ok:
+                return result, state
+            error = claim(source, result.testbenches)
+            if error is not None:
+                return result._replace(ok=False, messages=(result.messages + "\n" + error).strip()), state
+            try:
+                write_time, written = await loop.run_in_executor(io_pool, _write, outputs)
+            except OSError as e:
+                return result._replace(ok=False, messages=(result.messages + "\nerror: %s" % e).strip()), state
+            if result.profile is not None:
+                phases, counters = result.profile["phases"], result.profile["counters"]
+                phases["read"] = phases.get("read", 0.0) + read_time
+                phases["write"] = write_time
+                counters["bytes_written"] = written
+            return result, state
+
+    try:
+        return await asyncio.gather(*(one(s) for s in sources))
+    finally:
+        cpu.shutdown()
+        io_pool.shutdown()
+
+def runBatch(sources, jobs=None, settings=None, cache=None, headers_only=False, profile=False, in_flight=None):
+    """
+    Generates the testbenches of all 'sources' and returns the list of
+    Results. Files are read, checked against 'cache' and written on an
+    asyncio pipeline that keeps at most 'in_flight' files (4 per job by
+    default) between being read and written, so I/O latency overlaps the
+    parsing and rendering, done on 'jobs' worker processes (one per core by
+    default). Batch runs never prompt, whatever 'settings' says. Sources that
+    'cache' knows to be up to date are not regenerated. With 'profile' the
+    Results of the generated files hold their tbProfile reports.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    in_flight = in_flight or jobs * 4
+    pairs = asyncio.run(_pipeline(sources, jobs, settings, cache, headers_only, profile, in_flight))
+
+    results = [r for r, _ in pairs]
+    if cache is not None:
+        for r, state in pairs:
+            if r.cached:
+                continue
+            if r.ok:
+                cache.record(r.source, state, r.testbenches, r.dependencies)
+            else:
+                cache.forget(r.source)
+        cache.save()
+    return results
+
+def printSummary(results, out=sys.stdout):
+    """
+    Prints the failures and a one-line summary. Returns True if every file
+    succeeded.
+    """
+    failed = [r for r in results if not r.ok]
+    generated = [r for r in results if r.ok and not r.cached]
+    # vector files are listed along with the testbenches
+    testbenches = sum(1 for r in generated for t in r.testbenches if t.endswith(".vhd"))
+    cached = sum(1 for r in results if r.cached for t in r.testbenches if t.endswith(".vhd"))
+    skipped = sum(1 for r in results if r.ok and not r.testbenches)
+    for r in failed:
+        out.write("FAILED %s\n" % r.source)
+        for line in r.messages.splitlines():
+            out.write("\t%s\n" % line)
+    summary = "%d testbenches generated, %d up to date, %d failed" % (testbenches, cached, len(failed))
+    if skipped:
+        summary += ", %d skipped (no entity)" % skipped
+    out.write(summary + "\n")
+    return not failed
@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbBenchmark
+===========
+
+Times the parser and the testbench generator phase by phase on the files of
+tests/ and on synthetic VHDL sources, and compares the throughput with a
+stored baseline::
+
+    python tbBenchmark.py -o results.json
+    python tbBenchmark.py --baseline baseline.json --update-baseline
+    python tbBenchmark.py --baseline baseline.json --threshold 0.2
+
+The last form exits with status 1 if a phase got slower than the baseline by
+more than the threshold.
+"""
+
+import glob, io, json, os, platform, random, shutil, sys, tempfile, time
+from contextlib import redirect_stdout
+
+import tb_gen
+from vhdl import *
+import vParser
+from vParser import *
+from vLexer import TokenStream
+from tbSettings import Settings
+from tbTemplate import loadTemplates
+
+RESULTS_VERSION = 1
+
+PHASES = ["read", "libs", "entities", "architectures", "ports", "signals", "parse", "emit", "write"]
+
+# Keyword arguments of generateVHDL
+SCENARIOS = {
+    "small":    {"entities": 1, "ports": 8, "generics": 2, "signals": 16, "components": 2, "comments": 0.2},
+    "wide":     {"entities": 1, "ports": 10000, "generics": 50, "signals": 100, "components": 2, "comments": 0.1},
+    "multi":    {"entities": 50, "ports": 16, "generics": 4, "signals": 32, "components": 4, "comments": 0.2},
+    "decl":     {"entities": 1, "ports": 8, "generics": 2, "signals": 20000, "components": 500, "comments": 0.1},
+    "comments": {"entities": 4, "ports": 32, "generics": 4, "signals": 64, "components": 4, "comments": 0.9},
+    "large":    {"entities": 2, "ports": 64, "generics": 8, "signals": 256, "components": 8, "comments": 0.3, "size": 8 << 20},
+}
+
+_TYPES = ["std_logic", "std_logic_vector(%d downto 0)", "unsigned(%d downto 0)", "signed(%d downto 0)", "integer range 0 to %d"]
+
+_COMMENTS = [
+    "-- %d: registered to meet timing",
+    "-- TODO %d: check the reset value",
+    "-- %d: 'quoted' \"text\" end begin function; -- keywords in comments",
+]
+
+def generateVHDL(entities=1, ports=8, generics=2, signals=16, components=2, comments=0.0, size=0, seed=0):
+    """
+    Returns a synthetic VHDL source with 'entities' entity/architecture pairs.
+    Every entity has a clock, a reset, 'ports' other ports and 'generics'
+    generics; every architecture declares 'components' components and
+    'signals' signals and constants. 'comments' is the fraction of lines
+    followed by a comment line. The architecture bodies are padded with
+    concurrent statements until the source is at least 'size' bytes long.
+    """
+    rnd = random.Random(seed)
+    lines = []
+
+    def add(line):
+        lines.append(line)
+        if comments and rnd.random() < comments:
+            lines.append("\t" + rnd.choice(_COMMENTS) % len(lines))
+
+    def vhdlType():
+        t = rnd.choice(_TYPES)
+        return t % rnd.choice((1, 7, 15, 31, 255)) if "%" in t else t
+
+    units = []
+    for e in range(entities):
+        add("library ieee;")
+        add("use ieee.std_logic_1164.all;")
+        add("use ieee.numeric_std.all;")
+        add("")
+        add("entity bench_%d is" % e)
+        if generics:
+            add("\tgeneric (")
+            for g in range(generics):
+                add("\t\tG_%d : integer := %d%s" % (g, rnd.randrange(64), ";" if g < generics - 1 else ""))
+            add("\t);")
+        add("\tport (")
+        add("\t\tclk : in std_logic;")
+        add("\t\trst : in std_logic%s" % (";" if ports else ""))
+        for p in range(ports):
+            add("\t\tp_%d : %s %s%s" % (p, rnd.choice(("in", "in", "out", "inout")), vhdlType(), ";" if p < ports - 1 else ""))
+        add("\t);")
+        add("end bench_%d;" % e)
+        add("")
+        add("architecture rtl_%d of bench_%d is" % (e, e))
+        for c in range(components):
+            add("\tcomponent sub_%d_%d is" % (e, c))
+            add("\t\tport (a : in std_logic; y : out std_logic);")
+            add("\tend component;")
+        for s in range(signals):
+            if s % 4 == 3:
+                add("\tconstant c_%d : integer := %d;" % (s, s))
+            else:
+                add("\tsignal s_%d : %s;" % (s, vhdlType()))
+        add("begin")
+        for c in range(components):
+            add("\tu_%d: sub_%d_%d port map (a => clk, y => open);" % (c, e, c))
+        units.append(len(lines))
+        add("end rtl_%d;" % e)
+        add("")
+
+    missing = size - sum(len(l) + 1 for l in lines)
+    if missing > 0:
+        # pad every body evenly, inserting from the last so offsets stay valid
+        per_unit = missing // len(units) + 1
+        for u in reversed(units):
+            body, length = [], 0
+            while length < per_unit:
+                n = len(body)
+                if comments and rnd.random() < comments:
+                    body.append("\t" + rnd.choice(_COMMENTS) % n)
+                body.append("\tq_%d <= d_%d when rising_edge(clk) and en_%d = '1' else q_%d;" % (n, n, n, n))
+                length += sum(len(l) + 1 for l in body[-2:])
+            lines[u:u] = body
+
+    return "\n".join(lines) + "\n"
+
+def corpus(scenarios=None, scale=1.0, tests_dir=None):
+    """
+    Returns the benchmark corpus as a list of (name, source text): the .vhd
+    files of 'tests_dir' (tests/ next to this module by default) and the
+    synthetic 'scenarios' (all by default), with their counts and size
+    multiplied by 'scale'.
+    """
+    if tests_dir is None:
+        tests_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests")
+    sources = []
+    for filename in sorted(glob.glob(os.path.join(tests_dir, "*.vhd"))):
+        sources.append(("tests/" + os.path.basename(filename), read_file(filename)))
+    for name in (scenarios if scenarios is not None else sorted(SCENARIOS)):
+        params = dict(SCENARIOS[name])
+        for key in params:
+            if key != "comments":
+                params[key] = max(1, int(params[key] * scale))
+        sources.append((name, generateVHDL(**params)))
+    return sources
+
+def _clauses(source):
+    """
+    Returns the port clauses of 'source' as tokens and its architecture
+    declarative regions as text, as PortList and SignalList get them from the
+    parser.
+    """
+    ports = []
+    ts = TokenStream(source)
+    while ts.peek() is not None:
+        if ts.next().kind == "port" and ts.peekKind() == "(":
+            ports.append(ts.collectGroup())
+    with redirect_stdout(io.StringIO()):
+        decls = [value[2] for kind, value in vParser.designUnits(source) if kind == "architecture" and value[2]]
+    decls = [text[start:end] for text, start, end in decls]
+    return ports, decls
+
+def _best(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def benchmarkSource(source, directory, repeat=3):
+    """
+    Times every phase of the generation of the testbenches of 'source', using
+    'directory' for the files read and written. Returns a dict with the size
+    of the source, the counts of what was parsed and the best time of each
+    phase in seconds.
+    """
+    filename = os.path.join(directory, "bench.vhd")
+    with open(filename, "w") as f:
+        f.write(source)
+    ports, decls = _clauses(source)
+
+    times = {}
+    with redirect_stdout(io.StringIO()):
+        times["read"] = _best(lambda: read_file(filename), repeat)
+        times["libs"] = _best(lambda: parseLibs(source), repeat)
+        times["entities"] = _best(lambda: parseEntities(source), repeat)
+        entities = parseEntities(source)
+        times["architectures"] = _best(lambda: [parseArchitectureOfEntity(source, e) for e in entities], repeat)
+        times["ports"] = _best(lambda: [PortList(p) for p in ports], repeat)
+        times["signals"] = _best(lambda: [SignalList(d) for d in decls], repeat)
+        times["parse"] = _best(lambda: parseVHDL(source), repeat)
+
+        model = parseVHDL(source)
+        tb_gen.useModel(model, Settings())
+        outputs = tb_gen.testbenchFilenames(filename, model)
+        times["emit"] = _best(lambda: ["".join(tb_gen.testbenchTb(e)) for e, _ in outputs], repeat)
+        testbenches = [(f, "".join(tb_gen.testbenchTb(e))) for e, f in outputs]
+
+        def write():
+            for tb_filename, testbench in testbenches:
+                if os.path.exists(tb_filename):
+                    os.remove(tb_filename) # time a real write, not the unchanged check
+                write_file(tb_filename, testbench)
+        times["write"] = _best(write, repeat)
+
+    return {
+        "bytes": len(source.encode()),
+        "entities": len(model.getEntities()),
+        "ports": sum(len(e.getPorts()) for e in model.getEntities()),
+        "generics": sum(len(e.getGenerics()) for e in model.getEntities()),
+        "signals": sum(len(a.getSignalList()) for a in model.getArchitectures()),
+        "output_bytes": sum(len(t.encode()) for _, t in testbenches),
+        "phases": times,
+    }
+
+def runBenchmark(sources, repeat=3):
+    """
+    Benchmarks every (name, source text) of 'sources' and returns the results
+    as a JSON-serializable dict.
+    """
+    results = {
+        "version": RESULTS_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "sources": {},
+    }
+    loadTemplates() # compile the templates outside of the timings
+    directory = tempfile.mkdtemp(prefix="tb_bench")
+    try:
+        for name, source in sources:
+            results["sources"][name] = benchmarkSource(source, directory, repeat)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+def throughput(result, phase):
+    """
+    Returns the throughput of 'phase' in MB of source per second.
+    """
+    elapsed = result["phases"][phase]
+    return result["bytes"] / elapsed / 1e6 if elapsed > 0 else float("inf")
+
+def compareResults(results, baseline, threshold=0.2, min_time=5e-3):
+    """
+    Returns the regressions of 'results' against 'baseline' as a list of
+    (source, phase, baseline MB/s, current MB/s): the phases whose throughput
+    dropped by more than 'threshold'. Phases that took less than 'min_time'
+    seconds in the baseline are too noisy to compare and are ignored, as are
+    sources whose size changed.
+    """
+    regressions = []
+    for name, result in sorted(results["sources"].items()):
+        base = baseline.get("sources", {}).get(name)
+        if base is None or base["bytes"] != result["bytes"]:
+            continue
+        for phase in PHASES:
+            if phase not in base["phases"] or base["phases"][phase] < min_time:
+                continue
+            before, after = throughput(base, phase), throughput(result, phase)
+            if after < before * (1 - threshold):
+                regressions.append((name, phase, before, after))
+    return regressions
+
+def printResults(results, out=sys.stdout):
+    out.write("%-24s %10s" % ("source", "KB"))
+    for phase in PHASES:
+        out.write(" %13s" % phase)
+    out.write("\n")
+    for name, result in results["sources"].items():
+        out.write("%-24s %10d" % (name, result["bytes"] // 1024))
+        for phase in PHASES:
+            out.write(" %10.2f ms" % (result["phases"][phase] * 1e3))
+        out.write("\n")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the VHDL parser and testbench generator.")
+    parser.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+                        help="synthetic sources to benchmark: %s (default: all)" % ", ".join(sorted(SCENARIOS)))
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="runs per phase, the best is kept (default: %(default)s)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiply the counts and sizes of the synthetic sources (default: %(default)s)")
+    parser.add_argument("--tests", metavar="DIR",
+                        help="directory of .vhd files added to the corpus (default: tests/)")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="results to compare with")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="write the results to the baseline file instead of comparing")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="fail if a phase is slower than the baseline by this fraction (default: %(default)s)")
+    parser.add_argument("--min-time", type=float, default=5e-3, metavar="SECONDS",
+                        help="ignore phases faster than this in the baseline (default: %(default)s)")
+    args = parser.parse_args()
+
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        print("error: unknown scenario '%s'" % unknown[0])
+        sys.exit(1)
+
+    results = runBenchmark(corpus(args.scenarios or None, args.scale, args.tests), args.repeat)
+    printResults(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=1)
+        print("\nThe baseline '%s' was updated." % args.baseline)
+    elif args.baseline:
+        try:
+            with open(args.baseline, "r") as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            print("error: failed to read baseline '%s': %s" % (args.baseline, e))
+            sys.exit(1)
+        regressions = compareResults(results, baseline, args.threshold, args.min_time)
+        for name, phase, before, after in regressions:
+            print("REGRESSION %s: %s %.2f MB/s -> %.2f MB/s" % (name, phase, before, after))
+        print("\n%d regressions against '%s'" % (len(regressions), args.baseline))
+        sys.exit(1 if regressions else 0)
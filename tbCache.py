@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbCache
+=======
+
+On-disk manifest of the sources whose testbench is up to date. An entry is
+only valid for the source content, the settings and the generator version it
+was produced with, and for the content of the files declaring the work
+packages it uses. The file stat is checked first, so unchanged trees are not
+read at all; a file whose stat changed is hashed and the source is only
+regenerated if its content did.
+"""
+
+import hashlib, json, os
+
+CACHE_FILENAME = ".tb_gen_cache.json"
+
+_TOOL_MODULES = ["vLexer.py", "vParser.py", "vhdl.py", "tb_gen.py", "tbSettings.py", "tbTemplate.py", "tbStimulus.py"]
+
+_tool_version = None
+
+def toolVersion():
+    """
+    Hash of the generator sources, so any change to the tool invalidates the
+    cache.
+    """
+    global _tool_version
+    if _tool_version is None:
+        h = hashlib.sha1()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for module in _TOOL_MODULES:
+            with open(os.path.join(directory, module), "rb") as f:
+                h.update(f.read())
+        _tool_version = h.hexdigest()
+    return _tool_version
+
+def toolStamp():
+    """
+    Hash of the stat of the generator sources: unlike toolVersion, it doesn't
+    read them, so a client can cheaply check that a daemon runs the sources
+    it would run itself.
+    """
+    h = hashlib.sha1()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in _TOOL_MODULES:
+        st = os.stat(os.path.join(directory, module))
+        h.update(("%s %d %d\n" % (module, st.st_mtime_ns, st.st_size)).encode())
+    return h.hexdigest()
+
+def hashFile(filename):
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class Cache(object):
+
+    def __init__(self, filename, settings, *keys):
+        """
+        'keys' are strings identifying further inputs of the generator, such
+        as the templates.
+        """
+        self._filename = filename
+        self._settings = hashlib.sha1("\0".join((settings.key(),) + keys).encode()).hexdigest()
+        self._entries = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._filename, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get("version") == toolVersion():
+            self._entries = manifest.get("entries", {})
+
+    def check(self, source):
+        """
+        Returns None if the testbenches of 'source' are up to date, or the
+        state of the source to pass to 'record' once they have been
+        regenerated.
+        """
+        key = os.path.abspath(source)
+        try:
+            st = os.stat(source)
+        except OSError:
+            return {}
+        state = {"mtime": st.st_mtime_ns, "size": st.st_size, "settings": self._settings}
+        entry = self._entries.get(key)
+        if entry is not None and entry["settings"] == self._settings \
+                and all(os.path.isfile(t) for t in entry["testbenches"]) \
+                and self._dependenciesCurrent(entry):
+            if entry["mtime"] == state["mtime"] and entry["size"] == state["size"]:
+                return None
+            state["hash"] = hashFile(source)
+            if entry["hash"] == state["hash"]:
+                self.record(source, state, entry["testbenches"], entry.get("dependencies", ())) # touched, but unchanged
+                return None
+        if "hash" not in state:
+            state["hash"] = hashFile(source)
+        return state
+
+    def _dependenciesCurrent(self, entry):
+        for path, (mtime, size, digest) in entry.get("dependencies", {}).items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+            if (st.st_mtime_ns, st.st_size) == (mtime, size):
+                continue
+            if hashFile(path) != digest:
+                return False
+            entry["dependencies"][path] = [st.st_mtime_ns, st.st_size, digest] # touched, but unchanged
+            self._dirty = True
+        return True
+
+    def dependencies(self, source):
+        """
+        Returns the package files recorded for 'source'.
+        """
+        entry = self._entries.get(os.path.abspath(source))
+        return sorted(entry.get("dependencies", {})) if entry is not None else []
+
+    def testbenches(self, source):
+        """
+        Returns the testbenches recorded for 'source'.
+        """
+        entry = self._entries.get(os.path.abspath(source))
+        return list(entry["testbenches"]) if entry is not None else []
+
+    def record(self, source, state, testbenches, dependencies=()):
+        """
+        Records the 'testbenches' generated from 'source' in 'state' (see
+        check) and the package files 'dependencies' they depend on. When
+        'dependencies' maps the files to the (mtime, size, sha1) they were
+        parsed at, those are recorded, so a file changed meanwhile is not
+        taken as current; other files are stamped now.
+        """
+        if not state:
+            return
+        state["testbenches"] = [os.path.abspath(t) for t in testbenches]
+        state["dependencies"] = {}
+        for path in dependencies:
+            stamp = dependencies[path] if isinstance(dependencies, dict) else None
+            try:
+                if stamp is None:
+                    st = os.stat(path)
+                    stamp = [st.st_mtime_ns, st.st_size, hashFile(path)]
+                state["dependencies"][os.path.abspath(path)] = list(stamp)
+            except OSError:
+                pass # deleted since, the next check will regenerate
+        self._entries[os.path.abspath(source)] = state
+        self._dirty = True
+
+    def forget(self, source):
+        if self._entries.pop(os.path.abspath(source), None) is not None:
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        tmp = self._filename + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": toolVersion(), "entries": self._entries}, f, separators=(",", ":"))
+        os.replace(tmp, self._filename)
+        self._dirty = False
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbClient
+========
+
+Fast path of ``tb_gen.py`` for a single file: when a daemon is running (see
+tbDaemon), the file is handed to it before the generator is imported, so a
+run costs little more than interpreter startup. Only the standard library,
+tbCache and the client functions of tbDaemon are imported, and the daemon
+checks and records the tbCache manifest itself.
+
+Any option the daemon can't serve (prompts, profiling, depfiles, batches,
+...) and any error, including no daemon listening, leaves the run to the
+full command line.
+"""
+
+import argparse, os
+
+import tbDaemon
+from tbCache import CACHE_FILENAME, toolStamp
+
+class _Parser(argparse.ArgumentParser):
+
+    def error(self, message):
+        raise ValueError(message)
+
+def _parser():
+    # The options of tb_gen.py that a daemon request carries; abbreviations
+    # are left to the full command line, which knows all of the options
+    parser = _Parser(add_help=False, allow_abbrev=False)
+    parser.add_argument("paths", nargs="*")
+    parser.add_argument("-s", "--settings")
+    parser.add_argument("--clock-period", type=int)
+    parser.add_argument("--reset-cycles", type=int)
+    parser.add_argument("--reset-polarity", choices=["auto", "low", "high"])
+    parser.add_argument("--clock")
+    parser.add_argument("--reset")
+    parser.add_argument("--templates")
+    parser.add_argument("--stimulus", choices=["none", "exhaustive", "random"])
+    parser.add_argument("--vectors", type=int)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--headers-only", action="store_true")
+    parser.add_argument("--cache", default=CACHE_FILENAME)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--socket")
+    return parser
+
+def run(argv):
+    """
+    Has a running daemon generate the testbenches of the command line
+    'argv' of tb_gen.py. Returns the exit status, or None if the run is left
+    to the full command line.
+    """
+    try:
+        args, unknown = _parser().parse_known_args(argv)
+    except ValueError:
+        return None
+    # vParser.SOURCE_EXTENSIONS, without importing the parser
+    if unknown or len(args.paths) != 1 or not args.paths[0].lower().endswith((".vhd", ".vhdl")) \
+            or not os.path.isfile(args.paths[0]):
+        return None
+
+    try:
+        version = toolStamp()
+    except OSError:
+        return None
+    reply = tbDaemon.request({
+        "op": "generate",
+        "cwd": os.getcwd(),
+        "path": args.paths[0],
+        "version": version,
+        "settings": args.settings,
+        "overrides": {
+            "clock_period": args.clock_period,
+            "reset_cycles": args.reset_cycles,
+            "reset_polarity": args.reset_polarity,
+            "clock": args.clock,
+            "reset": args.reset,
+            "templates": args.templates,
+            "stimulus": args.stimulus,
+            "stimulus_vectors": args.vectors,
+            "stimulus_seed": args.seed,
+        },
+        "headers_only": args.headers_only,
+        "cache": None if args.no_cache else args.cache,
+    }, args.socket)
+    if reply is None or reply["version"] != version:
+        return None
+
+    if reply["messages"]:
+        print(reply["messages"])
+    if not reply["ok"]:
+        return 1
+    if reply["up_to_date"]:
+        for vhdl_filename in reply["testbenches"]:
+            print("The file '%s' is up to date." % os.path.relpath(vhdl_filename))
+        return 0
+    print()
+    for vhdl_filename in reply["testbenches"]:
+        print("The file '%s' was created successfully." % vhdl_filename)
+    return 0
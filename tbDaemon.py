@@ -0,0 +1,310 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbDaemon
+========
+
+Resident generator for editor-on-save integration. The server listens on a
+Unix socket and keeps the parsed files and the rendered testbenches in
+memory, so a request for an unchanged file costs neither interpreter startup
+nor parsing::
+
+    python tbDaemon.py serve &
+    python tb_gen.py my_file.vhd      # uses the daemon while it runs
+    python tbDaemon.py stop
+
+Requests and replies are JSON objects, one per line. Every reply holds
+``ok``, ``version`` (the tbCache.toolStamp of the server) and ``messages``
+(what the generator printed). The operations are:
+
+- ``{"op": "ping"}``
+- ``{"op": "stop"}``
+- ``{"op": "parse", "cwd": dir, "path": file, "headers_only": bool}``:
+  replies with the ``entities`` of the file
+- ``{"op": "generate", "cwd": dir, "path": file, "version": v,
+  "settings": file or null, "overrides": {...}, "headers_only": bool,
+  "cache": file or null}``:
+  writes the testbenches of the file and their vector files and replies
+  with their names as ``testbenches``, the names of those that changed
+  as ``written`` and the files of the work packages the source uses as
+  ``dependencies``, each with the (mtime, size, sha1) it was parsed at.
+  With a ``cache``, the server checks and records the file in that
+  tbCache manifest like the command line would, and ``up_to_date`` tells
+  whether the testbenches were left alone.
+  Instead of ``path``,
+  ``entity`` and ``paths`` name an entity to resolve through the index
+  ``index``. Requests of another version are refused, so clients never get
+  the output of an outdated server.
+
+Only the client functions (``defaultSocket`` and ``request``) are needed to
+talk to a server, and they don't import the generator.
+"""
+
+import io, json, os, socket, sys, tempfile
+from collections import OrderedDict
+from contextlib import redirect_stdout
+
+DEFAULT_MAX_ENTRIES = 256
+
+def defaultSocket():
+    """
+    Returns the socket path from $TB_GEN_SOCKET, or a per-user path in the
+    temporary directory.
+    """
+    return os.environ.get("TB_GEN_SOCKET") or os.path.join(tempfile.gettempdir(), "tb_gen-%d.sock" % os.getuid())
+
+def request(message, socket_path=None, timeout=60.0):
+    """
+    Sends 'message' to the server and returns its reply, or None if no
+    server is listening on 'socket_path'.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(socket_path or defaultSocket())
+        except OSError:
+            return None
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+        return json.loads(line) if line else None
+    finally:
+        sock.close()
+
+class _Lru(object):
+    """
+    Mapping that keeps its 'size' most recently used entries.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+
+    def discard(self, predicate):
+        for key in [k for k in self._entries if predicate(k)]:
+            del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+class Server(object):
+
+    def __init__(self, socket_path=None, max_entries=DEFAULT_MAX_ENTRIES):
+        import tb_gen, tbCache, tbIndex, vParser
+        self._tb_gen, self._tbCache, self._tbIndex, self._vParser = tb_gen, tbCache, tbIndex, vParser
+        self._version = tbCache.toolStamp()
+        self._socket_path = socket_path or defaultSocket()
+        self._models = _Lru(max_entries)    # (path, mtime, size, headers_only) -> (model, detection, package stamps)
+        self._outputs = _Lru(max_entries)   # (model key, settings, templates, entity, testbench) -> [(filename, content)]
+        self._indexes = {}
+        self._running = False
+
+    def serve(self):
+        """
+        Handles requests one at a time until a stop request.
+        """
+        if request({"op": "ping"}, self._socket_path, 1.0) is not None:
+            raise OSError("a server is already listening on '%s'" % self._socket_path)
+        if os.path.exists(self._socket_path):
+            os.remove(self._socket_path) # left over by a server that died
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(self._socket_path)
+            os.chmod(self._socket_path, 0o600)
+            sock.listen(16)
+            self._running = True
+            while self._running:
+                conn, _ = sock.accept()
+                with conn:
+                    self._handle(conn)
+        finally:
+            sock.close()
+            if os.path.exists(self._socket_path):
+                os.remove(self._socket_path)
+            for index in self._indexes.values():
+                index.close()
+
+    def _handle(self, conn):
+        with conn.makefile("rb") as f:
+            line = f.readline()
+        try:
+            message = json.loads(line)
+        except ValueError:
+            message = {}
+        conn.sendall(json.dumps(self.handle(message)).encode() + b"\n")
+
+    def handle(self, message):
+        """
+        Runs the request 'message' and returns the reply.
+        """
+        reply = {"ok": False, "version": self._version, "messages": ""}
+        op = message.get("op")
+        if op == "generate" and message.get("version") != self._version:
+            reply["messages"] = "error: the server runs another version of the generator"
+            return reply
+
+        out = io.StringIO()
+        cwd = os.getcwd()
+        with redirect_stdout(out):
+            try:
+                # requests are handled one at a time, so relative paths and
+                # settings files can be resolved like the client would
+                os.chdir(message.get("cwd", cwd))
+                if op == "ping":
+                    reply.update(pid=os.getpid(), models=len(self._models), outputs=len(self._outputs))
+                elif op == "stop":
+                    self._running = False
+                elif op == "parse":
+                    model = self._model(message["path"], message.get("headers_only", False))[1]
+                    reply["entities"] = [entityInterface(e) for e in model.getEntities()]
+                elif op == "generate":
+                    reply.update(self._generate(message))
+                else:
+                    raise ValueError("unknown request '%s'" % op)
+                reply["ok"] = True
+            except SystemExit:
+                pass
+            except Exception as e:
+                print("error: %s" % e)
+            finally:
+                os.chdir(cwd)
+        reply["messages"] = out.getvalue().strip()
+        return reply
+
+    def _model(self, path, headers_only):
+        """
+        Returns the cache key and the parsed model of 'path', parsing it only
+        if it or one of its package files changed. The key ends with the
+        stamps of the package files (see tb_gen.packageStamps). The model
+        comes with the clock and reset detection of the parser, as applying
+        settings overwrites it.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size, headers_only)
+        entry = self._models.get(key)
+        if entry is None or not self._packagesCurrent(entry[0]):
+            self._models.discard(lambda k: k[0] == path)
+            self._outputs.discard(lambda k: k[0][0] == path)
+            model = self._tb_gen.parseFile(path, headers_only)
+            stamps = self._tb_gen.packageStamps(model)
+            entry = (model, [(e, e.clk, e.rst, e.rstActiveLow) for e in model.getEntities()],
+                     tuple(sorted((p, tuple(s)) for p, s in stamps.items())))
+            self._models.put(key, entry)
+        for entity, clk, rst, rst_active_low in entry[1]:
+            entity.clk, entity.rst, entity.rstActiveLow = clk, rst, rst_active_low
+        return key + (entry[2],), entry[0]
+
+    def _packagesCurrent(self, model):
+        """
+        Returns whether the packages 'model' was resolved with are still
+        those of their files. The package cache only reparses a file whose
+        content changed.
+        """
+        for package in model.getPackages():
+            if package.getPath() is None:
+                continue
+            try:
+                current = self._vParser.package_cache.packagesOf(package.getPath())
+            except OSError:
+                return False
+            if current.get(package.getName().lower()) is not package:
+                return False
+        return True
+
+    def _generate(self, message):
+        tb_gen = self._tb_gen
+        path = message.get("path")
+        if path is None:
+            index_path = os.path.abspath(message.get("index", self._tbIndex.INDEX_FILENAME))
+            index = self._indexes.get(index_path)
+            if index is None:
+                index = self._indexes[index_path] = self._tbIndex.Index(index_path)
+            record = self._tbIndex.resolveEntity(index, message["entity"], message.get("paths") or ["."])
+            if record is None:
+                raise ValueError("no entity '%s' was found" % message["entity"])
+            path = record.path
+
+        run_settings = tb_gen.loadSettings(message.get("settings"), message.get("overrides"))
+        templates = tb_gen.loadTemplates(run_settings.get("templates"))
+        cache, state = None, {}
+        if message.get("cache"):
+            cache = self._tbCache.Cache(message["cache"], run_settings, templates.key())
+            state = cache.check(path)
+            if state is None:
+                cache.save() # touched files are restamped
+                return {"testbenches": cache.testbenches(path), "written": [], "up_to_date": True,
+                        "dependencies": cache.dependencies(path)}
+        key, model = self._model(path, message.get("headers_only", False))
+        testbenches, written = [], []
+        tb_gen.useModel(model, run_settings)
+        for entity, testbench in tb_gen.testbenchFilenames(path, model):
+            output_key = (key, run_settings.key(), templates.key(), entity.getName(), testbench)
+            outputs = self._outputs.get(output_key)
+            if outputs is None:
+                outputs = tb_gen.renderOutputs(entity, testbench)
+                self._outputs.put(output_key, outputs)
+            for filename, content in outputs:
+                testbenches.append(filename)
+                if tb_gen.write_file(filename, content):
+                    written.append(filename)
+        dependencies = dict(key[-1])
+        if cache is not None:
+            cache.record(path, state, testbenches, dependencies)
+            cache.save()
+        return {"testbenches": testbenches, "written": written, "up_to_date": False, "dependencies": dependencies}
+
+def entityInterface(entity):
+    """
+    Returns the interface of 'entity' as a JSON-serializable dict.
+    """
+    return {
+        "name": entity.getName(),
+        "ports": [[p.getName(), p.getPortType(), p.getType()] for p in entity.getPorts().values()],
+        "generics": [[g.getName(), g.getType(), g.getValue()] for g in entity.getGenerics().values()],
+        "clk": entity.clk,
+        "rst": entity.rst,
+        "rst_active_low": entity.rstActiveLow,
+    }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Resident VHDL testbench generator.")
+    parser.add_argument("command", choices=["serve", "stop", "status"])
+    parser.add_argument("--socket", metavar="PATH",
+                        help="socket to listen on or connect to (default: $TB_GEN_SOCKET or %s)" % defaultSocket())
+    parser.add_argument("--max-entries", type=int, default=DEFAULT_MAX_ENTRIES, metavar="N",
+                        help="parsed files and testbenches kept in memory (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            Server(args.socket, args.max_entries).serve()
+        except KeyboardInterrupt:
+            pass
+        except OSError as e:
+            print("error: %s" % e)
+            sys.exit(1)
+        sys.exit(0)
+
+    reply = request({"op": "ping" if args.command == "status" else "stop"}, args.socket)
+    if reply is None:
+        print("No server is listening on '%s'." % (args.socket or defaultSocket()))
+        sys.exit(1)
+    if args.command == "status":
+        print("Server %d: %d files and %d testbenches in memory." % (reply["pid"], reply["models"], reply["outputs"]))
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbDepfile
+=========
+
+Dependency information for Make and Ninja. Next to every testbench, a
+``.d`` depfile lists the testbench and its vector file as targets of the
+source, the files of the work packages it uses, the settings file and the
+templates::
+
+    tb_alu.vhd tb_alu.vec: alu.vhd alu_pkg.vhd tb_gen.ini
+
+    alu_pkg.vhd:
+
+    tb_gen.ini:
+
+The prerequisites other than the source are also listed as targets without
+recipes, so Make doesn't fail once one of them is deleted. A manifest holds
+the same information for a whole run as JSON.
+"""
+
+import glob, json, os
+
+from tbCache import toolVersion
+from tbTemplate import BUILTIN, TEMPLATE_EXTENSION
+from vParser import write_file
+
+def inputFiles(settings_file, templates):
+    """
+    Returns the files every testbench depends on: the settings file, if
+    any, and the templates of the directory 'templates'.
+    """
+    files = [settings_file] if settings_file else []
+    if templates not in (None, BUILTIN):
+        files += sorted(glob.glob(os.path.join(templates, "*" + TEMPLATE_EXTENSION)))
+    return files
+
+def _path(path):
+    """
+    Returns 'path' relative to the current directory, unless it is outside
+    of it.
+    """
+    relative = os.path.relpath(path)
+    return path if relative.startswith(os.pardir) else relative
+
+def _escape(path):
+    return path.replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+
+def groupOutputs(outputs):
+    """
+    Splits the testbenches and vector files of a source, each vector file
+    listed after its testbench, into one list per testbench.
+    """
+    groups = []
+    for filename in outputs:
+        if filename.endswith(".vhd") or not groups:
+            groups.append([])
+        groups[-1].append(filename)
+    return groups
+
+def depfileName(testbench):
+    return os.path.splitext(testbench)[0] + ".d"
+
+def depfile(targets, source, prerequisites):
+    """
+    Returns the text of the depfile of the files 'targets' generated from
+    'source', which also depend on the files 'prerequisites'.
+    """
+    lines = ["%s: %s\n" % (" ".join(_escape(_path(t)) for t in targets),
+                           " ".join(_escape(_path(p)) for p in [source] + prerequisites))]
+    for p in prerequisites:
+        lines.append("\n%s:\n" % _escape(_path(p)))
+    return "".join(lines)
+
+def writeDepfiles(source, outputs, packages, inputs):
+    """
+    Writes the depfile of every testbench in 'outputs', generated from
+    'source' using the package files 'packages' and the files 'inputs' (see
+    inputFiles). Returns their names.
+    """
+    prerequisites = sorted(set(packages)) + [f for f in inputs if f not in packages]
+    written = []
+    for group in groupOutputs(outputs):
+        write_file(depfileName(group[0]), depfile(group, source, prerequisites))
+        written.append(depfileName(group[0]))
+    return written
+
+def manifestEntries(source, outputs, packages, settings_file):
+    """
+    Returns the manifest entries of the testbenches in 'outputs', generated
+    from 'source'.
+    """
+    entries = []
+    for group in groupOutputs(outputs):
+        entries.append({
+            "testbench": _path(group[0]),
+            "outputs": [_path(f) for f in group],
+            "source": _path(source),
+            "packages": [_path(p) for p in sorted(set(packages))],
+            "settings": _path(settings_file) if settings_file else None,
+        })
+    return entries
+
+def writeManifest(filename, entries, templates=()):
+    """
+    Writes the manifest 'entries' of a run, along with the 'templates' files
+    all of them depend on.
+    """
+    write_file(filename, json.dumps({
+        "version": toolVersion(),
+        "templates": [_path(t) for t in templates],
+        "testbenches": entries,
+    }, indent=1) + "\n")
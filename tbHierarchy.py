@@ -0,0 +1,332 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbHierarchy
+===========
+
+Design hierarchy of a source tree: which architecture instantiates which
+entity or component. Every file is parsed on its own, on a process pool,
+into its entities, packages, component declarations and instantiation
+statements (including those nested in generate statements), and the results
+are merged into a Hierarchy indexed by entity name. It tells the top-level
+entities, the entities that depend on a given one, and an order to analyze
+the files in.
+
+Components are bound by name to the entity of the same name, as the default
+binding does. Instances no source declares an entity for, such as vendor
+primitives or configurations, are kept as unresolved.
+"""
+
+import heapq, json, mmap, os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import vParser
+from vhdl import Architecture, Entity, Package, VHDLError, collecting
+from vParser import map_file
+
+# 'packages' are (name, component names) and 'uses' the work packages the
+# file uses; 'error' is the message of a file that can't be parsed
+DesignFile = namedtuple("DesignFile", ["path", "entities", "packages", "uses", "architectures", "error"])
+# 'instances' are vParser.Instances
+DesignArchitecture = namedtuple("DesignArchitecture", ["name", "entity", "components", "instances"])
+# the instance 'instance' of the architecture 'architecture' of 'parent',
+# declared in 'path'
+Edge = namedtuple("Edge", ["parent", "architecture", "instance", "path"])
+
+def scanFile(path):
+    """
+    Returns the DesignFile of 'path'.
+    """
+    source = None
+    entities, packages, uses, architectures = [], [], set(), []
+    with collecting():
+        try:
+            source = map_file(path)
+            for kind, value in vParser.designUnits(source):
+                if kind == "entity":
+                    entities.append(value.getName())
+                elif kind == "use":
+                    uses.update(u.split(".")[1] for u in value if u.startswith("work.") and u.count(".") >= 2)
+                elif kind == "package":
+                    name, region = value
+                    package = Package(name, path)
+                    if region is not None:
+                        package.setDeclarations(*region)
+                    packages.append((name, sorted(package.getComponents())))
+                elif kind == "architecture":
+                    name, entity, region = value
+                    components, instances = [], []
+                    if region is not None:
+                        arch = Architecture(name, Entity(entity))
+                        arch.setDeclarations(*region)
+                        components = sorted(arch.getComponents())
+                        instances = vParser.architectureInstances(region[0], region[2])
+                    architectures.append(DesignArchitecture(name, entity, components, instances))
+        except VHDLError as e:
+            return DesignFile(path, [], [], [], [], str(e))
+        finally:
+            if isinstance(source, mmap.mmap):
+                source.close()
+    return DesignFile(path, entities, packages, sorted(uses), architectures, None)
+
+def _topological(nodes, dependencies):
+    """
+    Returns 'nodes' ordered so that each comes after its 'dependencies'
+    (node -> set of nodes), ties broken by name. Nodes on a cycle come last,
+    by name.
+    """
+    waiting = dict((n, set(d for d in dependencies.get(n, ()) if d in nodes and d != n)) for n in nodes)
+    needed_by = {}
+    for node, deps in waiting.items():
+        for d in deps:
+            needed_by.setdefault(d, []).append(node)
+    ready = [n for n, deps in waiting.items() if not deps]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        node = heapq.heappop(ready)
+        order.append(node)
+        for user in needed_by.get(node, ()):
+            waiting[user].discard(node)
+            if not waiting[user]:
+                heapq.heappush(ready, user)
+    done = set(order)
+    return order + sorted(n for n in nodes if n not in done)
+
+class Hierarchy(object):
+    """
+    Instance graph of a set of DesignFiles. Entities are looked up by name,
+    case insensitively; when several files declare the same entity or
+    package, the first one added wins.
+    """
+
+    def __init__(self):
+        self._entities = {}     # key -> (name, path)
+        self._packages = {}     # key -> (name, path)
+        self._components = {}   # key -> [(path, architecture or package name)]
+        self._archs = {}        # key -> [architecture names]
+        self._instances = {}    # parent key -> [Edge]
+        self._users = {}        # child key -> set of parent keys
+        self._uses = {}         # path -> set of package keys
+        self.errors = {}        # path -> message
+
+    def add(self, design):
+        """
+        Merges the DesignFile 'design' into the graph.
+        """
+        if design.error is not None:
+            self.errors[design.path] = design.error
+            return
+        for name in design.entities:
+            self._entities.setdefault(name.lower(), (name, design.path))
+        for name, components in design.packages:
+            self._packages.setdefault(name.lower(), (name, design.path))
+            for c in components:
+                self._components.setdefault(c.lower(), []).append((design.path, name))
+        self._uses.setdefault(design.path, set()).update(u.lower() for u in design.uses)
+        for arch in design.architectures:
+            parent = arch.entity.lower()
+            self._archs.setdefault(parent, []).append(arch.name)
+            for c in arch.components:
+                self._components.setdefault(c.lower(), []).append((design.path, arch.name))
+            for instance in arch.instances:
+                self._instances.setdefault(parent, []).append(Edge(arch.entity, arch.name, instance, design.path))
+                self._users.setdefault(instance.name.lower(), set()).add(parent)
+
+    def entities(self, path=None):
+        """
+        Returns the names of the entities, or of those declared in 'path'.
+        """
+        return sorted(name for name, p in self._entities.values() if path is None or p == path)
+
+    def path(self, name):
+        """
+        Returns the file declaring the entity 'name', or None.
+        """
+        entry = self._entities.get(name.lower())
+        return entry[1] if entry is not None else None
+
+    def _name(self, key):
+        return self._entities[key][0] if key in self._entities else key
+
+    def isResolved(self, instance):
+        """
+        Tells whether the vParser.Instance 'instance' is bound to an entity
+        of the graph.
+        """
+        if instance.kind == "configuration":
+            return False
+        return instance.name.lower() in self._entities and instance.library in (None, "work")
+
+    def instances(self, name):
+        """
+        Returns the Edges of the instances of the architectures of 'name'.
+        """
+        return list(self._instances.get(name.lower(), ()))
+
+    def components(self, name):
+        """
+        Returns where the component 'name' is declared, as (path,
+        architecture or package name) pairs.
+        """
+        return list(self._components.get(name.lower(), ()))
+
+    def unresolved(self):
+        """
+        Returns the Edges of the instances no entity is known for.
+        """
+        return [e for key in sorted(self._instances) for e in self._instances[key] if not self.isResolved(e.instance)]
+
+    def users(self, name):
+        """
+        Returns the names of the entities instantiating 'name' directly.
+        """
+        return sorted(self._name(k) for k in self._users.get(name.lower(), ()) if k != name.lower())
+
+    def dependents(self, name):
+        """
+        Returns the names of the entities instantiating 'name' directly or
+        through other entities, nearest first.
+        """
+        seen, queue, result = set([name.lower()]), [name.lower()], []
+        while queue:
+            for user in sorted(self._users.get(queue.pop(0), ())):
+                if user not in seen:
+                    seen.add(user)
+                    queue.append(user)
+                    result.append(self._name(user))
+        return result
+
+    def tops(self):
+        """
+        Returns the names of the entities with an architecture that no other
+        entity instantiates.
+        """
+        return sorted(name for key, (name, _) in self._entities.items()
+                      if key in self._archs and not (self._users.get(key, set()) - set([key])))
+
+    def order(self):
+        """
+        Returns the names of the entities, each after the entities it
+        instantiates.
+        """
+        dependencies = dict((key, set(e.instance.name.lower() for e in edges if self.isResolved(e.instance)))
+                            for key, edges in self._instances.items())
+        return [self._name(k) for k in _topological(set(self._entities), dependencies)]
+
+    def fileDependencies(self):
+        """
+        Returns the files of the graph mapped to the files declaring the
+        packages they use and the entities they instantiate (other than
+        themselves).
+        """
+        dependencies = dict((path, set()) for _, path in self._entities.values())
+        dependencies.update((path, set()) for _, path in self._packages.values())
+        for path, uses in self._uses.items():
+            dependencies.setdefault(path, set()).update(self._packages[u][1] for u in uses if u in self._packages)
+        for edges in self._instances.values():
+            for e in edges:
+                if self.isResolved(e.instance):
+                    dependencies.setdefault(e.path, set()).add(self._entities[e.instance.name.lower()][1])
+        for path, files in dependencies.items():
+            files.discard(path)
+        return dependencies
+
+    def analysisOrder(self):
+        """
+        Returns the files of the graph in an order they can be analyzed in:
+        each after the files it depends on (see fileDependencies).
+        """
+        dependencies = self.fileDependencies()
+        return _topological(set(dependencies), dependencies)
+
+    def asDict(self):
+        return {
+            "entities": dict((name, {
+                "path": path,
+                "architectures": self._archs.get(key, []),
+                "instances": [dict(e.instance._asdict(), architecture_of_parent=e.architecture,
+                                   resolved=self.isResolved(e.instance)) for e in self.instances(key)],
+                "users": self.users(key),
+            }) for key, (name, path) in sorted(self._entities.items())),
+            "packages": dict((name, path) for name, path in sorted(self._packages.values())),
+            "tops": self.tops(),
+            "order": self.analysisOrder(),
+            "errors": self.errors,
+        }
+
+def build(sources, jobs=None):
+    """
+    Parses the files 'sources' on 'jobs' processes and returns their
+    Hierarchy. Files are merged in the order given.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(sources) <= 1:
+        designs = [scanFile(s) for s in sources]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            designs = list(pool.map(scanFile, sources, chunksize=max(1, len(sources) // (jobs * 4))))
+    hierarchy = Hierarchy()
+    for design in designs:
+        hierarchy.add(design)
+    return hierarchy
+
+def printTree(hierarchy, name, out, indent="", seen=()):
+    """
+    Prints the instances under the entity 'name', recursively.
+    """
+    seen = set(seen) | set([name.lower()])
+    for e in hierarchy.instances(name):
+        label = ".".join(e.instance.scope + (e.instance.label,))
+        child = e.instance.name
+        if not hierarchy.isResolved(e.instance):
+            out.write("%s    %s: %s (unresolved)\n" % (indent, label, child))
+        elif child.lower() in seen:
+            out.write("%s    %s: %s (recursive)\n" % (indent, label, child))
+        else:
+            out.write("%s    %s: %s\n" % (indent, label, child))
+            printTree(hierarchy, child, out, indent + "    ", seen)
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import tbBatch
+
+    parser = argparse.ArgumentParser(description="Print the design hierarchy of a VHDL source tree.")
+    parser.add_argument("paths", nargs="*", default=["."], metavar="PATH",
+                        help="VHDL file, directory or glob pattern (default: .)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: %(default)s)")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--tops", action="store_true",
+                       help="print the top-level entities")
+    group.add_argument("--users", metavar="ENTITY",
+                       help="print the entities that instantiate ENTITY, directly or not")
+    group.add_argument("--order", action="store_true",
+                       help="print the files in analysis order")
+    group.add_argument("--json", action="store_true",
+                       help="print the whole graph as JSON")
+    args = parser.parse_args()
+
+    hierarchy = build(tbBatch.findSources(args.paths), args.jobs)
+    for path, message in sorted(hierarchy.errors.items()):
+        print("error: %s: %s" % (path, message), file=sys.stderr)
+
+    if args.tops:
+        print("\n".join(hierarchy.tops()))
+    elif args.users:
+        if hierarchy.path(args.users) is None and not hierarchy.users(args.users):
+            print("error: no entity '%s' was found" % args.users)
+            sys.exit(1)
+        print("\n".join(hierarchy.dependents(args.users)))
+    elif args.order:
+        print("\n".join(hierarchy.analysisOrder()))
+    elif args.json:
+        print(json.dumps(hierarchy.asDict(), indent=1))
+    else:
+        for top in hierarchy.tops():
+            print(top)
+            printTree(hierarchy, top, sys.stdout)
+    sys.exit(1 if hierarchy.errors else 0)
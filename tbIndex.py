@@ -0,0 +1,282 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbIndex
+=======
+
+Project-wide index of the entities of a source tree, kept in a SQLite
+database: for every entity, the file and byte offset it is declared at, its
+ports, generics, detected clock and reset, and the names of its
+architectures. The types of the ports and generics are also stored
+resolved through the work packages the file uses, which are looked up in
+its directory like the generator does. Updating the index only reparses the
+files whose stat and content, or whose package files, changed, and looking
+an entity up does not touch the tree at all unless one of them changed.
+"""
+
+import io, json, mmap, os, sqlite3
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+import tbBatch, tbStimulus, vParser
+from vhdl import VHDLError
+from vParser import map_file
+from tbCache import toolVersion, hashFile
+
+INDEX_FILENAME = ".tb_gen_index.db"
+
+# bumped when the tables or the records change
+_FORMAT = 2
+
+# ports are (name, mode, type, default, resolved type) and generics (name,
+# type, default, resolved type), see tbStimulus.resolveType
+EntityRecord = namedtuple("EntityRecord", ["name", "path", "offset", "ports", "generics",
+                                           "clk", "rst", "rst_active_low", "architectures"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, hash TEXT, dependencies TEXT);
+CREATE TABLE IF NOT EXISTS entities (
+    key TEXT, name TEXT, path TEXT, offset INTEGER, ports TEXT, generics TEXT,
+    clk TEXT, rst TEXT, rst_active_low INTEGER, architectures TEXT
+);
+CREATE INDEX IF NOT EXISTS entities_key ON entities (key);
+CREATE INDEX IF NOT EXISTS entities_path ON entities (path);
+"""
+
+def _scan(path):
+    """
+    Returns the EntityRecords of the entities 'path' declares, or None if it
+    can't be parsed, and the (mtime, size, sha1) of the other files of the
+    packages their types were resolved with, by file.
+    """
+    source = None
+    entities, packages, architectures = [], [], {}
+    out = io.StringIO()
+    with redirect_stdout(out):
+        try:
+            source = map_file(path)
+            for kind, value, offset in vParser.designUnits(source, headers_only=True, offsets=True):
+                if kind == "entity":
+                    entities.append((value, offset))
+                elif kind == "use":
+                    packages += [u.split(".")[1] for u in value if u.lower().startswith("work.") and u.count(".") >= 2]
+                elif kind == "architecture":
+                    architectures.setdefault(value[1].lower(), []).append(value[0])
+        except VHDLError:
+            return None, {}
+        finally:
+            if isinstance(source, mmap.mmap):
+                source.close()
+
+        constants, types, dependencies = {}, {}, {}
+        for name in packages:
+            package = vParser.package_cache.find(name, [os.path.dirname(path)])
+            if package is None:
+                continue
+            constants = tbStimulus.constantValues(package.getConstants().values(), constants)
+            types.update((t.lower(), d) for t, d in package.getTypes().items())
+            if os.path.abspath(package.getPath()) != os.path.abspath(path):
+                dependencies[package.getPath()] = list(package.getStamp())
+
+    records = []
+    for entity, offset in entities:
+        ports = [(p.getName(), p.getPortType(), p.getType(), p.getValue(),
+                  tbStimulus.resolveType(p.getType(), constants, types)) for p in entity.getPorts().values()]
+        generics = [(g.getName(), g.getType(), g.getValue(),
+                     tbStimulus.resolveType(g.getType(), constants, types)) for g in entity.getGenerics().values()]
+        records.append(EntityRecord(entity.getName(), path, offset, ports, generics, entity.clk, entity.rst,
+                                    entity.rstActiveLow, architectures.get(entity.getName().lower(), [])))
+    return records, dependencies
+
+def entityRecords(path):
+    """
+    Returns the EntityRecords of the entities 'path' declares, or None if it
+    can't be parsed.
+    """
+    return _scan(path)[0]
+
+def scanFile(path):
+    """
+    Returns the hash of 'path', its EntityRecords (see entityRecords) and
+    the stamps of the package files they depend on.
+    """
+    return (hashFile(path),) + _scan(path)
+
+def scanInterfaces(sources, jobs=1):
+    """
+    Yields the files 'sources' with their EntityRecords (see entityRecords),
+    in order, parsed on 'jobs' processes. Each file is yielded as soon as it
+    and the files before it are parsed, so the first results of a big tree
+    come early.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(sources) <= 1:
+        for path in sources:
+            yield path, entityRecords(path)
+        return
+    pool = ProcessPoolExecutor(max_workers=jobs)
+    try:
+        yield from zip(sources, pool.map(entityRecords, sources, chunksize=max(1, min(16, len(sources) // (jobs * 4)))))
+    finally:
+        pool.shutdown(cancel_futures=True) # when the caller stops early
+
+class Index(object):
+
+    def __init__(self, filename=INDEX_FILENAME):
+        self._db = sqlite3.connect(filename)
+        self._db.executescript(_SCHEMA)
+        version = "%s/%d" % (toolVersion(), _FORMAT)
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != version:
+            # entries of another generator version may have been parsed differently
+            with self._db:
+                self._db.execute("DROP TABLE files")
+                self._db.execute("DROP TABLE entities")
+            self._db.executescript(_SCHEMA)
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _stale(self, path, st):
+        """
+        Returns None if the entry of 'path' matches the stat 'st', False if
+        only the stat changed and True if 'path' was never indexed or one of
+        its package files changed.
+        """
+        row = self._db.execute("SELECT mtime, size, dependencies FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return True
+        for dependency, (mtime, size, digest) in json.loads(row[2]).items():
+            try:
+                dst = os.stat(dependency)
+            except OSError:
+                return True
+            if (dst.st_mtime_ns, dst.st_size) != (mtime, size) and hashFile(dependency) != digest:
+                return True
+        if row[:2] == (st.st_mtime_ns, st.st_size):
+            return None
+        return False
+
+    def update(self, sources, jobs=1):
+        """
+        Brings the index up to date with the files 'sources' and drops the
+        files that no longer exist. Files whose stat is unchanged are not
+        read; files whose content is unchanged are not parsed. Returns the
+        number of files parsed.
+        """
+        pending, stats = [], {}
+        for source in sources:
+            path = os.path.abspath(source)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stale = self._stale(path, st)
+            if stale is None:
+                continue
+            stats[path] = st
+            if stale is False:
+                row = self._db.execute("SELECT hash FROM files WHERE path = ?", (path,)).fetchone()
+                if row[0] == hashFile(path):
+                    with self._db: # touched, but unchanged
+                        self._db.execute("UPDATE files SET mtime = ?, size = ? WHERE path = ?",
+                                         (st.st_mtime_ns, st.st_size, path))
+                    continue
+            pending.append(path)
+
+        jobs = jobs or os.cpu_count() or 1
+        if jobs == 1 or len(pending) <= 1:
+            scanned = [scanFile(p) for p in pending]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                scanned = list(pool.map(scanFile, pending, chunksize=max(1, len(pending) // (jobs * 4))))
+
+        with self._db:
+            for path, (digest, records, dependencies) in zip(pending, scanned):
+                self._db.execute("DELETE FROM entities WHERE path = ?", (path,))
+                st = stats[path]
+                self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                                 (path, st.st_mtime_ns, st.st_size, digest, json.dumps(dependencies)))
+                for r in records or []:
+                    self._db.execute("INSERT INTO entities VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                     (r.name.lower(), r.name, path, r.offset, json.dumps(r.ports),
+                                      json.dumps(r.generics), r.clk, r.rst, int(r.rst_active_low),
+                                      json.dumps(r.architectures)))
+            for (path,) in self._db.execute("SELECT path FROM files").fetchall():
+                if not os.path.isfile(path):
+                    self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+                    self._db.execute("DELETE FROM entities WHERE path = ?", (path,))
+        return len(pending)
+
+    def lookup(self, name):
+        """
+        Returns the EntityRecords of the entities called 'name' (case
+        insensitive), ordered by path.
+        """
+        rows = self._db.execute("SELECT name, path, offset, ports, generics, clk, rst, rst_active_low, architectures "
+                                "FROM entities WHERE key = ? ORDER BY path", (name.lower(),)).fetchall()
+        return [EntityRecord(r[0], r[1], r[2], [tuple(p) for p in json.loads(r[3])],
+                             [tuple(g) for g in json.loads(r[4])], r[5], r[6], bool(r[7]), json.loads(r[8]))
+                for r in rows]
+
+    def isCurrent(self, path):
+        """
+        Tells whether the indexed entry of 'path' matches the file on disk.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return self._stale(os.path.abspath(path), st) is None
+
+    def entities(self):
+        return [r[0] for r in self._db.execute("SELECT name FROM entities ORDER BY key")]
+
+def resolveEntity(index, name, paths, jobs=1):
+    """
+    Returns the EntityRecord of the entity 'name', updating the index with the
+    sources under 'paths' only if it is unknown or its file changed. Returns
+    None if no file declares it; when several do, the first by path wins.
+    """
+    records = index.lookup(name)
+    if not records or not all(index.isCurrent(r.path) for r in records):
+        index.update(tbBatch.findSources(paths), jobs)
+        records = index.lookup(name)
+    return records[0] if records else None
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Index the entities of a VHDL source tree.")
+    parser.add_argument("paths", nargs="*", default=["."], metavar="PATH",
+                        help="VHDL file, directory or glob pattern (default: .)")
+    parser.add_argument("-e", "--entity", metavar="NAME",
+                        help="print the indexed interface of an entity as JSON")
+    parser.add_argument("--index", metavar="FILE", default=INDEX_FILENAME,
+                        help="index database (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: %(default)s)")
+    args = parser.parse_args()
+
+    with Index(args.index) as index:
+        if args.entity:
+            record = resolveEntity(index, args.entity, args.paths, args.jobs)
+            if record is None:
+                print("error: no entity '%s' was found" % args.entity)
+                sys.exit(1)
+            print(json.dumps(record._asdict()))
+            sys.exit(0)
+        parsed = index.update(tbBatch.findSources(args.paths), args.jobs)
+        print("%d files parsed, %d entities indexed" % (parsed, len(index.entities())))
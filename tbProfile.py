@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbProfile
+=========
+
+Per-file timings and counters of a generation run. While a thread profiles
+a file, ``current()`` returns its Profile and the lexer, parser, model and
+generator add their phases and counters to it; the rest of the time it
+returns None and instrumented code only pays for that check. Each thread
+has its own, so files generated concurrently are profiled apart.
+
+Phases are ``read``, ``parse`` (split into ``libs``, ``entities`` and
+``architectures``), ``packages`` (looking up the work packages used),
+``emit``, ``vectors`` and ``write``. Counters are ``bytes``, ``tokens``,
+``entities``, ``ports``, ``generics``, ``signals``, ``packages`` (parsed)
+and ``bytes_written``, plus ``peak_memory`` when tracemalloc is tracing.
+"""
+
+import json, threading, time, tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Parser phase each kind of design unit is accounted to
+PARSE_PHASES = {"library": "libs", "use": "libs", "entity": "entities", "architecture": "architectures"}
+
+_state = threading.local()
+
+def current():
+    """
+    Returns the Profile of the current thread, or None when it isn't
+    profiling.
+    """
+    return getattr(_state, "profile", None)
+
+class Profile(object):
+
+    def __init__(self, source=None):
+        self.source = source
+        self.phases = {}
+        self.counters = {}
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def timeUnits(self, units):
+        """
+        Wraps the ``(kind, value)`` design units yielded by the parser, so the
+        time spent scanning up to a unit and handling it is accounted to its
+        phase.
+        """
+        phase = "libs"
+        start = time.perf_counter()
+        for unit in units:
+            now = time.perf_counter()
+            phase = PARSE_PHASES.get(unit[0], phase)
+            self.add(phase, now - start)
+            yield unit
+            start = time.perf_counter()
+            self.add(phase, start - now)
+        self.add(phase, time.perf_counter() - start)
+
+    def timeChunks(self, chunks):
+        """
+        Wraps the chunks of an output that is written as it is rendered, so
+        the time spent rendering them is accounted to ``emit`` and the time
+        spent writing them to ``write``.
+        """
+        start = time.perf_counter()
+        for chunk in chunks:
+            now = time.perf_counter()
+            self.add("emit", now - start)
+            yield chunk
+            start = time.perf_counter()
+            self.add("write", start - now)
+        self.add("emit", time.perf_counter() - start)
+
+    def report(self):
+        return {"file": self.source, "phases": self.phases, "counters": self.counters}
+
+def phase(name):
+    """
+    Times the enclosed block as 'name' when profiling.
+    """
+    profile = current()
+    return profile.phase(name) if profile is not None else nullcontext()
+
+def count(counter, n=1):
+    profile = current()
+    if profile is not None:
+        profile.count(counter, n)
+
+@contextmanager
+def profiling(source):
+    """
+    Profiles the enclosed block as the processing of 'source' and yields its
+    Profile.
+    """
+    profile, previous = Profile(source), current()
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    _state.profile = profile
+    try:
+        yield profile
+    finally:
+        _state.profile = previous
+        if tracemalloc.is_tracing():
+            profile.counters["peak_memory"] = tracemalloc.get_traced_memory()[1]
+
+def total(reports):
+    """
+    Sums the reports of several files.
+    """
+    phases, counters = {}, {}
+    for report in reports:
+        for key, value in report["phases"].items():
+            phases[key] = phases.get(key, 0.0) + value
+        for key, value in report["counters"].items():
+            if key == "peak_memory":
+                counters[key] = max(counters.get(key, 0), value)
+            else:
+                counters[key] = counters.get(key, 0) + value
+    return {"total": True, "files": len(reports), "phases": phases, "counters": counters}
+
+def writeReport(reports, out):
+    """
+    Writes one JSON object per file followed by the total, as JSON lines.
+    """
+    for report in reports:
+        out.write(json.dumps(report, sort_keys=True) + "\n")
+    out.write(json.dumps(total(reports), sort_keys=True) + "\n")
@@ -0,0 +1,311 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbRun
+=====
+
+Analyzes and simulates generated testbenches::
+
+    python tb_gen.py src/
+    python tb_gen.py run src/ -j 8
+
+``tb_gen.py run`` hands its arguments to main, as does ``python tbRun.py``.
+
+The testbenches (``tb_*.vhd``) under the given paths and the sources they
+depend on are analyzed into a work library, one at a time, in dependency
+order (see tbHierarchy). A file is only analyzed again when its content, or
+a file it depends on, changed since the last run: their hashes are kept in
+the work directory. The testbenches are then elaborated and run on a pool
+of jobs, each from the directory of its file so it finds its vector file.
+
+A testbench passes when its stimulus process reaches the ``"Simulation
+finished"`` assertion of failure severity it ends with, and no other
+assertion of error or failure severity was reported. The log of each run is
+kept in the work directory, under the path of its testbench.
+
+The simulator is a set of command templates (string.Template), run without a
+shell, where ``$file``, ``$entity`` and ``$workdir`` stand for absolute paths
+and names and ``$$`` for a dollar sign (see SIMULATORS). GHDL is the default;
+``stub`` is tbSimStub, which needs no simulator.
+"""
+
+import json, os, re, shlex, string, subprocess, sys, time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import tbBatch, tbHierarchy
+from tbCache import hashFile
+from vParser import write_file
+
+WORKDIR = ".tb_run"
+CACHE_FILENAME = "analyzed.json"
+
+SIMULATORS = {
+    "ghdl": {
+        "analyze": "ghdl -a --std=08 --workdir=$workdir $file",
+        "elaborate": "ghdl -e --std=08 --workdir=$workdir $entity",
+        "run": "ghdl -r --std=08 --workdir=$workdir $entity",
+    },
+    "stub": {
+        "analyze": "$python $stub analyze --workdir $workdir $file",
+        "elaborate": "$python $stub elaborate --workdir $workdir $entity",
+        "run": "$python $stub run --workdir $workdir $entity",
+    },
+}
+
+FINISHED = "Simulation finished"
+
+# Assertion reports of error or failure severity, as GHDL, nvc and ModelSim print them
+_SEVERITY_RE = re.compile(r"\((?:assertion|report) (?:error|failure)\)|\*\* (?:error|failure)\b", re.IGNORECASE)
+
+# 'passed' is False with the reason in 'reason'; 'log' is the file of the output
+RunResult = namedtuple("RunResult", ["testbench", "entity", "passed", "reason", "seconds", "log"])
+
+def findTestbenches(paths):
+    """
+    Returns the testbenches generated by tb_gen under 'paths', sorted.
+    """
+    testbenches = set()
+    for path in paths:
+        if os.path.isfile(path):
+            if os.path.basename(path).startswith("tb_") and path.endswith(".vhd"):
+                testbenches.add(os.path.normpath(path))
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            testbenches.update(os.path.normpath(os.path.join(root, f)) for f in files
+                               if f.startswith("tb_") and f.endswith(".vhd"))
+    return sorted(testbenches)
+
+def command(template, **values):
+    """
+    Returns the arguments of the command 'template' with 'values' filled in.
+    Each argument is filled in on its own, so values may hold spaces.
+    """
+    values.setdefault("python", sys.executable)
+    values.setdefault("stub", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tbSimStub.py"))
+    return [string.Template(arg).substitute(values) for arg in shlex.split(template)]
+
+def logName(testbench, entity):
+    """
+    Returns the log file of the run of the testbench entity 'entity' of the
+    file 'testbench', relative to the work directory. Logs are kept under
+    the absolute path of their testbench, so entities of the same name in
+    different files don't share one.
+    """
+    path = os.path.splitdrive(os.path.splitext(os.path.abspath(testbench))[0])[1]
+    return os.path.join("logs", path.lstrip(os.sep), entity.lower() + ".log")
+
+def verdict(output):
+    """
+    Returns whether the output of a simulation is a pass, and why not.
+    """
+    finished = False
+    for line in output.splitlines():
+        if not _SEVERITY_RE.search(line):
+            continue
+        if FINISHED in line:
+            finished = True
+            break
+        return False, line.strip()
+    if not finished:
+        return False, "did not reach \"%s\"" % FINISHED
+    return True, ""
+
+class Runner(object):
+    """
+    Analyzes and runs testbenches with the commands 'commands' (a dict of
+    ``analyze``, ``elaborate`` and ``run`` templates, see SIMULATORS) in the
+    work directory 'workdir'.
+    """
+
+    def __init__(self, commands, workdir=WORKDIR, jobs=None, timeout=None, out=sys.stdout):
+        self.commands = commands
+        self.workdir = os.path.abspath(workdir)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.timeout = timeout
+        self.out = out
+        os.makedirs(self.workdir, exist_ok=True)
+
+    def _execute(self, step, cwd=None, **values):
+        """
+        Runs the command of 'step' and returns whether it succeeded and its
+        output.
+        """
+        args = command(self.commands[step], workdir=self.workdir, **values)
+        try:
+            p = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd,
+                               timeout=self.timeout, universal_newlines=True)
+        except subprocess.TimeoutExpired as e:
+            output = e.stdout.decode(errors="replace") if isinstance(e.stdout, bytes) else e.stdout or ""
+            return None, output
+        except OSError as e:
+            return False, "error: %s: %s\n" % (args[0], e)
+        return p.returncode == 0, p.stdout
+
+    def _loadCache(self):
+        try:
+            with open(os.path.join(self.workdir, CACHE_FILENAME)) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if cache.get("analyze") != self.commands["analyze"]:
+            return {} # analyzed by another simulator
+        return cache.get("files", {})
+
+    def _saveCache(self, files):
+        write_file(os.path.join(self.workdir, CACHE_FILENAME),
+                   json.dumps({"analyze": self.commands["analyze"], "files": files}, indent=1) + "\n")
+
+    def analyze(self, order, dependencies, force=False):
+        """
+        Analyzes the files 'order' in that order, but only those that changed
+        or depend on a file that was analyzed again (all of them with
+        'force'). Returns the files that failed, or depend on one that did,
+        with the reason.
+        """
+        cached = {} if force else self._loadCache()
+        analyzed, failed, current = set(), {}, 0
+        for path in order:
+            broken = [d for d in dependencies.get(path, ()) if d in failed]
+            if broken:
+                failed[path] = "depends on %s, which failed to analyze" % os.path.relpath(broken[0])
+                cached.pop(path, None)
+                continue
+            digest = hashFile(path)
+            if cached.get(path) == digest and not analyzed.intersection(dependencies.get(path, ())):
+                current += 1
+                continue
+            ok, output = self._execute("analyze", file=path)
+            analyzed.add(path)
+            if ok:
+                cached[path] = digest
+                continue
+            cached.pop(path, None)
+            failed[path] = "analysis of %s failed" % os.path.relpath(path)
+            self.out.write("FAILED analysis of %s\n" % os.path.relpath(path))
+            for line in output.splitlines():
+                self.out.write("\t%s\n" % line)
+        self._saveCache(cached)
+        self.out.write("%d files analyzed, %d up to date\n" % (len(analyzed), current))
+        return failed
+
+    def simulate(self, testbench, entity):
+        """
+        Elaborates and runs the testbench entity 'entity' of the file
+        'testbench' and returns its RunResult.
+        """
+        start = time.monotonic()
+        log = os.path.join(self.workdir, logName(testbench, entity))
+        cwd = os.path.dirname(os.path.abspath(testbench))
+        ok, output = self._execute("elaborate", cwd=cwd, entity=entity)
+        if not ok:
+            passed, reason = False, "elaboration failed" if ok is False else "elaboration timed out"
+        else:
+            ok, run_output = self._execute("run", cwd=cwd, entity=entity)
+            output += run_output
+            if ok is None:
+                passed, reason = False, "timed out after %gs" % self.timeout
+            else:
+                passed, reason = verdict(run_output)
+        os.makedirs(os.path.dirname(log), exist_ok=True)
+        write_file(log, output)
+        return RunResult(testbench, entity, passed, reason, time.monotonic() - start, log)
+
+    def runAll(self, testbenches, paths, force=False):
+        """
+        Analyzes the testbenches 'testbenches' and the sources under 'paths'
+        they depend on, then runs them. Returns their RunResults. Sources are
+        looked up in the directory of the files of 'paths'.
+        """
+        directories = sorted(set(p if os.path.isdir(p) else os.path.dirname(p) or "." for p in paths))
+        sources = [os.path.abspath(s) for s in tbBatch.findSources(directories)]
+        testbenches = [os.path.abspath(t) for t in testbenches]
+        hierarchy = tbHierarchy.build(sorted(set(sources + testbenches)), self.jobs)
+        for path, message in sorted(hierarchy.errors.items()):
+            self.out.write("error: %s: %s\n" % (os.path.relpath(path), message))
+        dependencies = hierarchy.fileDependencies()
+
+        needed, pending = set(), list(testbenches)
+        while pending:
+            path = pending.pop()
+            if path not in needed:
+                needed.add(path)
+                pending += dependencies.get(path, ())
+        order = [p for p in hierarchy.analysisOrder() if p in needed]
+        failed = self.analyze(order, dependencies, force)
+
+        results, runs = [], []
+        for testbench in testbenches:
+            entities = hierarchy.entities(testbench)
+            if testbench in failed or testbench in hierarchy.errors or not entities:
+                reason = failed.get(testbench) or hierarchy.errors.get(testbench) or "no entity found"
+                other = hierarchy.path(os.path.splitext(os.path.basename(testbench))[0])
+                if not entities and other is not None:
+                    # the work library holds one entity of a name
+                    reason = "its entity is also declared in %s, run them with separate --workdir" % os.path.relpath(other)
+                self.out.write("FAIL %s: %s\n" % (os.path.relpath(testbench), reason))
+                results.append(RunResult(testbench, entities[0] if entities else None, False, reason, 0.0, None))
+                continue
+            runs += [(testbench, entity) for entity in entities]
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = [pool.submit(self.simulate, testbench, entity) for testbench, entity in runs]
+            for future in futures:
+                result = future.result()
+                self.out.write("%s %s (%.1fs)%s\n" % ("PASS" if result.passed else "FAIL", result.entity,
+                                                      result.seconds, "" if result.passed else ": " + result.reason))
+                self.out.flush()
+                results.append(result)
+        return results
+
+def main(argv=None, prog=None):
+    """
+    Runs the command line 'argv' (sys.argv by default) and returns the exit
+    status.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog=prog, description="Analyze and run generated VHDL testbenches.")
+    parser.add_argument("paths", nargs="*", default=["."], metavar="PATH",
+                        help="testbench, source or directory (default: .)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="simulations run at a time (default: %(default)s)")
+    parser.add_argument("--simulator", choices=sorted(SIMULATORS), default="ghdl",
+                        help="simulator commands to use (default: %(default)s)")
+    parser.add_argument("--analyze", metavar="CMD",
+                        help="command analyzing $file into $workdir, instead of the simulator's")
+    parser.add_argument("--elaborate", metavar="CMD",
+                        help="command elaborating $entity, instead of the simulator's")
+    parser.add_argument("--run", metavar="CMD",
+                        help="command running $entity, instead of the simulator's")
+    parser.add_argument("--workdir", default=WORKDIR, metavar="DIR",
+                        help="work library, analysis cache and logs (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, metavar="SECONDS",
+                        help="stop simulations running longer than this")
+    parser.add_argument("--force", action="store_true",
+                        help="analyze every file again")
+    args = parser.parse_args(argv)
+
+    commands = dict(SIMULATORS[args.simulator])
+    for step in ("analyze", "elaborate", "run"):
+        if getattr(args, step):
+            commands[step] = getattr(args, step)
+    for step, template in commands.items():
+        try:
+            command(template, workdir="", file="", entity="")
+        except (KeyError, ValueError) as e:
+            print("error: invalid %s command '%s': %s" % (step, template, e))
+            return 1
+
+    testbenches = findTestbenches(args.paths)
+    if not testbenches:
+        print("error: no testbench (tb_*.vhd) was found")
+        return 1
+    results = Runner(commands, args.workdir, args.jobs, args.timeout).runAll(testbenches, args.paths, args.force)
+    passed = len([r for r in results if r.passed])
+    print("%d passed, %d failed" % (passed, len(results) - passed))
+    return 0 if passed == len(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
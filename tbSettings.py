@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbSettings
+==========
+
+Generator settings: clock period, reset length and polarity, clock/reset
+port overrides and stimulus vectors. They come from the defaults, a
+per-project settings file and the command line, from least to most
+specific, and can be overridden per entity in the settings file::
+
+    [tb_gen]
+    clock_period = 20
+    reset_cycles = 3
+
+    [entity HVcounter]
+    clock = clk
+    reset = none
+"""
+
+import configparser, json, os
+
+from vhdl import report
+
+SETTINGS_FILENAME = "tb_gen.ini"
+
+DEFAULTS = {
+    "clock_period": 10,         # ns
+    "reset_cycles": 5,          # clock periods the reset is held for
+    "reset_polarity": "auto",   # auto, low or high
+    "clock": "auto",            # auto, none or the name of a port
+    "reset": "auto",            # auto, none or the name of a port
+    "templates": "builtin",     # builtin or a directory of .tpl files
+    "stimulus": "none",         # none, exhaustive or random (see tbStimulus)
+    "stimulus_vectors": 1000,   # random vectors
+    "stimulus_seed": 0,
+}
+
+_ENTITY_SECTION = "entity "
+
+def _checkValue(key, value):
+    if key not in DEFAULTS:
+        raise ValueError("unknown setting '%s'" % key)
+    if key in ("clock_period", "reset_cycles", "stimulus_vectors"):
+        value = int(value)
+        if value <= 0:
+            raise ValueError("'%s' must be a positive integer" % key)
+    elif key == "stimulus_seed":
+        value = int(value)
+        if value < 0:
+            raise ValueError("'stimulus_seed' must be a non-negative integer")
+    elif key == "stimulus":
+        value = str(value).lower()
+        if value not in ("none", "exhaustive", "random"):
+            raise ValueError("'stimulus' must be one of none, exhaustive or random")
+    elif key == "reset_polarity":
+        value = str(value).lower()
+        if value not in ("auto", "low", "high"):
+            raise ValueError("'reset_polarity' must be one of auto, low or high")
+    elif key == "templates":
+        value = str(value).strip() or "builtin"
+    else:
+        value = str(value).strip() or "none"
+    return value
+
+class Settings(object):
+
+    def __init__(self, values=None, interactive=False):
+        self._values = dict(DEFAULTS)
+        self._entities = {}
+        self.interactive = interactive
+        if values:
+            self.update(values)
+
+    def update(self, values, entity=None):
+        for key, value in values.items():
+            if value is not None:
+                self.set(key, value, entity)
+
+    def set(self, key, value, entity=None):
+        value = _checkValue(key, value)
+        if entity is None:
+            self._values[key] = value
+        else:
+            self._entities.setdefault(entity.lower(), {})[key] = value
+
+    def get(self, key, entity=None):
+        """
+        Returns a setting, taking into account the overrides of 'entity'.
+        """
+        if entity is not None:
+            overrides = self._entities.get(entity.lower())
+            if overrides and key in overrides:
+                return overrides[key]
+        return self._values[key]
+
+    def key(self):
+        """
+        Returns a stable string identifying these settings (prompting aside).
+        """
+        return json.dumps([self._values, self._entities], sort_keys=True)
+
+    def hasEntity(self, key, entity):
+        return key in self._entities.get(entity.lower(), {})
+
+    def load(self, filename):
+        """
+        Reads a settings file: the [tb_gen] section holds the project settings
+        and every [entity <name>] section the overrides of that entity.
+        Raises ValueError if it can't be read or holds an invalid setting.
+        """
+        config = configparser.ConfigParser()
+        try:
+            with open(filename, "r") as f:
+                config.read_file(f)
+        except (OSError, UnicodeDecodeError, configparser.Error) as e:
+            raise ValueError("failed to read settings file '%s': %s" % (filename, e))
+
+        for section in config.sections():
+            if section == "tb_gen":
+                entity = None
+            elif section.lower().startswith(_ENTITY_SECTION):
+                entity = section[len(_ENTITY_SECTION):].strip()
+            else:
+                report("warning: section '%s' of '%s' was ignored" % (section, filename))
+                continue
+            try:
+                self.update(dict(config.items(section)), entity)
+            except ValueError as e:
+                raise ValueError("%s: [%s] %s" % (filename, section, e))
+
+def loadSettings(filename=None, overrides=None, interactive=False):
+    """
+    Builds the settings of a run. 'filename' defaults to tb_gen.ini in the
+    current directory when it exists; 'overrides' are the command line values
+    and take precedence over the [tb_gen] section of the file, but not over
+    its per-entity sections. Raises ValueError for invalid settings.
+    """
+    settings = Settings(interactive=interactive)
+    if filename is None and os.path.isfile(SETTINGS_FILENAME):
+        filename = SETTINGS_FILENAME
+    if filename is not None:
+        settings.load(filename)
+    if overrides:
+        settings.update(overrides)
+    return settings
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbSimStub
+=========
+
+Stand-in for a simulator, to try tbRun without one. It takes the same steps
+as GHDL with the same exit statuses, but only parses:
+
+- ``analyze --workdir DIR FILE`` parses FILE and records its entities in the
+  library of DIR
+- ``elaborate --workdir DIR ENTITY`` checks that ENTITY and every entity it
+  instantiates, directly or not, were analyzed
+- ``run --workdir DIR ENTITY`` prints the reports of the assertions of
+  error or failure severity of the file of ENTITY in GHDL's format, as if
+  each one was hit once in source order, and exits with status 1 if there
+  were any
+
+A testbench generated by tb_gen thus passes: its only assertion is the
+``"Simulation finished"`` failure ending its stimulus.
+"""
+
+import json, os, re, sys
+
+from vhdl import VHDLError
+from vParser import read_file, write_file
+import tbHierarchy
+
+LIBRARY_FILENAME = "stub-work.json"
+
+_ASSERT_RE = re.compile(r"\breport\s+\"((?:[^\"\n]|\"\")*)\"\s*severity\s+(error|failure)\b", re.IGNORECASE)
+
+def _library(workdir):
+    try:
+        with open(os.path.join(workdir, LIBRARY_FILENAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def analyze(workdir, filename):
+    design = tbHierarchy.scanFile(os.path.abspath(filename))
+    if design.error is not None:
+        raise VHDLError(design.error, filename)
+    library = _library(workdir)
+    library = dict((k, v) for k, v in library.items() if v != design.path)
+    for name in design.entities:
+        library[name.lower()] = design.path
+    write_file(os.path.join(workdir, LIBRARY_FILENAME), json.dumps(library, indent=1) + "\n")
+
+def elaborate(workdir, entity):
+    library = _library(workdir)
+    pending, seen = [entity.lower()], set()
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        if name not in library:
+            raise VHDLError("unit '%s' not found in library 'work'" % name)
+        for arch in tbHierarchy.scanFile(library[name]).architectures:
+            if arch.entity.lower() == name:
+                pending += [i.name.lower() for i in arch.instances if i.kind != "configuration"]
+
+def run(workdir, entity):
+    """
+    Prints the assertion reports of 'entity' and returns their number.
+    """
+    filename = _library(workdir).get(entity.lower())
+    if filename is None:
+        raise VHDLError("unit '%s' not found in library 'work'" % entity)
+    text = read_file(filename)
+    reports = 0
+    for m in _ASSERT_RE.finditer(text):
+        line = text.count("\n", 0, m.start()) + 1
+        print("%s:%d:%d:@0ms:(assertion %s): %s" % (filename, line, 1, m.group(2).lower(), m.group(1)))
+        reports += 1
+    return reports
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stand-in simulator for tbRun.")
+    parser.add_argument("command", choices=["analyze", "elaborate", "run"])
+    parser.add_argument("unit", metavar="FILE|ENTITY")
+    parser.add_argument("--workdir", default=".", metavar="DIR",
+                        help="directory of the work library (default: .)")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "analyze":
+            analyze(args.workdir, args.unit)
+        elif args.command == "elaborate":
+            elaborate(args.workdir, args.unit)
+        elif run(args.workdir, args.unit):
+            sys.exit(1)
+    except VHDLError as e:
+        print("error: %s" % e)
+        sys.exit(1)
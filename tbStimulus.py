@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbStimulus
+==========
+
+Stimulus vectors for the input ports of an entity. Instead of unrolling
+assignments into the testbench, the vectors are written to a text file with
+one line per vector and one field of '0' and '1' per input, which the
+testbench reads with std.textio::
+
+    0 00000000
+    0 00000001
+    ...
+
+Vectors are either every combination of the inputs (``exhaustive``, as long
+as they have at most EXHAUSTIVE_MAX_BITS bits, otherwise random vectors are
+used instead) or ``random`` vectors drawn from a seeded generator. They are
+computed as NumPy bit matrices when NumPy is installed, and with plain
+Python otherwise; both give the same file.
+"""
+
+import ast, random, re
+from collections import namedtuple
+
+MODES = ("none", "exhaustive", "random")
+
+EXHAUSTIVE_MAX_BITS = 16
+
+# port type -> (type of the variable read from the file, conversion to the port type)
+_TYPES = {
+    "std_logic": ("bit", "to_stdulogic(%s)"),
+    "std_ulogic": ("bit", "to_stdulogic(%s)"),
+    "bit": ("bit", "%s"),
+    "std_logic_vector": ("bit_vector", "to_stdlogicvector(%s)"),
+    "std_ulogic_vector": ("bit_vector", "to_stdulogicvector(%s)"),
+    "bit_vector": ("bit_vector", "%s"),
+    "unsigned": ("bit_vector", "unsigned(to_stdlogicvector(%s))"),
+    "signed": ("bit_vector", "signed(to_stdlogicvector(%s))"),
+}
+
+_TYPE_RE = re.compile(r"^\s*(\w+)\s*(?:\((.*)\))?\s*$", re.DOTALL)
+_RANGE_RE = re.compile(r"^(.+?)\s+(downto|to)\s+(.+)$", re.DOTALL | re.IGNORECASE)
+_EXPR_RE = re.compile(r"^[\w\s+\-*/()]*$")
+
+# bounds of the values and exponents of the expressions _evaluate computes,
+# so a source can't make it build huge integers
+_MAX_VALUE = 1 << 64
+_MAX_EXPONENT = 64
+
+_numpy = None
+
+# 'inputs' are StimulusInputs, applied every 'period' (a VHDL time expression)
+Stimulus = namedtuple("Stimulus", ["file", "inputs", "period"])
+StimulusInput = namedtuple("StimulusInput", ["name", "variable", "type", "value", "width"])
+
+def _evaluate(expr, constants):
+    """
+    Returns the value of the integer expression 'expr' of a range bound, or
+    None if it is not a plain arithmetic expression of 'constants' or its
+    value is out of bounds.
+    """
+    if not _EXPR_RE.match(expr):
+        return None
+    expr = re.sub(r"\b[A-Za-z]\w*\b", lambda m: str(constants.get(m.group(0).lower(), m.group(0))), expr)
+    if re.search(r"[A-Za-z_]", expr):
+        return None
+    try:
+        return _evaluateNode(ast.parse(expr.strip(), mode="eval").body)
+    except (SyntaxError, ValueError, ZeroDivisionError):
+        return None
+
+def _evaluateNode(node):
+    """
+    Computes an expression tree of integers, +, -, *, / (truncating, as in
+    VHDL) and **, raising ValueError for anything else or out of bounds.
+    """
+    if isinstance(node, ast.Constant) and type(node.value) is int:
+        value = node.value
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        value = _evaluateNode(node.operand)
+        if isinstance(node.op, ast.USub):
+            value = -value
+    elif isinstance(node, ast.BinOp):
+        left, right = _evaluateNode(node.left), _evaluateNode(node.right)
+        if isinstance(node.op, ast.Add):
+            value = left + right
+        elif isinstance(node.op, ast.Sub):
+            value = left - right
+        elif isinstance(node.op, ast.Mult):
+            value = left * right
+        elif isinstance(node.op, ast.Div):
+            value = abs(left) // abs(right)
+            if (left < 0) != (right < 0):
+                value = -value
+        elif isinstance(node.op, ast.Pow):
+            if not 0 <= right <= _MAX_EXPONENT:
+                raise ValueError("exponent out of bounds")
+            value = left ** right
+        else:
+            raise ValueError("unsupported operator")
+    else:
+        raise ValueError("unsupported expression")
+    if abs(value) > _MAX_VALUE:
+        raise ValueError("value out of bounds")
+    return value
+
+def _loadNumpy():
+    """
+    Returns the numpy module, or None when it isn't installed. It is only
+    imported once vectors are computed.
+    """
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+def constantValues(declarations, constants=None):
+    """
+    Returns 'constants' (by lowercased name) updated with the integer values
+    of the generics or package constants 'declarations'.
+    """
+    constants = dict(constants or {})
+    for d in declarations:
+        value = _evaluate(d.getValue() or "", constants)
+        if value is not None:
+            constants[d.getName().lower()] = value
+    return constants
+
+def _definition(type_name, types):
+    # the match of _TYPE_RE on the definition of 'type_name', following the
+    # package subtypes of 'types'
+    m = _TYPE_RE.match(type_name)
+    for _ in range(8): # subtypes of subtypes
+        if m is None or m.group(2) is not None or not types or m.group(1).lower() not in types:
+            break
+        m = _TYPE_RE.match(types[m.group(1).lower()])
+    return m
+
+def resolveType(type_name, constants, types=None):
+    """
+    Returns the type 'type_name' of a port or generic with the package
+    subtypes of 'types' replaced by their definition and the bounds of its
+    range computed from 'constants' (see stimulusInput), as far as they can
+    be.
+    """
+    m = _definition(type_name, types)
+    if m is None:
+        return type_name
+    if m.group(2) is None:
+        return m.group(1)
+    bounds = _RANGE_RE.match(m.group(2).strip())
+    if bounds is not None:
+        left, right = _evaluate(bounds.group(1), constants), _evaluate(bounds.group(3), constants)
+        if left is not None and right is not None:
+            return "%s(%d %s %d)" % (m.group(1), left, bounds.group(2).lower(), right)
+    return "%s(%s)" % (m.group(1), m.group(2).strip())
+
+def stimulusInput(port, constants, types=None):
+    """
+    Returns the StimulusInput of 'port', or None if its type can't be read
+    from a vector file. 'constants' maps the lowercased names of the
+    generics and package constants to their values, for the bounds of the
+    port range, and 'types' the lowercased names of package subtypes to
+    their definition.
+    """
+    m = _definition(port.getType(), types)
+    if m is None or m.group(1).lower() not in _TYPES:
+        return None
+    variable_type, value = _TYPES[m.group(1).lower()]
+    variable = "stim_" + port.getName()
+    if variable_type == "bit":
+        if m.group(2) is not None:
+            return None
+        return StimulusInput(port.getName(), variable, "bit", value % variable, 1)
+    if m.group(2) is None:
+        return None
+    bounds = _RANGE_RE.match(m.group(2).strip())
+    if bounds is None:
+        return None
+    left, right = _evaluate(bounds.group(1), constants), _evaluate(bounds.group(3), constants)
+    if left is None or right is None or abs(left - right) + 1 > 64:
+        return None
+    return StimulusInput(port.getName(), variable, "bit_vector(%s)" % m.group(2).strip(),
+                         value % variable, abs(left - right) + 1)
+
+def bitRows(bits, mode, count, seed):
+    """
+    Returns the vectors as a (vectors, bits) NumPy array of 0 and 1, most
+    significant bit first, or as a list of strings of '0' and '1' without
+    NumPy.
+    """
+    numpy = _loadNumpy()
+    exhaustive = mode == "exhaustive" and bits <= EXHAUSTIVE_MAX_BITS
+    if exhaustive:
+        count = 1 << bits
+        if numpy is not None:
+            values = numpy.arange(count, dtype=numpy.uint32)[:, None]
+            shifts = numpy.arange(bits - 1, -1, -1, dtype=numpy.uint32)
+            return ((values >> shifts) & 1).astype(numpy.uint8)
+        return [format(v, "0%db" % bits) for v in range(count)]
+
+    # a single draw of all the bits, so both ways give the same vectors
+    total = bits * count
+    value = random.Random(seed).getrandbits(total)
+    if numpy is not None:
+        packed = numpy.frombuffer(value.to_bytes((total + 7) // 8, "big"), dtype=numpy.uint8)
+        return numpy.unpackbits(packed)[-total:].reshape(count, bits)
+    digits = format(value, "0%db" % total)
+    return [digits[i:i + bits] for i in range(0, total, bits)]
+
+def formatVectors(widths, mode="exhaustive", count=1000, seed=0):
+    """
+    Returns the text of the vector file of inputs of 'widths' bits (at least
+    one input).
+    """
+    bits = sum(widths)
+    rows = bitRows(bits, mode, count, seed)
+    numpy = _loadNumpy()
+    if numpy is None:
+        lines = []
+        for row in rows:
+            fields, pos = [], 0
+            for width in widths:
+                fields.append(row[pos:pos + width])
+                pos += width
+            lines.append(" ".join(fields) + "\n")
+        return "".join(lines)
+
+    # one byte per bit, plus a space after every field but the last one,
+    # which is followed by the newline
+    chars = numpy.full((len(rows), bits + len(widths)), ord(" "), dtype=numpy.uint8)
+    columns, pos = [], 0
+    for i, width in enumerate(widths):
+        columns.extend(range(pos + i, pos + i + width))
+        pos += width
+    chars[:, columns] = rows + ord("0")
+    chars[:, -1] = ord("\n")
+    return chars.tobytes().decode("ascii")
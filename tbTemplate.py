@@ -0,0 +1,440 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbTemplate
+==========
+
+Templates the testbenches are rendered from. A template is text with:
+
+- ``{{ expr }}``: the value of a Python expression
+- ``{% for x in expr %} ... {% sep %} ... {% endfor %}``: a loop, the optional
+  part after ``sep`` is output between iterations
+- ``{% if expr %} ... {% elif expr %} ... {% else %} ... {% endif %}``
+- ``{% include name %}`` or ``{% include name with expr %}``: another template,
+  optionally with the entries of the dict ``expr`` added to the context
+- ``{# comment #}``
+
+A tag alone on its line is removed along with its line. Expressions see the
+entries of the context as variables.
+
+Templates are compiled once into Python generators and cached, so rendering
+costs the same for the default templates and for templates loaded from a
+directory (``<name>.tpl`` files overriding the defaults of the same name).
+Rendering yields chunks of text instead of building the whole output.
+
+Errors, in the syntax of a template or raised by one of its expressions
+while it renders, are raised as TemplateError with the name of the template
+and the line of the tag. A template may not include itself, directly or
+not.
+"""
+
+import bisect, builtins, glob, hashlib, os, re
+from collections import OrderedDict
+from types import FunctionType
+
+DEFAULT_TEMPLATES = {
+    "testbench":
+        "{% include library %}\n"
+        "{% for unit in units %}\n"
+        "{% include entity with unit %}{% sep %}\n"
+        "{% endfor %}\n"
+        "\n"
+        "\n"
+        "{% for unit in units %}\n"
+        "{% include architecture with unit %}\n"
+        "{% endfor %}\n",
+
+    "library":
+        "{% for l in libraries %}\n"
+        "library {{ l }};\n"
+        "{% endfor %}\n"
+        "{% for u in uses %}\n"
+        "use {{ u }};\n"
+        "{% endfor %}\n"
+        "\n",
+
+    "entity":
+        "entity tb_{{ name }} is\n"
+        "end tb_{{ name }};",
+
+    "architecture":
+        "architecture behav of tb_{{ name }} is\n"
+        "{% include component %}\n"
+        "{% include constants %}\n"
+        "{% include signals %}\n"
+        "\n"
+        "\n"
+        "\tbegin\n"
+        "{% include uut %}\n"
+        "{% include clock %}\n"
+        "{% include reset %}\n"
+        "{% include stimulus %}\n"
+        "\n"
+        "\n"
+        "end behav;",
+
+    "component":
+        "\tcomponent {{ name }}\n"
+        "{% if generics %}\n"
+        "\tgeneric (\n"
+        "{% for g in generics %}\n"
+        "\t\t\t{{ g.getName() }} : {{ g.getType() }}{% sep %};\n"
+        "{% endfor %}\n"
+        "\n"
+        "\t);\n"
+        "{% endif %}\n"
+        "\tport (\n"
+        "{% for p in ports %}\n"
+        "\t\t\t{{ p.getName() }} : {{ p.getPortType() }} {{ p.getType() }}{% sep %};\n"
+        "{% endfor %}\n"
+        "\n"
+        "\t);\n"
+        "\tend component;\n"
+        "\n",
+
+    "constants":
+        "{% for g in generics %}\n"
+        "\tconstant {{ g.getName() }} : {{ g.getType() }} := {{ g.getValue() }};\n"
+        "{% endfor %}\n"
+        "{% if clk %}\n"
+        "\tconstant clk_period : time := {{ clock_period }} ns;\n"
+        "{% endif %}\n",
+
+    "signals":
+        "{% for p in ports %}\n"
+        "\tsignal {{ p.getName() }} : {{ p.getType() }};{% sep %}\n"
+        "{% endfor %}\n",
+
+    "uut":
+        "\tUUT: {{ name }} {% if generics %}generic map (\n"
+        "{% for g in generics %}\n"
+        "\t\t{{ g.getName() }} => {{ g.getName() }}{% sep %},\n"
+        "{% endfor %}\n"
+        "\n"
+        "\t)\n"
+        "{% endif %}\n"
+        "\tport map (\n"
+        "{% for p in ports %}\n"
+        "\t\t{{ p.getName() }} => {{ p.getName() }}{% sep %},\n"
+        "{% endfor %}\n"
+        "\n"
+        "\t);\n",
+
+    "clock":
+        "{% if clk %}\n"
+        "\n"
+        "\n"
+        "\tclk_process: process\n"
+        "\tbegin\n"
+        "\t\t{{ clk }} <= '0';\n"
+        "\t\twait for clk_period/2;\n"
+        "\t\t{{ clk }} <= '1';\n"
+        "\t\twait for clk_period/2;\n"
+        "\tend process clk_process;"
+        "{% endif %}",
+
+    "reset":
+        "{% if reset_process %}\n"
+        "\n"
+        "\n"
+        "\trst_process: process\n"
+        "\tbegin\n"
+        "\t\t{{ rst }} <= '{{ int(not rst_active_low) }}';\n"
+        "\t\twait for {{ reset_hold }};\n"
+        "\t\t{{ rst }} <= '{{ int(rst_active_low) }}';\n"
+        "\t\twait;\n"
+        "\tend process rst_process;"
+        "{% endif %}",
+
+    "stimulus":
+        "\n"
+        "\n"
+        "\tstim_process: process\n"
+        "{% if stimulus %}\n"
+        "\t\tfile vectors : text open read_mode is \"{{ stimulus.file }}\";\n"
+        "\t\tvariable vector : line;\n"
+        "{% for i in stimulus.inputs %}\n"
+        "\t\tvariable {{ i.variable }} : {{ i.type }};\n"
+        "{% endfor %}\n"
+        "{% endif %}\n"
+        "begin\n"
+        "{% if rst %}\n"
+        "\t\twait until {{ rst }} = '{{ int(rst_active_low) }}';\n"
+        "{% endif %}\n"
+        "{% if stimulus %}\n"
+        "\t\twhile not endfile(vectors) loop\n"
+        "\t\t\treadline(vectors, vector);\n"
+        "{% for i in stimulus.inputs %}\n"
+        "\t\t\tread(vector, {{ i.variable }});\n"
+        "\t\t\t{{ i.name }} <= {{ i.value }};\n"
+        "{% endfor %}\n"
+        "\t\t\twait for {{ stimulus.period }};\n"
+        "\t\tend loop;\n"
+        "{% else %}\n"
+        "\t\t--insert stimulus here\n"
+        "{% endif %}\n"
+        "\n"
+        "\t\tassert false\n"
+        "\t\t\treport \"Simulation finished\"\n"
+        "\t\t\tseverity failure;\n"
+        "\tend process stim_process;",
+}
+
+TEMPLATE_EXTENSION = ".tpl"
+
+class TemplateError(ValueError):
+    pass
+
+_TAG_RE = re.compile(r"{{(.*?)}}|{%(.*?)%}|{#.*?#}", re.DOTALL)
+_STANDALONE_RE = re.compile(r"^[ \t]*({%(?:(?!%}).)*%}|{#(?:(?!#}).)*#})[ \t]*\n", re.MULTILINE)
+_FOR_RE = re.compile(r"for\s+([A-Za-z_]\w*)\s+in\s+(.+)$", re.DOTALL)
+_INCLUDE_RE = re.compile(r"include\s+([A-Za-z_]\w*)(?:\s+with\s+(.+))?$", re.DOTALL)
+
+# compiled templates kept, by source text
+COMPILED_TEMPLATES = 256
+
+_compiled = OrderedDict()   # source -> (code, template line of each line of the code)
+
+def compileTemplate(source, name="<template>"):
+    """
+    Returns the code object of the generator rendering 'source', and the
+    line of the template each of its lines comes from (None for the first
+    ones). The COMPILED_TEMPLATES most recently used are cached by source
+    text.
+    """
+    compiled = _compiled.get(source)
+    if compiled is None:
+        lines, origins = ["def _render(_include):", "    if False: yield ''"], [None, None]
+        _generate(_parse(source, name), lines, 1, origins)
+        try:
+            namespace = {}
+            exec(compile("\n".join(lines), "<template %s>" % name, "exec"), namespace)
+        except SyntaxError as e:
+            line = origins[e.lineno - 1] if e.lineno and e.lineno <= len(origins) else None
+            raise TemplateError("template '%s'%s: invalid expression: %s"
+                                % (name, ", line %d" % line if line else "", (e.text or str(e)).strip()))
+        compiled = (namespace["_render"].__code__, origins)
+    _compiled[source] = compiled
+    _compiled.move_to_end(source)
+    while len(_compiled) > COMPILED_TEMPLATES:
+        _compiled.popitem(last=False)
+    return compiled
+
+def _parse(source, name):
+    """
+    Parses a template into a tree of nodes, where 'line' is the line of the
+    tag in the template:
+
+    - ``("text", str)``
+    - ``("expr", python_expr, line)``
+    - ``("for", var, python_expr, body, separator, line)``
+    - ``("if", [(python_expr, body, line), ...], else_body)``
+    - ``("include", template_name, python_expr or None, line)``
+    """
+    # the tags alone on their line are removed with their line break: keep
+    # where, so lines can still be counted in the stripped source
+    stripped, removed, offset, length = [], [], 0, 0
+    for m in _STANDALONE_RE.finditer(source):
+        stripped += [source[offset:m.start()], m.group(1)]
+        length += m.start() - offset + len(m.group(1))
+        removed.append(length)
+        offset = m.end()
+    stripped.append(source[offset:])
+    source = "".join(stripped)
+
+    def lineAt(position):
+        return 1 + source.count("\n", 0, position) + bisect.bisect_right(removed, position)
+
+    root = []
+    stack = [] # (tag, node, current body)
+    body = root
+
+    def error(message):
+        raise TemplateError("template '%s', line %d: %s" % (name, lineAt(m.start()), message))
+
+    pos = 0
+    for m in _TAG_RE.finditer(source):
+        if m.start() > pos:
+            body.append(("text", source[pos:m.start()]))
+        pos = m.end()
+        line = lineAt(m.start())
+        if m.group(1) is not None:
+            body.append(("expr", m.group(1).strip(), line))
+            continue
+        if m.group(2) is None:
+            continue # comment
+        tag = m.group(2).strip()
+        keyword = tag.split(None, 1)[0] if tag else ""
+
+        if keyword == "for":
+            loop = _FOR_RE.match(tag)
+            if loop is None:
+                error("invalid tag '{%% %s %%}'" % tag)
+            node = ("for", loop.group(1), loop.group(2).strip(), [], [], line)
+            body.append(node)
+            stack.append(("for", node, body))
+            body = node[3]
+        elif keyword == "sep":
+            if not stack or stack[-1][0] != "for" or body is not stack[-1][1][3]:
+                error("'sep' outside of a loop")
+            body = stack[-1][1][4]
+        elif keyword == "if":
+            node = ("if", [(tag[2:].strip(), [], line)], [])
+            body.append(node)
+            stack.append(("if", node, body))
+            body = node[1][0][1]
+        elif keyword in ("elif", "else"):
+            if not stack or stack[-1][0] != "if" or body is stack[-1][1][2]:
+                error("unexpected '%s'" % keyword)
+            node = stack[-1][1]
+            if keyword == "elif":
+                node[1].append((tag[4:].strip(), [], line))
+                body = node[1][-1][1]
+            else:
+                body = node[2]
+        elif keyword in ("endfor", "endif"):
+            if not stack or "end" + stack[-1][0] != keyword:
+                error("unexpected '%s'" % keyword)
+            body = stack.pop()[2]
+        elif keyword == "include":
+            include = _INCLUDE_RE.match(tag)
+            if include is None:
+                error("invalid tag '{%% %s %%}'" % tag)
+            body.append(("include", include.group(1), include.group(2), line))
+        else:
+            error("unknown tag '{%% %s %%}'" % tag)
+
+    if pos < len(source):
+        body.append(("text", source[pos:]))
+    if stack:
+        error("missing 'end%s'" % stack[-1][0])
+    return root
+
+def _generate(nodes, lines, depth, origins):
+    # 'origins' gets the template line of each line appended to 'lines'
+    indent = "    " * depth
+
+    def add(code, line=None):
+        lines.append(indent + code)
+        origins.append(line)
+
+    add("pass")
+    for node in nodes:
+        kind = node[0]
+        if kind == "text":
+            add("yield %r" % node[1])
+        elif kind == "expr":
+            add("yield str(%s)" % node[1], node[2])
+        elif kind == "include":
+            add("yield from _include(%r, %s)" % (node[1], node[2] or "None"), node[3])
+        elif kind == "for":
+            _, var, expr, body, separator, line = node
+            if separator:
+                first = "_first%d" % len(lines)
+                add("%s = True" % first, line)
+                add("for %s in %s:" % (var, expr), line)
+                add("    if %s:" % first, line)
+                add("        %s = False" % first, line)
+                add("    else:", line)
+                _generate(separator, lines, depth + 2, origins)
+            else:
+                add("for %s in %s:" % (var, expr), line)
+            _generate(body, lines, depth + 1, origins)
+        elif kind == "if":
+            _, branches, otherwise = node
+            for i, (condition, body, line) in enumerate(branches):
+                add("%s %s:" % ("if" if i == 0 else "elif", condition), line)
+                _generate(body, lines, depth + 1, origins)
+            if otherwise:
+                add("else:")
+                _generate(otherwise, lines, depth + 1, origins)
+
+class Templates(object):
+    """
+    A set of named templates: the defaults, overridden by the .tpl files of
+    'directory' if given.
+    """
+
+    def __init__(self, directory=None):
+        self._sources = dict(DEFAULT_TEMPLATES)
+        if directory is not None:
+            filenames = glob.glob(os.path.join(directory, "*" + TEMPLATE_EXTENSION))
+            if not filenames:
+                raise TemplateError("no %s files in '%s'" % (TEMPLATE_EXTENSION, directory))
+            for filename in filenames:
+                with open(filename, "r") as f:
+                    self._sources[os.path.basename(filename)[:-len(TEMPLATE_EXTENSION)]] = f.read()
+        for name in self._sources:
+            compileTemplate(self._sources[name], name) # report errors early
+
+    def key(self):
+        """
+        Returns a stable string identifying the templates.
+        """
+        h = hashlib.sha1()
+        for name in sorted(self._sources):
+            h.update(("%s\0%s\0" % (name, self._sources[name])).encode())
+        return h.hexdigest()
+
+    def render(self, name, context, _including=()):
+        """
+        Renders the template 'name' and yields its output in chunks.
+        """
+        if name not in self._sources:
+            raise TemplateError("unknown template '%s'" % name)
+        if name in _including:
+            raise TemplateError("template '%s' includes itself: %s" % (name, " -> ".join(_including + (name,))))
+        code, origins = compileTemplate(self._sources[name], name)
+        scope = dict(context)
+        scope["__builtins__"] = builtins
+
+        def include(template, extra):
+            return self.render(template, context if extra is None else dict(context, **extra), _including + (name,))
+
+        return _reported(FunctionType(code, scope)(include), name, code, origins)
+
+def _reported(chunks, name, code, origins):
+    """
+    Yields the 'chunks' of the template 'name' rendered by 'code', raising
+    what its expressions raise as TemplateError (see compileTemplate).
+    """
+    try:
+        yield from chunks
+    except TemplateError:
+        raise
+    except Exception as e:
+        line, tb = None, e.__traceback__
+        while tb is not None:
+            if tb.tb_frame.f_code is code and tb.tb_lineno <= len(origins):
+                line = origins[tb.tb_lineno - 1]
+            tb = tb.tb_next
+        raise TemplateError("template '%s'%s: %s: %s"
+                            % (name, ", line %d" % line if line else "", type(e).__name__, e)) from e
+
+BUILTIN = "builtin"
+
+_loaded = {}
+
+def loadTemplates(directory=BUILTIN):
+    """
+    Returns the templates of 'directory', or the built-in ones. Template sets
+    are loaded and compiled once per process, and again only if the files of
+    the directory changed.
+    """
+    if directory in (None, BUILTIN):
+        directory = None
+    key = None
+    if directory is not None:
+        key = [os.path.abspath(directory)]
+        for filename in sorted(glob.glob(os.path.join(directory, "*" + TEMPLATE_EXTENSION))):
+            st = os.stat(filename)
+            key.append((filename, st.st_mtime_ns, st.st_size))
+        key = tuple(key)
+    templates = _loaded.get(key)
+    if templates is None:
+        templates = Templates(directory)
+        for stale in [k for k in _loaded if k is not None and key is not None and k[0] == key[0]]:
+            del _loaded[stale]
+        _loaded[key] = templates
+    return templates
@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+tbWatch
+=======
+
+Watches a source tree and regenerates testbenches as files are saved. Most
+edits only touch architecture bodies, which the testbench does not depend
+on, so a changed file is reparsed but its testbench is only rendered and
+written again when the fingerprint of its interface changed: the ports,
+generics, clock and reset of its entities, its library clauses and the
+constants and types of the packages it uses. The files of the work packages
+a file uses are polled along with it.
+
+The tree is polled, bursts of saves are debounced, and files are parsed on a
+bounded process pool.
+"""
+
+import hashlib, io, json, os, signal, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+import tb_gen, tbBatch
+from tbBatch import Result
+
+def interfaceFingerprint(model):
+    """
+    Returns a stable hash of what the testbench of the parsed file 'model'
+    depends on.
+    """
+    entities = []
+    for entity in model.getEntities():
+        entities.append([
+            entity.getName(),
+            [[p.getName(), p.getPortType(), p.getType()] for p in entity.getPorts().values()],
+            [[g.getName(), g.getType(), g.getValue()] for g in entity.getGenerics().values()],
+            entity.clk, entity.rst, entity.rstActiveLow,
+        ])
+    libs = [[l.getName(), l.getPackages()] for l in model.getLibs()]
+    packages = []
+    for package in model.getPackages():
+        packages.append([
+            package.getName(),
+            [[c.getName(), c.getType(), c.getValue()] for c in package.getConstants().values()],
+            sorted(package.getTypes().items()),
+        ])
+    return hashlib.sha1(json.dumps([libs, entities, packages]).encode()).hexdigest()
+
+def watchOne(source, settings=None, headers_only=False, previous=None):
+    """
+    Parses 'source' and regenerates its testbench unless the fingerprint of
+    its interface is 'previous'. Returns the Result, the fingerprint (None if
+    the file could not be parsed) and whether the testbench was rendered.
+    """
+    if settings is not None:
+        settings.interactive = False
+
+    out = io.StringIO()
+    testbenches, ok, fingerprint, rendered, dependencies = [], False, None, False, {}
+    with redirect_stdout(out):
+        try:
+            model = tb_gen.parseFile(source, headers_only)
+            fingerprint = interfaceFingerprint(model)
+            tb_gen.useModel(model, settings)
+            outputs = tb_gen.testbenchFilenames(source, model)
+            testbenches = [t for _, t in outputs]
+            testbenches += [v for v in (tb_gen.vectorFilename(e, t) for e, t in outputs) if v is not None]
+            if fingerprint != previous or not all(os.path.isfile(t) for t in testbenches):
+                for entity, testbench in outputs:
+                    tb_gen.writeTestbench(entity, testbench)
+                rendered = True
+            dependencies = tb_gen.packageStamps(model)
+            ok = True
+        except SystemExit:
+            pass
+        except Exception as e:
+            print("error: %s" % e)
+    return Result(source, testbenches, ok, out.getvalue().strip(), dependencies=dependencies), fingerprint, rendered
+
+def _ignoreInterrupts():
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # the parent stops the pool
+
+def _stat(source):
+    try:
+        st = os.stat(source)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _stamp(source, packages):
+    """
+    Returns the stat of 'source' and of its package files 'packages', or
+    None if 'source' is gone.
+    """
+    st = _stat(source)
+    if st is None:
+        return None
+    return (st, tuple((p, _stat(p)) for p in packages))
+
+def watch(paths, jobs=None, settings=None, headers_only=False, interval=1.0, debounce=0.5, out=sys.stdout):
+    """
+    Polls 'paths' every 'interval' seconds until interrupted. Every file is
+    processed once at startup, and then whenever it changed and was left
+    alone for 'debounce' seconds. At most 'jobs' files are processed at a
+    time.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_ignoreInterrupts) as pool:
+        try:
+            _poll(pool, paths, jobs, settings, headers_only, interval, debounce, out)
+        except KeyboardInterrupt:
+            pool.shutdown(cancel_futures=True)
+            raise
+
+def _poll(pool, paths, jobs, settings, headers_only, interval, debounce, out):
+    fingerprints = {}   # source -> fingerprint of its last successful parse
+    done = {}           # source -> stamp it was last processed at
+    packages = {}       # source -> package files of its last successful parse
+    changed = {}        # source -> (stamp, time it was first seen at)
+    running = {}        # future -> (source, stamp)
+
+    sources = tbBatch.findSources(paths)
+    while True:
+        now = time.monotonic()
+        for source in sources:
+            st = _stamp(source, packages.get(source, ()))
+            if st is None or st == done.get(source):
+                changed.pop(source, None)
+                continue
+            if source not in done:
+                since = float("-inf") # never seen: no need to wait
+            else:
+                since = changed[source][1] if source in changed and changed[source][0] == st else now
+            changed[source] = (st, since)
+
+        busy = set(s for s, _ in running.values())
+        for source, (st, since) in sorted(changed.items(), key=lambda c: c[1][1]):
+            if len(running) >= jobs * 2:
+                break
+            if source in busy or now - since < debounce:
+                continue
+            del changed[source]
+            done[source] = st
+            future = pool.submit(watchOne, source, settings, headers_only, fingerprints.get(source))
+            running[future] = (source, st)
+
+        for future in [f for f in running if f.done()]:
+            source, st = running.pop(future)
+            result, fingerprint, rendered = future.result()
+            if not result.ok:
+                out.write("FAILED %s\n" % source)
+                for line in result.messages.splitlines():
+                    out.write("\t%s\n" % line)
+                fingerprints.pop(source, None)
+                continue
+            # the package files as they were parsed: a later change is seen at the next poll
+            packages[source] = sorted(result.dependencies)
+            done[source] = (st[0], tuple((p, tuple(result.dependencies[p][:2])) for p in packages[source]))
+            if not result.testbenches:
+                pass # no entity, e.g. a package
+            elif rendered and fingerprints.get(source) is not None:
+                out.write("%s: interface changed, %s regenerated\n" % (source, ", ".join(result.testbenches)))
+            elif rendered:
+                out.write("%s: %s generated\n" % (source, ", ".join(result.testbenches)))
+            fingerprints[source] = fingerprint
+        out.flush()
+
+        time.sleep(interval)
+        with redirect_stdout(io.StringIO()): # don't repeat the warnings every poll
+            sources = tbBatch.findSources(paths)
+        present = set(sources)
+        for source in [s for s in done if s not in present]:
+            del done[source]
+            fingerprints.pop(source, None)
+            packages.pop(source, None)
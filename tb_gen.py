@@ -1,167 +1,579 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
-import sys
+import mmap, sys, os, threading
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["run"]:
+        # Simulation of the generated testbenches, see tbRun
+        import tbRun
+        sys.exit(tbRun.main(sys.argv[2:], "tb_gen.py run"))
+    # A running daemon takes a single file before the generator is imported
+    import tbClient
+    status = tbClient.run(sys.argv[1:])
+    if status is not None:
+        sys.exit(status)
+
+import tbProfile, tbStimulus
 from vhdl import *
 from vParser import *
+from tbSettings import Settings, loadSettings, DEFAULTS, SETTINGS_FILENAME
+from tbCache import Cache, CACHE_FILENAME, hashFile
+from tbTemplate import loadTemplates, TemplateError
+
+# The model and settings testbenches are rendered from, per thread, so
+# several files can be generated at once (see useModel)
+_state = threading.local()
+
+def currentModel():
+    return getattr(_state, "vhdl", None)
+
+def currentSettings():
+    settings = getattr(_state, "settings", None)
+    if settings is None:
+        settings = _state.settings = Settings()
+    return settings
 
 def libraryTb():
+    """
+    Returns the template context of the library and use clauses.
+    """
     libs, uses = [], []
-    for l in vhdl.getLibs():
-        uses += ['use %s;' % p for p in l.getPackages()]
+    for l in currentModel().getLibs():
+        uses += l.getPackages()
         if l.getName() == "work":
             continue # skip work library, but not work packages
-        libs += ['library %s;\n' % l.getName()]
-    numeric_std = 'use ieee.numeric_std.all;'
-    if numeric_std not in uses and 'library ieee;\n' in libs:
-        uses += [numeric_std] 
-    return "%s%s\n\n" % ("\n".join(libs), "\n".join(uses))
-
-def entityTb():
-    entities = ['entity tb_%s is\nend tb_%s;' % (a.getEntity().getName(), a.getEntity().getName()) for a in vhdl.getArchitectures()]
-    return "\n".join(entities) + "\n\n"
-
-def architectureTb():
-    result = ""
-    for architecture in vhdl.getArchitectures():
-        entity = architecture.getEntity()
-        clk = clockTb()
-        generics = genericsTb()
-        result += 'architecture behav of tb_%s is\n\tcomponent %s\n' % (entity.getName(), entity.getName())
-        result += generics[1] + portsTb() + generics[0] + clk[0] + dutSignalsTb() + dutTb() + clk[1] + resetTb()
-        result += "\n\n\tstim_process: process\nbegin\n\t\t"
-        if entity.rst:
-            result += "wait until {0} = '{1}';\n\t\t".format(entity.rst, int(entity.rstActiveLow))
-        result += "--insert stimulus here\n\n\t\tassert false\n\t\t\treport \"Simulation finished\"\n\t\t\tseverity failure;\n\tend process stim_process;\n\nend behav;"
-    return result
-
-def genericsTb():
-    result = '\tgeneric (\n\t\t'
-    constants = ""
-    for arch in vhdl.getArchitectures():
-        ent = arch.getEntity()
-        generics = ['\t{0} : {1};\n'.format(g.getName(), g.getType()) for g in ent.getGenerics().values()]
-        result += "\t\t".join(generics)[:-2] + '\n\t);\n'
-        if generics == []:
-            result = ""
-        for g in ent.getGenerics().values():
-            constants += '\tconstant {0} : {1} := {2};\n'.format(g.getName(), g.getType(), g.getValue())
-    return (constants, result)
-
-def portsTb():
-    result = '\tport (\n\t\t'
-    for arch in vhdl.getArchitectures():
-        ent = arch.getEntity()
-        ports = ['\t{0} : {1} {2};\n'.format(p.getName(), p.getPortType(), p.getType()) for p in ent.getPorts().values()]
-        result += "\t\t".join(ports)[:-2] + '\n\t);\n\tend component;\n\n'
-    return result
-
-def dutSignalsTb():
-    result = ""
-    for arch in vhdl.getArchitectures():
-        e = arch.getEntity()
-        result += "\n".join(['\tsignal %s : %s;' % (p.getName(), p.getType()) for p in e.getPorts().values()])
-        result += '\n\n\tbegin\n'
-    return result
-
-def dutTb():
-    result = ""
-    for architecture in vhdl.getArchitectures():
-        entity = architecture.getEntity()
-        result += '\tUUT: %s ' % entity.getName()
-        g = entity.getGenerics().values()
-        if g:
-            result += "generic map (\n"
-            for generic in g:
-                result += '\t\t%s => %s,\n' % (generic.getName(), generic.getName())
-            result = result[:-2] + "\n\t)\n"
-        result += "\tport map (\n"
-        for p in entity.getPorts().values():
-            result += '\t\t%s => %s,\n' % (p.getName(), p.getName())
-        result = result[:-2] + "\n\t);\n"
-    return result
-
-def resetTb():
-    clk = True
-    clkStr = "*clk_period"
-    rst_len = 0
-    entity = list(vhdl.getEntities())[0]
+        libs += [l.getName()]
+    numeric_std = 'ieee.numeric_std.all'
+    if numeric_std not in uses and 'ieee' in libs:
+        uses += [numeric_std]
+    return {"libraries": libs, "uses": uses}
+
+def entityTb(entity):
+    """
+    Returns the template context of the testbench of 'entity'.
+    """
+    clock_period = clockTb(entity)
+    reset_hold = resetTb(entity)
+    return {
+        "name": entity.getName(),
+        "entity": entity,
+        "generics": list(entity.getGenerics().values()),
+        "ports": list(entity.getPorts().values()),
+        "clk": entity.clk,
+        "clock_period": clock_period,
+        "rst": entity.rst,
+        "rst_active_low": entity.rstActiveLow,
+        "reset_process": bool(reset_hold),
+        "reset_hold": reset_hold,
+        "stimulus": stimulusTb(entity),
+    }
+
+def testbenchTb(entity=None):
+    """
+    Renders the testbench of 'entity', or of every entity of the parsed file,
+    and yields it in chunks.
+    """
+    vhdl, settings = currentModel(), currentSettings()
+    context = libraryTb()
+    entities = [entity] if entity is not None else [a.getEntity() for a in vhdl.getArchitectures()]
+    context["units"] = [entityTb(e) for e in entities]
+    if any(u["stimulus"] for u in context["units"]) and "std.textio.all" not in context["uses"]:
+        context["uses"].append("std.textio.all")
+    return loadTemplates(settings.get("templates")).render("testbench", context)
+
+def stimulusTb(entity, warn=False):
+    """
+    Returns the Stimulus of the testbench of 'entity', or None if it gets no
+    stimulus vectors. With 'warn' the input ports left out are reported.
+    """
+    vhdl, settings = currentModel(), currentSettings()
+    name = entity.getName()
+    if settings.get("stimulus", name) == "none":
+        return None
+    constants, types = {}, {}
+    for package in vhdl.getPackages():
+        constants = tbStimulus.constantValues(package.getConstants().values(), constants)
+        types.update((t.lower(), d) for t, d in package.getTypes().items())
+    constants = tbStimulus.constantValues(entity.getGenerics().values(), constants)
+    inputs = []
+    for p in entity.getPorts().values():
+        if p.getPortType().lower() != "in" or p.getName() in (entity.clk, entity.rst):
+            continue
+        stimulus_input = tbStimulus.stimulusInput(p, constants, types)
+        if stimulus_input is not None:
+            inputs.append(stimulus_input)
+        elif warn:
+            report("warning: entity '%s': port '%s' of type '%s' gets no stimulus" % (name, p.getName(), p.getType()))
+    if not inputs:
+        return None
+    period = "clk_period" if entity.clk else "%d ns" % settings.get("clock_period", name)
+    return tbStimulus.Stimulus("tb_%s.vec" % name, inputs, period)
+
+def vectorFilename(entity, tb_filename):
+    """
+    Returns the name of the vector file read by the testbench 'tb_filename'
+    of 'entity', or None if it gets no stimulus.
+    """
+    stimulus = stimulusTb(entity)
+    return os.path.join(os.path.dirname(tb_filename), stimulus.file) if stimulus is not None else None
+
+def vectorsTb(entity, tb_filename):
+    """
+    Returns the name and the content of the vector file read by the
+    testbench 'tb_filename' of 'entity', or None if it gets no stimulus.
+    """
+    stimulus = stimulusTb(entity, warn=True)
+    if stimulus is None:
+        return None
+    settings = currentSettings()
+    name = entity.getName()
+    with tbProfile.phase("vectors"):
+        content = tbStimulus.formatVectors([i.width for i in stimulus.inputs], settings.get("stimulus", name),
+                                           settings.get("stimulus_vectors", name), settings.get("stimulus_seed", name))
+    return os.path.join(os.path.dirname(tb_filename), stimulus.file), content
+
+def resetTb(entity):
+    """
+    Returns how long the reset of 'entity' is held for, or "" for no reset
+    process.
+    """
     rst = entity.rst
-    if not entity.clk:
-        confirm = input("No clock is present, but reset is. Add reset anyway? [Y/n] ")
+    if rst and not entity.clk:
+        confirm = ask("No clock is present, but reset is. Add reset anyway? [Y/n] ")
         if "n" in confirm.lower():
-            rst = ""
-        else:
-            clkStr = "100 ns"
-            clk = False
+            return ""
+        return "100 ns"
     if rst:
-        while True and clk:
-            try:
-                rst_len = input("Number of periods to hold rst (default 5): ") 
-                if rst_len == "":
-                    rst_len = "5"
-                rst_len = int(rst_len) # rising clk edges happen at half periods, so this forces falling edge deassertion
-                if rst_len > 0:
-                    break
-            except Exception as e:
-                print(e)
-                print("error: Invalid reset length")
-
-        return "\n\n\trst_process: process\n\tbegin\n\t\t%s <= '%d';\n\t\twait for %s%s;\n\t\t%s <= '%d';\n\t\twait;\n\tend process rst_process;" % (rst, not entity.rstActiveLow, rst_len if clk else "", clkStr, rst, entity.rstActiveLow)
-    else:
-        return ""
-
-def clockTb():
-    clk = False
-    if list(vhdl.getEntities())[0].clk:
-        while True:
-            try:
-                clk_freq = input("Enter clock period (ns) (default 10): ")
-                if not clk_freq:
-                    clk_freq = "10"
-                clk_freq = int(clk_freq)
-                if clk_freq > 0:
-                    break
-            except Exception as e:
-                print(e)
-                print("error: Invalid frequency")
-
-        return ("\tconstant clk_period : time := {0} ns;\n".format(clk_freq), "\n\n\tclk_process: process\n\tbegin\n\t\t{0} <= '0';\n\t\twait for clk_period/2;\n\t\t{0} <= '1';\n\t\twait for clk_period/2;\n\tend process clk_process;".format(list(vhdl.getEntities())[0].clk)) 
-    else:
-        return ("", "")
+        # rising clk edges happen at half periods, so this forces falling edge deassertion
+        rst_len = askSetting(entity, "reset_cycles", "Number of periods to hold rst (default %d): ")
+        return "%d*clk_period" % rst_len
+    return ""
+
+def clockTb(entity):
+    """
+    Returns the clock period of 'entity' in ns, or None if it has no clock.
+    """
+    if entity.clk:
+        return askSetting(entity, "clock_period", "Enter clock period (ns) (default %d): ")
+    return None
+
+def ask(prompt, default=""):
+    """
+    Prompts the user, or returns 'default' unless running interactively.
+    """
+    if not currentSettings().interactive:
+        return default
+    return input(prompt)
+
+def askSetting(entity, key, prompt):
+    """
+    Returns a setting of 'entity'. When running interactively the user is
+    asked for it once per entity, with the configured value as default.
+    """
+    settings = currentSettings()
+    answered = getattr(_state, "answered", None)
+    if answered is None:
+        answered = _state.answered = set()
+    name = entity.getName()
+    value = settings.get(key, name)
+    if not settings.interactive or (name.lower(), key) in answered:
+        return value
+    while True:
+        try:
+            settings.set(key, ask(prompt % value) or value, name)
+            break
+        except ValueError as e:
+            print("error: %s" % e)
+    answered.add((name.lower(), key))
+    return settings.get(key, name)
+
+def applySettings(entity):
+    """
+    Applies the clock/reset port and reset polarity overrides to 'entity'.
+    """
+    settings = currentSettings()
+    name = entity.getName()
+    for key, attr in (("clock", "clk"), ("reset", "rst")):
+        port = settings.get(key, name)
+        if port == "none":
+            setattr(entity, attr, "")
+        elif port != "auto":
+            match = [p for p in entity.getPorts() if p.lower() == port.lower()]
+            if match:
+                setattr(entity, attr, match[0])
+            else:
+                report("warning: entity '%s' has no port '%s', %s detection was kept" % (name, port, key))
+    polarity = settings.get("reset_polarity", name)
+    if polarity != "auto":
+        entity.rstActiveLow = polarity == "low"
+
+def testbenchFilenames(vhd_path, model):
+    """
+    Returns the entities of the parsed file 'model' with the names of their
+    testbenches, tb_<entity>.vhd next to 'vhd_path'. Naming them after the
+    entity rather than the file keeps the testbenches of different sources
+    apart.
+    """
+    directory = os.path.dirname(vhd_path)
+    return [(a.getEntity(), os.path.join(directory, "tb_" + a.getEntity().getName() + ".vhd"))
+            for a in model.getArchitectures()]
+
+def parseFile(vhd_path, headers_only=False):
+    """
+    Reads and parses 'vhd_path', along with the work packages it uses that
+    are declared next to it. With 'headers_only' the file is memory-mapped
+    and only its headers are scanned, which keeps memory low for huge
+    netlists.
+    """
+    with tbProfile.phase("read"):
+        vhd_file = map_file(vhd_path) if headers_only else read_file(vhd_path)
+    if tbProfile.current() is not None:
+        tbProfile.count("bytes", os.path.getsize(vhd_path))
+    try:
+        with tbProfile.phase("parse"):
+            model = parseVHDL(vhd_file, headers_only)
+        with tbProfile.phase("packages"):
+            resolvePackages(model, [os.path.dirname(vhd_path)])
+        return model
+    finally:
+        if isinstance(vhd_file, mmap.mmap):
+            vhd_file.close()
+
+def packageFiles(model):
+    """
+    Returns the files declaring the work packages the parsed file 'model'
+    uses, other than itself.
+    """
+    return sorted(set(p.getPath() for p in model.getPackages() if p.getPath() is not None))
+
+def packageStamps(model):
+    """
+    Returns the files of packageFiles, by name, with the (mtime, size, sha1)
+    of the content their packages were parsed from, as tbCache records them.
+    """
+    stamps = {}
+    for package in model.getPackages():
+        if package.getPath() is not None and package.getStamp() is not None:
+            stamps[package.getPath()] = list(package.getStamp())
+    for path in packageFiles(model):
+        if path not in stamps:
+            st = os.stat(path) # deserialized: stamp it now
+            stamps[path] = [st.st_mtime_ns, st.st_size, hashFile(path)]
+    return stamps
+
+def useModel(model, run_settings=None):
+    """
+    Makes 'model' the parsed file the testbenches of the current thread are
+    rendered from, with 'run_settings' if given, and applies the settings to
+    its entities.
+    """
+    if run_settings is not None:
+        _state.settings = run_settings
+    _state.vhdl = model
+    for entity in model.getEntities():
+        applySettings(entity)
+
+def renderTestbench(model, run_settings=None, entity=None):
+    """
+    Returns the testbench of 'entity', or of every entity of the parsed file
+    'model'.
+    """
+    useModel(model, run_settings)
+    with tbProfile.phase("emit"):
+        return "".join(testbenchTb(entity))
+
+def renderOutputs(entity, tb_filename):
+    """
+    Renders the testbench 'tb_filename' of 'entity' of the current model.
+    Returns it as a (filename, content) pair, followed by its vector file if
+    it gets stimulus vectors.
+    """
+    with tbProfile.phase("emit"):
+        outputs = [(tb_filename, "".join(testbenchTb(entity)))]
+    vectors = vectorsTb(entity, tb_filename)
+    if vectors is not None:
+        outputs.append(vectors)
+    return outputs
+
+def writeTestbench(entity, tb_filename):
+    """
+    Renders the testbench of 'entity' of the current model into 'tb_filename'
+    and writes its vector file. Returns the names of the files.
+
+    The testbench is written as it is rendered, so however wide the entity,
+    it is never held in memory as a whole.
+    """
+    chunks = testbenchTb(entity)
+    profile = tbProfile.current()
+    if profile is not None:
+        chunks = profile.timeChunks(chunks)
+    size = write_chunks(tb_filename, chunks)
+    if size is not None:
+        tbProfile.count("bytes_written", size)
+    vectors = vectorsTb(entity, tb_filename)
+    if vectors is None:
+        return [tb_filename]
+    filename, content = vectors
+    with tbProfile.phase("write"):
+        size = write_chunks(filename, (content,))
+    if size is not None:
+        tbProfile.count("bytes_written", size)
+    return [tb_filename, filename]
+
+def generateFile(vhd_path, run_settings=None, headers_only=False):
+    """
+    Parses 'vhd_path' and writes the testbenches of its entities next to it,
+    one entity after the other. Returns their file names, and those of their
+    vector files, along with the package files they depend on (see
+    packageStamps).
+    """
+    model = parseFile(vhd_path, headers_only)
+    useModel(model, run_settings)
+    written = []
+    for entity, tb_filename in testbenchFilenames(vhd_path, model):
+        written += writeTestbench(entity, tb_filename)
+    return written, packageStamps(model)
 
 if __name__ == "__main__":
+    import argparse, json
+    from contextlib import redirect_stdout
+    import tbBatch, tbDaemon, tbDepfile, tbIndex, tbWatch
+    from tbCache import toolStamp
 
-    if len(sys.argv) != 2:
-        print("usage: {} <VHDL file>.vhd".format(sys.argv[0]))
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Generate VHDL testbench templates.",
+                                     epilog="'%(prog)s run [PATH ...]' analyzes and runs the generated testbenches "
+                                            "(see '%(prog)s run --help'); name a file 'run' as './run'.")
+    parser.add_argument("paths", nargs="*", metavar="PATH",
+                        help="VHDL file, directory or glob pattern (with --entity, where to look for it)")
+    parser.add_argument("-e", "--entity", metavar="NAME",
+                        help="generate the testbench of the file declaring this entity, found through the index")
+    parser.add_argument("--index", metavar="FILE", default=tbIndex.INDEX_FILENAME,
+                        help="entity index used by --entity (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes in batch mode (default: %(default)s)")
+    parser.add_argument("--in-flight", type=int, metavar="N",
+                        help="files read but not yet written at a time in batch mode (default: 4 per job)")
+    parser.add_argument("-i", "--interactive", action="store_true",
+                        help="prompt for the clock period and reset length (single file only)")
+    parser.add_argument("-s", "--settings", metavar="FILE",
+                        help="settings file (default: %s if present)" % SETTINGS_FILENAME)
+    parser.add_argument("--clock-period", type=int, metavar="NS",
+                        help="clock period in ns (default: %d)" % DEFAULTS["clock_period"])
+    parser.add_argument("--reset-cycles", type=int, metavar="N",
+                        help="clock periods to hold the reset for (default: %d)" % DEFAULTS["reset_cycles"])
+    parser.add_argument("--reset-polarity", choices=["auto", "low", "high"],
+                        help="reset polarity, detected from the port name by default")
+    parser.add_argument("--clock", metavar="PORT",
+                        help="clock port, 'none' for no clock (detected by default)")
+    parser.add_argument("--reset", metavar="PORT",
+                        help="reset port, 'none' for no reset (detected by default)")
+    parser.add_argument("--templates", metavar="DIR",
+                        help="directory of .tpl files overriding the built-in templates")
+    parser.add_argument("--stimulus", choices=["none", "exhaustive", "random"],
+                        help="write stimulus vectors for the input ports, read by the testbench (default: none)")
+    parser.add_argument("--vectors", type=int, metavar="N",
+                        help="number of random stimulus vectors (default: %d)" % DEFAULTS["stimulus_vectors"])
+    parser.add_argument("--seed", type=int, metavar="N",
+                        help="seed of the random stimulus vectors (default: %d)" % DEFAULTS["stimulus_seed"])
+    parser.add_argument("--headers-only", action="store_true",
+                        help="memory-map the sources and only scan their headers (for huge netlists)")
+    parser.add_argument("--cache", metavar="FILE", default=CACHE_FILENAME,
+                        help="manifest of up to date testbenches (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="regenerate every testbench")
+    parser.add_argument("--depfiles", action="store_true",
+                        help="write a Make/Ninja depfile (.d) next to every testbench")
+    parser.add_argument("--manifest", metavar="FILE",
+                        help="write the testbenches of the run with their sources, packages and settings file as JSON")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="write the timings and counters of every file as JSON lines ('-' for stdout, the "
+                             "messages then go to stderr)")
+    parser.add_argument("--cprofile", metavar="FILE",
+                        help="write cProfile statistics of the run (of the main process only, see -j)")
+    parser.add_argument("--tracemalloc", metavar="FILE",
+                        help="trace allocations and write the top allocation sites (of the main process only, see -j)")
+    parser.add_argument("-w", "--watch", action="store_true",
+                        help="keep running and regenerate testbenches whose entity interface changed")
+    parser.add_argument("--interval", type=float, default=1.0, metavar="SECONDS",
+                        help="how often --watch polls the sources (default: %(default)s)")
+    parser.add_argument("--debounce", type=float, default=0.5, metavar="SECONDS",
+                        help="how long a changed file must be left alone before --watch processes it (default: %(default)s)")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="socket of the generator daemon (default: $TB_GEN_SOCKET or %s)" % tbDaemon.defaultSocket())
+    parser.add_argument("--no-daemon", action="store_true",
+                        help="generate in this process even if a daemon is running")
+    parser.add_argument("--emit-json", action="store_true",
+                        help="print the interface of every entity as a JSON line instead of generating testbenches")
+    args = parser.parse_args()
+    if not args.paths and not args.entity:
+        parser.error("the following arguments are required: PATH")
+
+    # With '--profile -', stdout only gets the JSON lines of the profile
+    profile_out = sys.stdout
+    if args.profile == "-":
+        sys.stdout = sys.stderr
+
+    if args.entity:
+        with tbIndex.Index(args.index) as index:
+            record = tbIndex.resolveEntity(index, args.entity, args.paths or ["."], args.jobs)
+        if record is None:
+            print("error: no entity '%s' was found" % args.entity)
+            sys.exit(1)
+        args.paths = [os.path.relpath(record.path)]
 
-    vhdl_filename = sys.argv[1].split('.')
+    if args.emit_json:
+        # Interfaces only, as tbIndex records them: nothing is rendered or
+        # written, and the entities of each file are printed once it's parsed
+        with redirect_stdout(sys.stderr):
+            sources = tbBatch.findSources(args.paths)
+        failed = False
+        for path, records in tbIndex.scanInterfaces(sources, args.jobs):
+            if records is None:
+                print("error: failed to parse '%s'" % path, file=sys.stderr)
+                failed = True
+                continue
+            for record in records:
+                sys.stdout.write(json.dumps(record._asdict()) + "\n")
+            sys.stdout.flush()
+        sys.exit(1 if failed else 0)
+
+    overrides = {
+        "clock_period": args.clock_period,
+        "reset_cycles": args.reset_cycles,
+        "reset_polarity": args.reset_polarity,
+        "clock": args.clock,
+        "reset": args.reset,
+        "templates": args.templates,
+        "stimulus": args.stimulus,
+        "stimulus_vectors": args.vectors,
+        "stimulus_seed": args.seed,
+    }
+    try:
+        run_settings = loadSettings(args.settings, overrides, args.interactive)
+    except ValueError as e:
+        print("error: %s" % e)
+        sys.exit(1)
 
-    if vhdl_filename[-1] != 'vhd':
-        print('error: file must have a vhd extenstion')
+    try:
+        templates = loadTemplates(run_settings.get("templates"))
+    except (OSError, TemplateError) as e:
+        print("error: %s" % e)
         sys.exit(1)
 
-    vhdl_filename = vhdl_filename[0].split('/')
-    vhdl_filename[-1] = 'tb_' + vhdl_filename[-1]
-    # VHDL_tb filename
-    vhdl_filename = "/".join(vhdl_filename) + '.vhd'
-
-    # VHDL content
-    vhd_file = read_file(sys.argv[1])
-
-    # Creating VHDL obj
-    vhdl = VHDL()
-    libs = parseLibs(vhd_file)
-    [vhdl.addLibrary(l) for l in libs]
-    [vhdl.setEntity(e) for e in parseEntities(vhd_file)]
-
-    # Get each entity in 'vhdl' and adds each architecture in 'vhdl'
-    for entity in vhdl.getEntities():
-        arch = parseArchitectureOfEntity(vhd_file, entity)
-        if arch != "":
-            vhdl.setArchitecture(arch)
-
-    # Write to file
-    write_file(vhdl_filename, libraryTb() + entityTb() + architectureTb())
-    print("\nThe file '%s' was created successfully." % vhdl_filename)
+    # Answers to prompts are not part of the settings, so they can't be cached
+    cache = None
+    if not args.no_cache and not args.interactive:
+        cache = Cache(args.cache, run_settings, templates.key())
+
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if args.tracemalloc:
+        import tracemalloc
+        tracemalloc.start()
+
+    def writeProfile(reports):
+        if args.cprofile:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+        if args.tracemalloc:
+            with open(args.tracemalloc, "w") as f:
+                for stat in tracemalloc.take_snapshot().statistics("lineno")[:50]:
+                    f.write("%s\n" % stat)
+        if args.profile == "-":
+            tbProfile.writeReport(reports, profile_out)
+        elif args.profile:
+            with open(args.profile, "w") as f:
+                tbProfile.writeReport(reports, f)
+
+    settings_file = args.settings
+    if settings_file is None and os.path.isfile(SETTINGS_FILENAME):
+        settings_file = SETTINGS_FILENAME
+
+    def writeDependencies(generated):
+        """
+        Writes the depfiles and the manifest of the (source, outputs,
+        package files) in 'generated'.
+        """
+        if not (args.depfiles or args.manifest):
+            return
+        inputs = tbDepfile.inputFiles(settings_file, run_settings.get("templates"))
+        entries = []
+        for source, outputs, packages in generated:
+            if args.depfiles:
+                tbDepfile.writeDepfiles(source, outputs, packages, inputs)
+            entries += tbDepfile.manifestEntries(source, outputs, packages, settings_file)
+        if args.manifest:
+            tbDepfile.writeManifest(args.manifest, entries, tbDepfile.inputFiles(None, run_settings.get("templates")))
+
+    if args.watch:
+        if args.interactive:
+            print("error: --watch can't prompt, drop -i")
+            sys.exit(1)
+        try:
+            tbWatch.watch(args.paths, args.jobs, run_settings, args.headers_only, args.interval, args.debounce)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    if len(args.paths) == 1 and os.path.isfile(args.paths[0]):
+        if not args.paths[0].lower().endswith(SOURCE_EXTENSIONS):
+            print('error: file must have a vhd or vhdl extension')
+            sys.exit(1)
+
+        state = cache.check(args.paths[0]) if cache is not None else {}
+        if state is None:
+            for vhdl_filename in cache.testbenches(args.paths[0]):
+                print("The file '%s' is up to date." % os.path.relpath(vhdl_filename))
+            writeDependencies([(args.paths[0], cache.testbenches(args.paths[0]), cache.dependencies(args.paths[0]))])
+            writeProfile([])
+            sys.exit(0)
+
+        # A running daemon has the file parsed already, unless it changed
+        reply, reports = None, []
+        if not (args.no_daemon or args.interactive or args.profile or args.cprofile or args.tracemalloc):
+            version = toolStamp()
+            reply = tbDaemon.request({
+                "op": "generate",
+                "cwd": os.getcwd(),
+                "path": args.paths[0],
+                "version": version,
+                "settings": args.settings,
+                "overrides": overrides,
+                "headers_only": args.headers_only,
+            }, args.socket)
+            if reply is not None and reply["version"] != version:
+                reply = None
+        if reply is not None:
+            if reply["messages"]:
+                print(reply["messages"])
+            if not reply["ok"]:
+                sys.exit(1)
+            vhdl_filenames, packages = reply["testbenches"], reply["dependencies"]
+        else:
+            try:
+                with tbProfile.profiling(args.paths[0]) as profile:
+                    vhdl_filenames, packages = generateFile(args.paths[0], run_settings, args.headers_only)
+            except (VHDLError, TemplateError) as e:
+                print("error: %s" % e)
+                sys.exit(1)
+            reports = [profile.report()]
+        if cache is not None:
+            cache.record(args.paths[0], state, vhdl_filenames, packages)
+            cache.save()
+        writeDependencies([(args.paths[0], vhdl_filenames, packages)])
+        print()
+        for vhdl_filename in vhdl_filenames:
+            print("The file '%s' was created successfully." % vhdl_filename)
+        writeProfile(reports)
+        sys.exit(0)
+
+    # Batch mode: every .vhd file found, without prompting
+    results = tbBatch.runBatch(tbBatch.findSources(args.paths), args.jobs, run_settings, cache, args.headers_only,
+                               bool(args.profile), args.in_flight)
+    ok = tbBatch.printSummary(results, sys.stdout)
+    writeDependencies([(r.source, r.testbenches, r.dependencies) for r in results if r.ok])
+    writeProfile([r.profile for r in results if r.profile is not None])
+    sys.exit(0 if ok else 1)
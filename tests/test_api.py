@@ -0,0 +1,34 @@
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tbApi
+from vParser import PackageCache
+
+TOP = """use work.pkg.all;
+entity top is
+    port (a : in bit);
+end top;
+architecture rtl of top is
+begin
+end rtl;
+"""
+
+class _BrokenCache(PackageCache):
+
+    def packagesOf(self, path):
+        raise TypeError("broken package file '%s'" % path)
+
+def test_unterminated_package_sibling(tmp_path):
+    with open(os.path.join(str(tmp_path), "pkg.vhd"), "w") as f:
+        f.write("package pkg is\n  constant W : integer := 4;\n")
+    testbench = tbApi.generate_testbench(TOP, search_paths=[str(tmp_path)], package_cache=PackageCache())
+    assert "entity tb_top is" in testbench.lower()
+
+def test_broken_package_sibling_raises_vhdl_error(tmp_path):
+    with open(os.path.join(str(tmp_path), "pkg.vhd"), "w") as f:
+        f.write("package pkg is\nend pkg;\n")
+    with pytest.raises(tbApi.VHDLError):
+        tbApi.generate_testbench(TOP, search_paths=[str(tmp_path)], package_cache=_BrokenCache())
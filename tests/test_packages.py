@@ -0,0 +1,36 @@
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tb_gen, tbIndex
+from vhdl import collecting
+from vParser import PackageCache
+
+UNTERMINATED_PACKAGE = """package pkg is
+  constant W : integer := 4;
+"""
+
+TOP = """use work.pkg.all;
+entity top is
+    port (a : in bit);
+end top;
+architecture rtl of top is
+begin
+end rtl;
+"""
+
+def _write(directory, name, text):
+    path = os.path.join(str(directory), name)
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+def test_unterminated_package_sibling(tmp_path):
+    _write(tmp_path, "pkg.vhd", UNTERMINATED_PACKAGE)
+    top = _write(tmp_path, "top.vhd", TOP)
+    with collecting():
+        model = tb_gen.parseFile(top)
+        assert [e.getName() for e in model.getEntities()] == ["top"]
+        assert PackageCache().find("pkg", [str(tmp_path)]).getConstants() == {}
+        records = tbIndex.entityRecords(top)
+    assert [r.name for r in records] == ["top"]
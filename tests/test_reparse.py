@@ -0,0 +1,29 @@
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vhdl import collecting
+from vParser import parseVHDL, reparseVHDL
+
+SOURCE = """entity e is
+    port (a : in bit);
+end e;
+architecture rtl of e is
+begin
+end rtl;
+"""
+
+def _libraries(model):
+    return [(l.getName(), l.getPackages()) for l in model.getLibs()]
+
+def test_typing_at_end_of_file():
+    text = "library ieee;\nuse ieee.std_logic_1164.all;\n"
+    source = SOURCE
+    with collecting():
+        model = parseVHDL(source)
+        for c in text:
+            source, model = reparseVHDL(model, source, len(source), 0, c)
+        full = parseVHDL(source)
+    assert source == SOURCE + text
+    assert _libraries(model) == _libraries(full)
+    assert ("ieee", ["ieee.std_logic_1164.all"]) in _libraries(model)
@@ -0,0 +1,29 @@
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tbTemplate
+from tbTemplate import Templates, TemplateError
+
+def _templates(sources, tmp_path):
+    for name, source in sources.items():
+        with open(os.path.join(str(tmp_path), name + tbTemplate.TEMPLATE_EXTENSION), "w") as f:
+            f.write(source)
+    return Templates(str(tmp_path))
+
+def test_runtime_error_names_template_and_line(tmp_path):
+    templates = _templates({"entity": "entity tb_{{ name }} is\n{% if name %}\n{{ name.nope() }}\n{% endif %}\n"}, tmp_path)
+    with pytest.raises(TemplateError, match=r"template 'entity', line 3: AttributeError"):
+        "".join(templates.render("entity", {"name": "e"}))
+
+def test_include_cycle(tmp_path):
+    templates = _templates({"entity": "{% include library %}", "library": "{% include entity %}"}, tmp_path)
+    with pytest.raises(TemplateError, match="includes itself"):
+        "".join(templates.render("entity", {}))
+
+def test_compiled_templates_are_bounded():
+    for i in range(tbTemplate.COMPILED_TEMPLATES + 10):
+        tbTemplate.compileTemplate("{{ %d }}" % i)
+    assert len(tbTemplate._compiled) == tbTemplate.COMPILED_TEMPLATES
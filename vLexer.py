@@ -0,0 +1,423 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+vLexer
+======
+
+Single pass, case-insensitive and comment-aware tokenizer for VHDL sources.
+
+Every token is a ``Token(kind, value, pos)`` tuple where ``value`` is the text
+as written in the source and ``pos`` its offset. Reserved words and delimiters
+use themselves (lower case) as ``kind``, so ``LIBRARY`` has the kind
+``"library"`` and ``:=`` the kind ``":="``. Everything else is one of ``"id"``,
+``"number"``, ``"string"``, ``"bitstring"``, ``"char"`` or ``"unknown"``.
+
+Sources may also be bytes-like objects such as a read-only ``mmap``, in which
+case offsets are byte offsets and token values are decoded as latin-1.
+"""
+
+import mmap, re
+from collections import deque, namedtuple
+
+import tbProfile
+
+Token = namedtuple("Token", ["kind", "value", "pos"])
+
+SUBPROGRAMS = frozenset(["function", "procedure"])
+
+# Keywords that may follow 'end' without closing a design unit or subprogram
+NESTED_ENDS = frozenset([
+    "if", "loop", "case", "record", "units", "component", "protected",
+    "process", "block", "generate", "for"
+])
+
+RESERVED = frozenset("""
+    abs access after alias all and architecture array assert assume
+    assume_guarantee attribute begin block body buffer bus case component
+    configuration constant context cover default disconnect downto else elsif
+    end entity exit fairness file for force function generate generic group
+    guarded if impure in inertial inout is label library linkage literal loop
+    map mod nand new next nor not null of on open or others out package parameter
+    port postponed procedure process property protected pure range record
+    register reject release rem report restrict restrict_guarantee return rol
+    ror select sequence severity shared signal sla sll sra srl strong subtype
+    then to transport type unaffected units until use variable vmode vprop
+    vunit wait when while with xnor xor
+""".split())
+
+_TOKEN_RE = re.compile(r"""
+      (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<bitstring>[0-9]*(?:[uUsS]?[bBoOxX]|[dD])"[^"\n]*")
+    | (?P<id>[a-zA-Z][a-zA-Z0-9_]*|\\[^\\\n]*\\)
+    | (?P<number>[0-9][0-9_]*(?:\#[0-9a-fA-F_.]+\#|\.[0-9_]+)?(?:[eE][+-]?[0-9_]+)?)
+    | (?P<string>"(?:[^"\n]|"")*")
+    | (?P<char>(?<![a-zA-Z0-9_)\]])'.')
+    | (?P<delim>=>|:=|<=|>=|/=|\*\*|<>|\?\?|\?/?=|\?[<>]=?|[-&'()*+,./:;<=>|\[\]?@^`])
+    | (?P<unknown>\S)
+""", re.VERBOSE | re.DOTALL)
+
+# The keywords 'TokenStream.skipBody' and 'TokenStream.skipDeclarations' react
+# to. Matches inside comments and string literals are discarded by looking at
+# the start of their line (see _isCode), so the regex engine alone walks
+# over bodies.
+_SKIP_RE = re.compile(r"""
+    \b(?P<kw>end|begin|function|procedure)\b
+""", re.VERBOSE | re.IGNORECASE | re.ASCII)
+
+# What can hide a keyword up to the end of the line: a comment or an
+# unterminated string literal
+_LINE_RE = re.compile(r"""
+    --|"(?:[^"\n]|"")*"?|(?<![a-zA-Z0-9_)\]])'.'
+""", re.VERBOSE)
+
+_TOKEN_RE_BYTES = re.compile(_TOKEN_RE.pattern.encode(), _TOKEN_RE.flags & ~re.UNICODE)
+_SKIP_RE_BYTES = re.compile(_SKIP_RE.pattern.encode(), _SKIP_RE.flags & ~re.UNICODE)
+_LINE_RE_BYTES = re.compile(_LINE_RE.pattern.encode(), _LINE_RE.flags & ~re.UNICODE)
+
+SOURCE_TYPES = (str, bytes, bytearray, memoryview, mmap.mmap)
+
+# Skipped regions are searched in windows of this size, so that the pages of a
+# memory-mapped source can be released as soon as they have been scanned
+_SKIP_WINDOW = 1 << 22
+
+_LINE_LOOKBACK = 4096
+
+def _isCode(line, pos):
+    """
+    Tells whether offset 'pos' of a line is outside of comments and strings.
+    """
+    for m in (_LINE_RE if isinstance(line, str) else _LINE_RE_BYTES).finditer(line, 0, pos):
+        value = m.group()
+        if value[:2] in ("--", b"--"):
+            return False
+        if value[:1] in ('"', b'"') and (len(value) == 1 or value[-1:] not in ('"', b'"')):
+            return False
+    return True
+
+def tokenize(source, pos=0):
+    """
+    Yields the tokens of ``source`` in order, starting at offset ``pos`` and
+    skipping whitespace and comments.
+    """
+    profile = tbProfile.current()
+    if profile is not None:
+        return _countTokens(_tokenize(source, pos), profile)
+    return _tokenize(source, pos)
+
+def _countTokens(tokens, profile):
+    n = 0
+    try:
+        for tok in tokens:
+            n += 1
+            yield tok
+    finally:
+        profile.count("tokens", n)
+
+def _tokenize(source, pos):
+    text = isinstance(source, str)
+    for m in (_TOKEN_RE if text else _TOKEN_RE_BYTES).finditer(source, pos):
+        kind = m.lastgroup
+        if kind == "comment":
+            continue
+        value = m.group() if text else m.group().decode("latin-1")
+        if kind == "id":
+            low = value.lower()
+            if low in RESERVED:
+                kind = low
+        elif kind == "delim":
+            kind = value
+        yield Token(kind, value, m.start())
+
+def tokenEnd(tok):
+    return tok.pos + len(tok.value)
+
+def joinTokens(tokens):
+    """
+    Rebuilds the text of a run of tokens, keeping a single space wherever the
+    source had whitespace or a comment between two tokens.
+    """
+    parts = []
+    last_end = None
+    for tok in tokens:
+        if last_end is not None and tok.pos > last_end:
+            parts.append(" ")
+        parts.append(tok.value)
+        last_end = tokenEnd(tok)
+    return "".join(parts)
+
+def splitTokens(tokens, kind):
+    """
+    Splits a list of tokens on every ``kind`` token outside of parentheses.
+    """
+    result, current = [], []
+    depth = 0
+    for tok in tokens:
+        if tok.kind == "(":
+            depth += 1
+        elif tok.kind == ")":
+            depth -= 1
+        elif tok.kind == kind and depth == 0:
+            result.append(current)
+            current = []
+            continue
+        current.append(tok)
+    if current:
+        result.append(current)
+    return result
+
+class TokenStream(object):
+    """
+    Lookahead wrapper over ``tokenize``. Accepts either a source (text or
+    bytes-like), read from the offset 'pos', or an iterable of tokens that was
+    already produced by the lexer.
+    """
+
+    def __init__(self, source, pos=0):
+        if isinstance(source, SOURCE_TYPES):
+            self._source = source
+            self._tokens = tokenize(source, pos)
+            self._skip_re = _SKIP_RE if isinstance(source, str) else _SKIP_RE_BYTES
+            self._newline = "\n" if isinstance(source, str) else b"\n"
+        else:
+            self._source = None
+            self._tokens = iter(source)
+        self._peeked = deque()
+        self._end = pos
+        self._released = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        tok = self.next()
+        if tok is None:
+            raise StopIteration
+        return tok
+
+    def peek(self, n=0):
+        while len(self._peeked) <= n:
+            tok = next(self._tokens, None)
+            if tok is None:
+                return None
+            self._end = tok.pos + len(tok.value)
+            self._peeked.append(tok)
+        return self._peeked[n]
+
+    def peekKind(self, n=0):
+        tok = self.peek(n)
+        return tok.kind if tok is not None else None
+
+    def next(self):
+        if self._peeked:
+            return self._peeked.popleft()
+        tok = next(self._tokens, None)
+        if tok is not None:
+            self._end = tok.pos + len(tok.value)
+        return tok
+
+    def _seek(self, pos):
+        self._peeked.clear()
+        self._tokens = tokenize(self._source, pos)
+        self._end = pos
+
+    def accept(self, kind):
+        """
+        Consumes and returns the next token if it is of the given kind.
+        """
+        if self.peekKind() == kind:
+            return self.next()
+        return None
+
+    def collect(self, stop_kinds):
+        """
+        Returns the tokens up to (but not including) the first token outside of
+        parentheses whose kind is in ``stop_kinds``. The stop token is left in
+        the stream.
+        """
+        result = []
+        depth = 0
+        while True:
+            tok = self.peek()
+            if tok is None:
+                return result
+            if depth == 0 and tok.kind in stop_kinds:
+                return result
+            if tok.kind == "(":
+                depth += 1
+            elif tok.kind == ")":
+                depth -= 1
+            result.append(self.next())
+
+    def skipPast(self, kind):
+        """
+        Consumes tokens up to and including the next token of the given kind.
+        """
+        return self._skipPast(kind, None)
+
+    def collectGroup(self):
+        """
+        Consumes a parenthesized group and returns the tokens inside it. The
+        next token must be the opening parenthesis.
+        """
+        result = []
+        if self.accept("(") is None:
+            return result
+        depth = 1
+        while True:
+            tok = self.next()
+            if tok is None:
+                return result
+            if tok.kind == "(":
+                depth += 1
+            elif tok.kind == ")":
+                depth -= 1
+                if depth == 0:
+                    return result
+            result.append(tok)
+
+    def skipSubprogram(self, into=None):
+        """
+        Consumes a subprogram declaration, instantiation or body whose
+        ``function``/``procedure`` keyword was just read. Consumed tokens are
+        appended to ``into`` when given.
+        """
+        signature = self.collect(("is", ";"))
+        tok = self.next()
+        if into is not None:
+            into.extend(signature)
+            if tok is not None:
+                into.append(tok)
+        if tok is None or tok.kind == ";":
+            return
+        if not signature or self.peekKind() == "new":
+            # attribute specification ('of f : function is ...') or instantiation
+            self._skipPast(";", into)
+            return
+        self.skipBody(into)
+
+    def skipBody(self, into=None):
+        """
+        Consumes tokens up to and including the ``end ... ;`` closing the
+        current design unit or subprogram body, skipping nested subprograms
+        and statements such as ``end process`` or ``end component``.
+        """
+        if into is None and self._source is not None:
+            return self._skipBodyFast()
+        while True:
+            tok = self.next()
+            if tok is None:
+                return None
+            if into is not None:
+                into.append(tok)
+            if tok.kind in SUBPROGRAMS:
+                self.skipSubprogram(into)
+            elif tok.kind == "end":
+                if self.peekKind() in NESTED_ENDS:
+                    nested = self.next()
+                    if into is not None:
+                        into.append(nested)
+                    continue
+                return self._skipPast(";", into)
+
+    def _skipBodyFast(self):
+        # Same as skipBody, but lets the regex engine jump over everything
+        # that is not a comment, a literal or one of the keywords it cares about
+        while True:
+            kw = self._searchKeyword()
+            if kw is None:
+                return None
+            if kw in SUBPROGRAMS:
+                self.skipSubprogram()
+            elif kw != "end":
+                continue
+            elif self.peekKind() in NESTED_ENDS:
+                self.next()
+            else:
+                return self._skipPast(";", None)
+
+    def skipDeclarations(self):
+        """
+        Same as collectDeclarations, but the tokens of the declarative region
+        are neither kept nor, when possible, even produced. Returns the offset
+        of its ``begin``, or None if there is none or the stream has no source.
+        """
+        if self._source is None:
+            self.collectDeclarations()
+            return None
+        while True:
+            kw = self._searchKeyword()
+            if kw is None:
+                return None
+            if kw == "begin":
+                return self._end - len(kw)
+            if kw in SUBPROGRAMS:
+                self.skipSubprogram()
+
+    def _searchKeyword(self):
+        """
+        Moves the stream right after the next end, begin, function or procedure
+        keyword and returns it in lower case, or None at the end of the source.
+        """
+        pos = self._peeked[0].pos if self._peeked else self._end
+        source, size = self._source, len(self._source)
+        while True:
+            if pos - self._released >= _SKIP_WINDOW:
+                self._release(pos)
+            limit = min(pos + _SKIP_WINDOW, size)
+            if limit < size:
+                # keywords don't span lines, so a window ending on one can't cut them
+                newline = source.rfind(self._newline, pos, limit)
+                if newline >= pos:
+                    limit = newline + 1
+            m = self._skip_re.search(source, pos, limit)
+            if m is None:
+                if limit >= size:
+                    self._seek(size)
+                    return None
+                pos = limit
+                continue
+            pos = m.end()
+            # only look back a bounded distance so huge single-line files stay linear
+            line_start = source.rfind(self._newline, max(0, m.start() - _LINE_LOOKBACK), m.start()) + 1
+            if line_start == 0:
+                line_start = max(0, m.start() - _LINE_LOOKBACK)
+            if not _isCode(source[line_start:m.start()], m.start() - line_start):
+                continue
+            self._seek(pos)
+            kw = m.group("kw")
+            return kw.lower() if isinstance(kw, str) else kw.decode("latin-1").lower()
+
+    def _release(self, pos):
+        # Drops the already scanned pages of a memory-mapped source, which the
+        # kernel would otherwise keep resident (and accounted to us)
+        if not isinstance(self._source, mmap.mmap) or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        end = pos - pos % mmap.PAGESIZE
+        if end > self._released:
+            self._source.madvise(mmap.MADV_DONTNEED, self._released, end - self._released)
+            self._released = end
+
+    def collectDeclarations(self):
+        """
+        Returns the tokens of a declarative region up to its ``begin``, which
+        is consumed but not returned.
+        """
+        result = []
+        while True:
+            tok = self.next()
+            if tok is None or tok.kind == "begin":
+                return result
+            result.append(tok)
+            if tok.kind in SUBPROGRAMS:
+                self.skipSubprogram(result)
+
+    def _skipPast(self, kind, into):
+        while True:
+            tok = self.next()
+            if tok is None:
+                return None
+            if into is not None:
+                into.append(tok)
+            if tok.kind == kind:
+                return tok
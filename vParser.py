@@ -2,7 +2,11 @@
 # -*- coding: utf-8 -*-
 
 from vhdl import *
-import sys, os
+from vLexer import TokenStream, joinTokens, splitTokens, tokenEnd
+import hashlib, mmap, os, threading
+from collections import OrderedDict, namedtuple
+from itertools import islice
+import tbProfile
 
 """
 vParser
@@ -11,10 +15,12 @@ vParser
 .. moduleauthor:: Jordi Masip <jordi@masip.cat>
 """
 
+# Chunks of rendered text joined into one write by write_chunks
+WRITE_BLOCK_CHUNKS = 4096
+
 def read_file(filename):
     if not os.path.isfile(filename):
-        print("error: file '%s' does not exist" % filename)
-        sys.exit(1)
+        raise VHDLError("file '%s' does not exist" % filename, filename)
 
     try:
         with open(filename, "r") as f:
@@ -22,183 +28,557 @@ def read_file(filename):
             return content
 
     except Exception as e:
-        print("error: failed to open file '%s'" % filename)
-        sys.exit(1)
+        raise VHDLError("failed to open file '%s'" % filename, filename)
 
-def write_file(filename, content):
-    with open(filename, "w") as f:
-        f.write(content)
+def map_file(filename):
+    """
+    Memory-maps 'filename' read-only, for parsing files too big to be read
+    into a string. The caller should close the returned object.
+    """
+    if not os.path.isfile(filename):
+        raise VHDLError("file '%s' does not exist" % filename, filename)
 
-def getBetween(s, pref, suf):
     try:
-        start = 0 if pref == "" else s.index(pref)
-        end = len(s) if suf == "" else s[start:].index(suf)
-        return (s[start + len(pref):start+end], start+end)
-    except Exception:
-        return ("", -1)
-
-def parseLibs(vhdl_file):
-    libs = {}
-    if "library" not in vhdl_file:
-        return []
-
-    last_pos = 0
-
-    while True:
-        value = getBetween(vhdl_file[last_pos:], "library", ";")
-
-        ignore_line = False
-
-        last_pos += value[1]
-
-        for i in range(last_pos - len("library" + value[0] + ";\n"), last_pos )[::-1]:
-            if vhdl_file[i] == '\n':
-                break
-
-            if vhdl_file[i] == '-' and vhdl_file[i-1] == '-':
-                ignore_line = True
-                break
-
-
-        if value == ("", -1):
-            break
-
-        lib_name = value[0].strip().lower()
-
-        if lib_name in libs:
-            break
-
-        if not ignore_line:
-            libs[lib_name] = Library(lib_name)
-    last_pos = 0
+        with open(filename, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b"" # empty files can't be mapped
+            content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except Exception as e:
+        raise VHDLError("failed to open file '%s'" % filename, filename)
 
-    libs["work"] = Library("work") # Present by default
+    if hasattr(mmap, "MADV_SEQUENTIAL"):
+        content.madvise(mmap.MADV_SEQUENTIAL)
+    return content
 
+def write_file(filename, content):
+    """
+    Writes 'content' to 'filename' unless the file already holds exactly that
+    content, so its mtime is kept. Returns whether the file was written.
+    """
+    return write_chunks(filename, (content,)) is not None
+
+def write_chunks(filename, chunks):
+    """
+    Writes the text 'chunks' to 'filename' as they are produced, so the whole
+    content is never held in memory. Returns the number of bytes written, or
+    None if the file already held exactly that content: its mtime is then
+    kept.
+
+    Chunks are written in blocks of WRITE_BLOCK_CHUNKS to a temporary file
+    next to 'filename', which then replaces it, so an interrupted run never
+    leaves a truncated file behind. The old content is compared block by
+    block.
+    """
+    tmp = "%s.%d.%d.tmp" % (filename, os.getpid(), threading.get_ident())
+    chunks = iter(chunks)
+    old = None
+    try:
+        try:
+            old = open(filename, "rb")
+        except OSError:
+            pass
+        size, same = 0, old is not None
+        with open(tmp, "wb") as f:
+            while True:
+                block = list(islice(chunks, WRITE_BLOCK_CHUNKS))
+                if not block:
+                    break
+                data = "".join(block).encode()
+                f.write(data)
+                size += len(data)
+                if same:
+                    same = old.read(len(data)) == data
+        if same and old.read(1) == b"":
+            os.remove(tmp)
+            return None
+        os.replace(tmp, filename)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        if old is not None:
+            old.close()
+    return size
+
+def designUnits(vhdl_file, headers_only=False, offsets=False, spans=False, pos=0):
+    """
+    Walks the tokens of a VHDL source once and yields its context items and
+    design units as ``(kind, value)`` pairs:
+
+    - ``("library", [names])``
+    - ``("use", [selected names])``
+    - ``("entity", Entity)``
+    - ``("architecture", (arch_name, entity_name, declarative_region))``
+    - ``("package", (package_name, declarative_region))``
+
+    The declarative region of an architecture or package is not parsed, only
+    located: it is reported as ``(source, start, end)`` for the
+    setDeclarations method of Architecture or Package, or None with
+    'headers_only' (which may be used on sources that are closed after
+    parsing). With 'offsets' the offset of the first token of
+    each item is yielded as a third element, and with 'spans' its offset and
+    the offset past its end as a third and fourth. The walk starts at the
+    offset 'pos', which must be the start of a token or the end of one.
+    """
+    ts = TokenStream(vhdl_file, pos)
     while True:
-        value = getBetween(vhdl_file[last_pos:], "use", ";")
+        tok = ts.next()
+        if tok is None:
+            return
+        kind = tok.kind
+
+        if kind == "library":
+            names = [t.value.lower() for t in ts.collect((";",)) if t.kind == "id"]
+            end = ts.skipPast(";")
+            unit = ("library", names)
+
+        elif kind == "use":
+            clause = ts.collect((";",))
+            end = ts.skipPast(";")
+            unit = ("use", [joinTokens(n).replace(" ", "").lower() for n in splitTokens(clause, ",")])
+
+        elif kind == "entity":
+            name = ts.accept("id")
+            if name is None or ts.accept("is") is None:
+                continue
+            entity = Entity(name.value)
+            parseEntityHeader(ts, entity)
+            end = ts.skipBody()
+            entity.setSpan(tok.pos, tokenEnd(end) if end is not None else len(vhdl_file))
+            unit = ("entity", entity)
+
+        elif kind == "architecture":
+            arch_name = ts.accept("id")
+            if arch_name is None or ts.accept("of") is None:
+                continue
+            ent_name = ts.accept("id")
+            is_tok = ts.accept("is")
+            if ent_name is None or is_tok is None:
+                continue
+            region = None
+            begin = ts.skipDeclarations()
+            if not headers_only and begin is not None:
+                region = (vhdl_file, tokenEnd(is_tok), begin)
+            end = ts.skipBody()
+            unit = ("architecture", (arch_name.value, ent_name.value, region))
+
+        elif kind == "package" and ts.peekKind() == "id" and ts.peekKind(1) == "is" and ts.peekKind(2) != "new":
+            name = ts.next()
+            is_tok = ts.next()
+            end = ts.skipBody()
+            region = None
+            if not headers_only and end is not None:
+                region = (vhdl_file, tokenEnd(is_tok), tokenEnd(end))
+            unit = ("package", (name.value, region))
 
-        ignore_line = False
-
-        last_pos += value[1]
+        else:
+            if kind in ("package", "configuration", "context"):
+                if kind == "context" and ts.peekKind(1) != "is":
+                    ts.skipPast(";") # context reference
+                    continue
+                ts.skipBody()
+            continue
 
-        for i in range(last_pos - len("use" + value[0] + ";\n"), last_pos )[::-1]:
-            if vhdl_file[i] == '\n':
-                break
+        if spans:
+            yield unit + (tok.pos, tokenEnd(end) if end is not None else len(vhdl_file))
+        else:
+            yield unit + (tok.pos,) if offsets else unit
 
-            if vhdl_file[i] == '-' and vhdl_file[i-1] == '-':
-                ignore_line = True
-                break
+def parseLibs(vhdl_file):
+    libs = {}
+    work = Library("work") # Present by default
 
+    for kind, value in designUnits(vhdl_file):
+        if kind in ("library", "use"):
+            _addContextItem(libs, work, kind, value)
 
-        if value == ("", -1):
-            break
+    libs["work"] = work
+    return libs.values()
 
-        use_statment = value[0].strip().lower().split(".")
+def _addContextItem(libs, work, kind, value, span=None):
+    if kind == "library":
+        for lib_name in value:
+            if lib_name not in libs and lib_name != "work":
+                libs[lib_name] = Library(lib_name)
+                if span is not None:
+                    libs[lib_name].setSpan(*span)
+        return
+
+    for use_statment in value:
+        use_statment = use_statment.split(".")
         lib, package = use_statment[0], ".".join(use_statment[1:])
-
-        if not ignore_line:
-            if lib in libs.keys():
-                libs[lib].addPackage(package)
-            else:
-                print("error: library '%s' is being used by the package '%s.%s' but has not been added" % (lib, lib, package))
+        lib = work if lib == "work" else libs.get(lib)
+        if lib is None:
+            report("error: library '%s' is being used by the package '%s.%s' but has not been added" % (use_statment[0], use_statment[0], package))
+        elif not lib.hasPackage(package):
+            lib.addPackage(package)
+
+def parseEntityHeader(ts, entity):
+    """
+    Reads the optional generic and port clauses following 'entity <name> is'.
+    """
+    while ts.peekKind() in ("generic", "port"):
+        kind = ts.next().kind
+        clause = ts.collectGroup()
+        if ts.accept(";") is None:
+            report("error: illegal or missing port/generic definition")
+        if kind == "generic":
+            entity.setGenericList(GenericList(clause))
+        else:
+            entity.setPortList(PortList(clause))
+            detectClockReset(entity)
+
+def detectClockReset(entity):
+    ports = list(entity.getPorts().keys())
+    clks = ['clk', 'clock']
+    rsts = ['rst', 'reset']
+    clk_search = True
+    for search_port in [clks, rsts]:
+        port = [port for port in ports if any(x in port.lower() for x in search_port)]
+        if not port:
             break
-
-    return libs.values()
-
-def parsePortsGenerics(vhdl_file, entity, isPort):
-    port = ""
-    search_string = ""
-    if isPort:
-        search_string = "port"
-    else:
-        search_string = "generic"
-    bracket_counter = 0
-    isCounting, isPortFound, isValidPort = False, False, False
-    between_entity = getBetween(vhdl_file, entity.getName() + " is", "end")[0].strip()
-
-    for i in range(len(between_entity)):
-        if between_entity[i:i+len(search_string)] == search_string:
-            isCounting = True
-            isPortFound = True
-        if isCounting:
-            port += between_entity[i]
-            if between_entity[i] == "(":
-                bracket_counter += 1
-            elif between_entity[i] == ")":
-                bracket_counter -= 1
-            elif between_entity[i] == ";" and bracket_counter == 0:
-                isPortFound = True
-                isValidPort = True
-                break
-    else:
-        isValidPort = False
-
-    if isValidPort:
-        if isPort:
-            entity.setPortList(PortList(port))
-            ports = set(entity.getPorts().keys())
-            clks = ['clk', 'clock']
-            rsts = ['rst', 'reset']
-            clk_search = True
-            for search_port in [clks, rsts]:
-                port = [port for port in ports if any(x in port.lower() for x in search_port)]
-                if not port:
-                    break
-                port = port[0] # TODO Deal with multiple clocks/resets
-                if clk_search:
-                    entity.clk = port
-                    clk_search = False # TODO This is probably not the best way
-                else:
-                    entity.rst = port
-                    if port.find("n") >= 0:
-                        entity.rstActiveLow = True
-                    else:
-                        entity.rstActiveLow = False
+        port = port[0] # TODO Deal with multiple clocks/resets
+        if clk_search:
+            entity.clk = port
+            clk_search = False # TODO This is probably not the best way
         else:
-            entity.setGenericList(GenericList(port))
-    elif isPortFound:
-        print("error: illegal or missing port/generic definition")
+            entity.rst = port
+            if port.find("n") >= 0:
+                entity.rstActiveLow = True
+            else:
+                entity.rstActiveLow = False
 
 def parseEntities(vhdl_file):
     entities = []
-    last_pos = 0
-
-    while True:
-        value = getBetween(vhdl_file[last_pos:], "entity", "is")
-        entity = Entity(value[0].strip())
-
-        if value == ("", -1) or entity in entities:
-            break
-
-        last_pos += value[1]
-        parsePortsGenerics(vhdl_file, entity, False) # get generics
-        parsePortsGenerics(vhdl_file, entity, True) # get ports
 
-        entities += [entity]
+    for kind, value in designUnits(vhdl_file):
+        if kind == "entity" and value not in entities:
+            entities += [value]
 
     return entities
 
 def parseArchitectureOfEntity(vhdl_file, entity):
-    last_pos = 0
-
-    while True:
-        value = getBetween(vhdl_file[last_pos:], "architecture", "begin")
-        last_pos += value[1]
-        arch_name = getBetween(value[0], "", " of")[0].strip()
-        ent_name = getBetween(value[0], "of ", "is")[0].strip()
-
-        if arch_name == "" or ent_name == "":
-            break
-        if ent_name != entity.getName():
+    for kind, value in designUnits(vhdl_file):
+        if kind != "architecture":
+            continue
+        arch_name, ent_name, region = value
+        if ent_name.lower() != entity.getName().lower():
             continue
 
         arch = Architecture(arch_name, entity)
-        signals = getBetween(value[0], "is", "")[0].strip()
-
-        if signals != "":
-            arch.setSignalList(SignalList(signals))
+        if region is not None:
+            arch.setDeclarations(*region)
 
         return arch
 
-    print("error: no architectures found for '%s'" % entity.getName())
-    sys.exit(1)
+    raise ParseError("no architectures found for '%s'" % entity.getName())
+
+# A context item or design unit of a parsed source: its kind and value as
+# yielded by designUnits, its span, and the Architecture or Package built
+# from it (None until then)
+DesignUnit = namedtuple("DesignUnit", ["kind", "value", "start", "end", "model"])
+
+def parseVHDL(vhdl_file, headers_only=False):
+    """
+    Builds a VHDL object with the libraries, entities and architectures of a
+    source in a single pass over its tokens. 'vhdl_file' may be text or a
+    memory-mapped file (see map_file). With 'headers_only', only the library
+    clauses, the entity headers and the architecture names are read, which is
+    all the testbench generator needs. Raises ParseError if an entity has no
+    architecture.
+
+    The libraries, entities, ports, generics and architectures of the model
+    carry their span in the source (see vhdl.Spanned).
+    """
+    units = designUnits(vhdl_file, headers_only, spans=True)
+    profile = tbProfile.current()
+    if profile is not None:
+        units = profile.timeUnits(units)
+    return _buildModel([DesignUnit(kind, value, start, end, None) for kind, value, start, end in units])
+
+def _buildModel(units):
+    """
+    Builds the VHDL object of the DesignUnits 'units', reusing the
+    Architectures and Packages they were already built into.
+    """
+    vhdl = VHDL()
+    libs = {}
+    work = Library("work") # Present by default
+    entities = {}
+    offsets = {}
+    with_arch = set()
+
+    for i, unit in enumerate(units):
+        kind, value = unit.kind, unit.value
+        if kind in ("library", "use"):
+            _addContextItem(libs, work, kind, value, (unit.start, unit.end))
+
+        elif kind == "entity":
+            if value.getName().lower() not in entities:
+                entities[value.getName().lower()] = value
+                offsets[value.getName().lower()] = unit.start
+                vhdl.setEntity(value)
+                tbProfile.count("entities")
+
+        elif kind == "package":
+            package = unit.model
+            if package is None:
+                package = Package(value[0])
+                package.setSpan(unit.start, unit.end)
+                if value[1] is not None:
+                    package.setDeclarations(*value[1])
+                units[i] = unit._replace(model=package)
+            vhdl.addPackage(package)
+
+        elif kind == "architecture":
+            arch_name, ent_name, region = value
+            entity = entities.get(ent_name.lower())
+            if entity is None or ent_name.lower() in with_arch:
+                continue # only the first architecture of each entity is used
+            with_arch.add(ent_name.lower())
+            arch = unit.model
+            if arch is None or arch.getEntity() is not entity:
+                arch = Architecture(arch_name, entity)
+                arch.setSpan(unit.start, unit.end)
+                if region is not None:
+                    arch.setDeclarations(*region)
+                units[i] = unit._replace(model=arch)
+            vhdl.setArchitecture(arch)
+
+    libs["work"] = work
+    [vhdl.addLibrary(l) for l in libs.values()]
+    vhdl.setUnits(units)
+
+    for entity in vhdl.getEntities():
+        if entity.getName().lower() not in with_arch:
+            raise ParseError("no architectures found for '%s'" % entity.getName(),
+                             offset=offsets[entity.getName().lower()])
+
+    return vhdl
+
+def _shiftUnit(unit, delta, source):
+    """
+    Returns the DesignUnit 'unit' moved by 'delta' into the edited 'source',
+    along with the model objects built from it.
+    """
+    kind, value, start, end, model = unit
+    if kind in ("architecture", "package"):
+        region = value[-1]
+        if region is not None:
+            value = value[:-1] + ((source, region[1] + delta, region[2] + delta),)
+        if model is not None:
+            model.shiftSpan(delta, source)
+    elif not delta:
+        return unit
+    elif kind == "entity":
+        value.shiftSpan(delta)
+    return DesignUnit(kind, value, start + delta, end + delta, model)
+
+def reparseVHDL(vhdl, vhdl_file, offset, removed, inserted, headers_only=False):
+    """
+    Applies an edit to the source 'vhdl_file' (text) that 'vhdl' is the model
+    of, as returned by parseVHDL or reparseVHDL: 'removed' characters at
+    'offset' are replaced by the text 'inserted'. Returns the edited source
+    and its model.
+
+    Only the design units the edit touches are lexed and parsed again, from
+    the end of the last unit before the edit up to the first following unit
+    that starts at the same place as before. The others, with their entities,
+    ports, generics and architectures, are reused and their spans moved, so
+    'vhdl' must not be used afterwards. 'headers_only' must be what 'vhdl'
+    was parsed with.
+    """
+    units = vhdl.getUnits()
+    source = vhdl_file[:offset] + inserted + vhdl_file[offset + removed:]
+    if (units is None or "*/" in vhdl_file[max(0, offset - 1):offset + removed + 1]
+            or "*/" in source[max(0, offset - 1):offset + len(inserted) + 1]):
+        # the end of a block comment decides whether an earlier '/*' starts one
+        return source, parseVHDL(source, headers_only)
+    delta = len(inserted) - removed
+
+    # only a unit ending before the edit starts is untouched: one ending where
+    # it starts may be unterminated, its end being the end of the source, and
+    # one starting where it ends may have its first token extended
+    before = [_shiftUnit(u, 0, source) for u in units if u.end < offset]
+    after = [u for u in units if u.start > offset + removed]
+    pos = before[-1].end if before else 0
+
+    result, following = before, 0
+    for kind, value, start, end in designUnits(source, headers_only, spans=True, pos=pos):
+        while following < len(after) and after[following].start + delta < start:
+            following += 1 # swallowed or changed by the edit
+        if following < len(after) and after[following].start + delta == start:
+            break # back in step with the old units
+        result.append(DesignUnit(kind, value, start, end, None))
+    else:
+        following = len(after) # the edit left the rest in a comment or unit
+    result += [_shiftUnit(u, delta, source) for u in after[following:]]
+    return source, _buildModel(result)
+
+# An instantiation statement of an architecture. 'kind' is "entity",
+# "component" or "configuration"; 'library' is lowercased and None for
+# components; 'scope' holds the labels of the generate statements it is
+# nested in, outermost first; 'offset' is the offset of its label.
+Instance = namedtuple("Instance", ["label", "kind", "library", "name", "architecture", "scope", "offset"])
+
+# What may precede the label of a concurrent statement
+_STATEMENT_START = frozenset([";", "begin", "generate", "=>"])
+
+def architectureInstances(vhdl_file, begin):
+    """
+    Returns the Instances of the statement part of an architecture, which
+    starts with the 'begin' keyword at the offset 'begin' of 'vhdl_file' (the
+    end of its declarative region, see designUnits).
+    """
+    body = []
+    TokenStream(vhdl_file, begin).skipBody(body)
+    instances, scope, pending = [], [], None
+    for i in range(2, len(body) - 1):
+        tok = body[i]
+        if tok.kind == "generate":
+            if body[i - 1].kind == "end":
+                if scope:
+                    scope.pop()
+            elif pending is not None:
+                scope.append(pending) # not for the alternatives of an if generate
+                pending = None
+            continue
+        if tok.kind in ("then", "loop", "is"):
+            pending = None # the label was one of a sequential statement
+            continue
+        if tok.kind != ":" or body[i - 1].kind != "id" or body[i - 2].kind not in _STATEMENT_START:
+            continue
+
+        label, kind = body[i - 1], body[i + 1].kind
+        if kind in ("for", "if", "case"):
+            pending = label.value
+        elif kind in ("entity", "configuration"):
+            names, j = [], i + 2
+            while j < len(body) and body[j].kind == "id":
+                names.append(body[j].value)
+                if j + 1 < len(body) and body[j + 1].kind == ".":
+                    j += 2
+                else:
+                    j += 1
+                    break
+            if not names:
+                continue
+            arch = None
+            if kind == "entity" and j + 2 < len(body) and body[j].kind == "(" and body[j + 1].kind == "id":
+                arch = body[j + 1].value
+            library = names[0].lower() if len(names) > 1 else "work"
+            instances.append(Instance(label.value, kind, library, names[-1], arch, tuple(scope), label.pos))
+        elif kind == "component" and i + 2 < len(body) and body[i + 2].kind == "id":
+            instances.append(Instance(label.value, "component", None, body[i + 2].value, None, tuple(scope), label.pos))
+        elif kind == "id" and i + 2 < len(body) and body[i + 2].kind in ("generic", "port"):
+            instances.append(Instance(label.value, "component", None, body[i + 1].value, None, tuple(scope), label.pos))
+    return instances
+
+SOURCE_EXTENSIONS = (".vhd", ".vhdl")
+
+# Files whose packages a PackageCache keeps by default
+PACKAGE_CACHE_FILES = 1024
+
+class PackageCache(object):
+    """
+    The packages declared by the sources of a run. A file is hashed only when
+    its stat changes and parsed only once per content, however many sources
+    use its packages. The 'max_files' most recently used files are kept.
+    Threads share the cache: files are read and parsed outside of its lock,
+    and the packages are parsed before they are shared, so they are not
+    changed afterwards.
+    """
+
+    def __init__(self, max_files=PACKAGE_CACHE_FILES):
+        self._max_files = max_files
+        self._files = OrderedDict()     # path -> (mtime, size, hash)
+        self._parsed = OrderedDict()    # hash -> {lowercased name: Package}
+        self._lock = threading.Lock()
+
+    def packagesOf(self, path):
+        """
+        Returns the packages declared in 'path' by lowercased name.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is not None and entry[:2] == (st.st_mtime_ns, st.st_size) and entry[2] in self._parsed:
+                self._files.move_to_end(path)
+                self._parsed.move_to_end(entry[2])
+                return self._parsed[entry[2]]
+
+        with open(path, "rb") as f:
+            source = f.read()
+        digest = hashlib.sha1(source).hexdigest()
+        with self._lock:
+            packages = self._parsed.get(digest)
+        if packages is None:
+            packages = {}
+            if b"package" in source.lower():
+                for kind, value in designUnits(source):
+                    if kind == "package" and value[0].lower() not in packages:
+                        package = Package(value[0], path, (st.st_mtime_ns, st.st_size, digest))
+                        if value[1] is not None: # no end yet, e.g. while it's being typed
+                            package.setDeclarations(*value[1])
+                        package.getConstants() # parsed while only this thread has it
+                        packages[value[0].lower()] = package
+                        tbProfile.count("packages")
+
+        with self._lock:
+            packages = self._parsed.setdefault(digest, packages) # another thread may have been first
+            self._parsed.move_to_end(digest)
+            self._files[path] = (st.st_mtime_ns, st.st_size, digest)
+            self._files.move_to_end(path)
+            while len(self._files) > self._max_files:
+                self._files.popitem(last=False)
+            while len(self._parsed) > self._max_files:
+                self._parsed.popitem(last=False)
+        return packages
+
+    def find(self, name, directories):
+        """
+        Returns the package 'name' declared by a source of 'directories', or
+        None. Sources are searched in name order.
+        """
+        for directory in directories:
+            try:
+                filenames = sorted(os.listdir(directory or "."))
+            except OSError:
+                continue
+            for filename in filenames:
+                if not filename.lower().endswith(SOURCE_EXTENSIONS):
+                    continue
+                try:
+                    package = self.packagesOf(os.path.join(directory, filename)).get(name.lower())
+                except OSError:
+                    continue
+                if package is not None:
+                    return package
+        return None
+
+package_cache = PackageCache()
+
+def resolvePackages(vhdl, directories, cache=None):
+    """
+    Adds to 'vhdl' the packages of the work library it uses but does not
+    declare itself, looked up in the sources of 'directories' through the
+    PackageCache 'cache' (the cache of the process by default). Returns the
+    names of the packages that were not found.
+    """
+    cache = cache or package_cache
+    missing = []
+    for lib in vhdl.getLibs():
+        if lib.getName() != "work":
+            continue
+        for use in lib.getPackages():
+            name = use.split(".")[1]
+            if vhdl.getPackage(name) is not None:
+                continue
+            package = cache.find(name, directories)
+            if package is None:
+                missing.append(name)
+            else:
+                vhdl.addPackage(package)
+    return missing
@@ -0,0 +1,471 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+vSerial
+=======
+
+Compact binary form of a parsed vhdl.VHDL model, for moving models between
+processes and to disk without pickling every object::
+
+    data = vSerial.to_bytes(model)
+    model = vSerial.from_bytes(data)
+
+The data starts with a header (magic, format version and the offset and
+count of every section) followed by the sections: a string table holding
+each distinct name, type and value once, and arrays of fixed-size
+little-endian records for the libraries, entities, ports, generics,
+signals, constants, types, architectures and packages, which refer to
+strings and to each other by index. Data of another format version is
+rejected with a ValueError.
+
+A ModelView reads the entities straight from a buffer, such as the
+``buf`` of a ``multiprocessing.shared_memory.SharedMemory`` block (see
+toSharedMemory), without copying it or building the model; only the
+strings asked for are decoded.
+
+Declarative regions that weren't parsed yet are stored as their text and
+stay unparsed in the loaded model. The design units a model was built from
+(vhdl.VHDL.getUnits) are not stored, so a loaded model can't be reparsed
+incrementally.
+"""
+
+import struct
+from collections import namedtuple
+
+from vhdl import VHDL, Library, Entity, Port, Generic, Signal, Constant, Architecture, Package, PORT_MODES
+
+MAGIC = b"VHDM"
+FORMAT_VERSION = 1
+
+NONE = 0xFFFFFFFF # index of an absent string or entity
+
+# name, first port, ports, first generic, generics, clk, rst, rstActiveLow, span
+_ENTITY = struct.Struct("<IIIIIIIBqq")
+# name, mode, type, value, span
+_PORT = struct.Struct("<IBIIqq")
+# name, type, value, span, for generics, signals and constants
+_DECLARATION = struct.Struct("<IIIqq")
+# name, first package, packages, span
+_LIBRARY = struct.Struct("<IIIqq")
+# name, entity, unparsed declarations, first signal, signals, first component, components, span
+_ARCHITECTURE = struct.Struct("<IIIIIIIqq")
+# name, path, unparsed declarations, first constant, constants, first type, types,
+# first component, components, span
+_PACKAGE = struct.Struct("<IIIIIIIIIqq")
+# name, definition
+_TYPE = struct.Struct("<II")
+_INDEX = struct.Struct("<I")
+
+# strings are blob[offsets[i]:offsets[i + 1]]; 'refs' are entity and string
+# indices the other records point into; 'top' holds the model's entities
+_SECTIONS = [
+    ("offsets", _INDEX), ("blob", struct.Struct("<B")), ("refs", _INDEX), ("top", _INDEX),
+    ("libraries", _LIBRARY), ("entities", _ENTITY), ("ports", _PORT), ("declarations", _DECLARATION),
+    ("types", _TYPE), ("architectures", _ARCHITECTURE), ("packages", _PACKAGE),
+]
+_HEADER = struct.Struct("<4sHH" + "II" * len(_SECTIONS))
+
+_MODES = dict((m, i) for i, m in enumerate(PORT_MODES))
+
+PortRecord = namedtuple("PortRecord", ["name", "mode", "type", "value", "span"])
+GenericRecord = namedtuple("GenericRecord", ["name", "type", "value", "span"])
+
+def _span(spanned):
+    span = spanned.getSpan()
+    return span if span is not None else (-1, -1)
+
+class _Writer(object):
+
+    def __init__(self):
+        self.strings = {}
+        self.sections = dict((name, []) for name, _ in _SECTIONS)
+        self.entities = {} # id -> index
+
+    def string(self, text):
+        if text is None:
+            return NONE
+        index = self.strings.get(text)
+        if index is None:
+            index = self.strings[text] = len(self.strings)
+        return index
+
+    def declarations(self, signals):
+        records = self.sections["declarations"]
+        first = len(records)
+        for s in signals:
+            records.append((self.string(s.getName()), self.string(s.getType()), self.string(s.getValue())) + _span(s))
+        return first, len(records) - first
+
+    def entity(self, entity):
+        ports = self.sections["ports"]
+        port_first = len(ports)
+        for p in entity.getPorts().values():
+            ports.append((self.string(p.getName()), _MODES[p.getPortType()], self.string(p.getType()),
+                          self.string(p.getValue())) + _span(p))
+        generics = self.declarations(entity.getGenerics().values())
+        records = self.sections["entities"]
+        self.entities[id(entity)] = len(records)
+        records.append((self.string(entity.getName()), port_first, len(ports) - port_first) + generics +
+                       (self.string(entity.clk), self.string(entity.rst), int(bool(entity.rstActiveLow))) +
+                       _span(entity))
+        return len(records) - 1
+
+    def components(self, components):
+        indices = [self.entity(c) for c in components.values()]
+        refs = self.sections["refs"]
+        refs.extend(indices)
+        return len(refs) - len(indices), len(indices)
+
+    def region(self, declarations):
+        """
+        Returns the string index of the text of an unparsed declarative
+        region, or NONE.
+        """
+        if declarations is None:
+            return NONE
+        source, start, end = declarations
+        text = source[start:end]
+        if not isinstance(text, str):
+            text = bytes(text).decode("latin-1") # as the lexer reads bytes
+        return self.string(text)
+
+    def pack(self):
+        blob = []
+        offsets, size = [0], 0
+        for text in self.strings: # in index order
+            data = text.encode("utf-8", "surrogatepass")
+            blob.append(data)
+            size += len(data)
+            offsets.append(size)
+        self.sections["offsets"] = offsets
+        self.sections["blob"] = b"".join(blob)
+
+        header_fields, body, position = [], [], _HEADER.size
+        for name, record in _SECTIONS:
+            records = self.sections[name]
+            if name == "blob":
+                data = records
+            elif record is _INDEX:
+                data = struct.pack("<%dI" % len(records), *records)
+            else:
+                data = b"".join(record.pack(*r) for r in records)
+            header_fields += [position, len(records)]
+            body.append(data)
+            position += len(data)
+        return _HEADER.pack(MAGIC, FORMAT_VERSION, 0, *header_fields) + b"".join(body)
+
+def to_bytes(vhdl):
+    """
+    Returns the serialized form of the vhdl.VHDL model 'vhdl'.
+    """
+    w = _Writer()
+    for lib in vhdl.getLibs():
+        refs = w.sections["refs"]
+        packages = [w.string(p) for p in lib.getPackages()]
+        refs.extend(packages)
+        w.sections["libraries"].append((w.string(lib.getName()), len(refs) - len(packages), len(packages)) + _span(lib))
+    w.sections["top"] = [w.entity(e) for e in vhdl.getEntities()]
+    for arch in vhdl.getArchitectures():
+        entity = w.entities.get(id(arch.getEntity()))
+        if entity is None:
+            entity = w.entity(arch.getEntity())
+        pending = arch.getUnparsedDeclarations()
+        if pending is not None:
+            signals, components = (0, 0), (0, 0)
+        else:
+            signals = w.declarations(arch.getSignalList().values())
+            components = w.components(arch.getComponents())
+        w.sections["architectures"].append((w.string(arch.getName()), entity, w.region(pending)) +
+                                            signals + components + _span(arch))
+    for package in vhdl.getPackages():
+        pending = package.getUnparsedDeclarations()
+        if pending is not None:
+            constants, types, components = (0, 0), (0, 0), (0, 0)
+        else:
+            constants = w.declarations(package.getConstants().values())
+            records = w.sections["types"]
+            records.extend((w.string(n), w.string(d)) for n, d in package.getTypes().items())
+            types = (len(records) - len(package.getTypes()), len(package.getTypes()))
+            components = w.components(package.getComponents())
+        w.sections["packages"].append((w.string(package.getName()), w.string(package.getPath()), w.region(pending)) +
+                                      constants + types + components + _span(package))
+    return w.pack()
+
+def from_bytes(data):
+    """
+    Returns the vhdl.VHDL model serialized in 'data' (see to_bytes).
+    """
+    return ModelView(data).toModel()
+
+class ModelView(object):
+    """
+    Read-only view of a serialized model in 'buffer' (bytes, a memoryview or
+    anything else exporting a buffer). Records are unpacked from the buffer
+    when asked for, so the buffer must stay alive while the view is used.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer).cast("B")
+        if len(self._buffer) < _HEADER.size:
+            raise ValueError("the data is not a serialized VHDL model")
+        fields = _HEADER.unpack_from(self._buffer)
+        if fields[0] != MAGIC:
+            raise ValueError("the data is not a serialized VHDL model")
+        if fields[1] != FORMAT_VERSION:
+            raise ValueError("the serialized model has format version %d instead of %d" % (fields[1], FORMAT_VERSION))
+        self._sections = {}
+        for i, (name, record) in enumerate(_SECTIONS):
+            offset, count = fields[3 + 2 * i], fields[4 + 2 * i]
+            if offset + count * record.size > len(self._buffer):
+                raise ValueError("the serialized model is truncated")
+            self._sections[name] = (offset, count, record)
+        self._strings = {}
+
+    def release(self):
+        """
+        Releases the buffer, so a shared memory block it belongs to can be
+        closed.
+        """
+        self._buffer.release()
+
+    def _count(self, section):
+        return self._sections[section][1]
+
+    def _record(self, section, index):
+        offset, count, record = self._sections[section]
+        if not 0 <= index < count:
+            raise IndexError("%s record %d is out of range" % (section, index))
+        return record.unpack_from(self._buffer, offset + index * record.size)
+
+    def _index(self, section, index):
+        return self._record(section, index)[0]
+
+    def string(self, index):
+        """
+        Returns the string 'index' of the string table, or None for NONE.
+        """
+        if index == NONE:
+            return None
+        text = self._strings.get(index)
+        if text is None:
+            blob = self._sections["blob"][0]
+            start, end = self._index("offsets", index), self._index("offsets", index + 1)
+            text = self._strings[index] = str(self._buffer[blob + start:blob + end], "utf-8", "surrogatepass")
+        return text
+
+    def entityCount(self):
+        return self._count("top")
+
+    def entities(self):
+        """
+        Returns EntityViews of the entities of the model.
+        """
+        return [EntityView(self, self._index("top", i)) for i in range(self._count("top"))]
+
+    def _table(self, section):
+        """
+        Returns all the records of 'section'.
+        """
+        offset, count, record = self._sections[section]
+        if record is _INDEX:
+            return struct.unpack_from("<%dI" % count, self._buffer, offset)
+        return list(record.iter_unpack(self._buffer[offset:offset + count * record.size]))
+
+    def _stringTable(self):
+        offsets = self._table("offsets")
+        blob = self._sections["blob"][0]
+        data = bytes(self._buffer[blob:blob + self._count("blob")])
+        return [data[offsets[i]:offsets[i + 1]].decode("utf-8", "surrogatepass") for i in range(len(offsets) - 1)]
+
+    def toModel(self):
+        """
+        Builds the vhdl.VHDL model.
+        """
+        build = _Builder(self)
+        vhdl = VHDL()
+        strings, refs = build.strings, build.refs
+        for name, first, count, start, end in self._table("libraries"):
+            lib = Library(strings[name])
+            for j in range(first, first + count):
+                lib.addPackage(strings[refs[j]].split(".", 1)[1])
+            _setSpan(lib, start, end)
+            vhdl.addLibrary(lib)
+        for index in self._table("top"):
+            vhdl.setEntity(build.entity(index))
+        for name, entity, pending, sig_first, sig_count, comp_first, comp_count, start, end in \
+                self._table("architectures"):
+            arch = Architecture(strings[name], build.entity(entity))
+            if pending != NONE:
+                arch.setDeclarations(strings[pending], 0, len(strings[pending]))
+            else:
+                arch.setDeclared(build.declarations(Signal, sig_first, sig_count),
+                                 build.components(comp_first, comp_count))
+            _setSpan(arch, start, end)
+            vhdl.setArchitecture(arch)
+        types = self._table("types")
+        for name, path, pending, const_first, const_count, type_first, type_count, comp_first, comp_count, \
+                start, end in self._table("packages"):
+            package = Package(strings[name], build.string(path))
+            if pending != NONE:
+                package.setDeclarations(strings[pending], 0, len(strings[pending]))
+            else:
+                package.setDeclared(build.declarations(Constant, const_first, const_count),
+                                    dict((strings[n], strings[d]) for n, d in types[type_first:type_first + type_count]),
+                                    build.components(comp_first, comp_count))
+            _setSpan(package, start, end)
+            vhdl.addPackage(package)
+        return vhdl
+
+class _Builder(object):
+    """
+    Builds model objects from the whole tables of a ModelView, each entity
+    once.
+    """
+
+    def __init__(self, view):
+        self.strings = view._stringTable()
+        self.refs = view._table("refs")
+        self.entities = view._table("entities")
+        self.ports = view._table("ports")
+        self.declared = view._table("declarations")
+        self.built = {}
+
+    def string(self, index):
+        return self.strings[index] if index != NONE else None
+
+    def entity(self, index):
+        entity = self.built.get(index)
+        if entity is not None:
+            return entity
+        name, port_first, port_count, generic_first, generic_count, clk, rst, low, start, end = self.entities[index]
+        entity = self.built[index] = Entity(self.strings[name])
+        strings = self.strings
+        for name, mode, t, value, p_start, p_end in self.ports[port_first:port_first + port_count]:
+            port = Port(strings[name], PORT_MODES[mode], strings[t])
+            port.setValue(strings[value])
+            if p_start >= 0:
+                port.setSpan(p_start, p_end)
+            entity.addPort(port)
+        for generic in self.declarations(Generic, generic_first, generic_count).values():
+            entity.addGeneric(generic)
+        entity.clk = strings[clk]
+        entity.rst = strings[rst]
+        entity.rstActiveLow = bool(low)
+        _setSpan(entity, start, end)
+        return entity
+
+    def declarations(self, cls, first, count):
+        signals = {}
+        strings = self.strings
+        for name, t, value, start, end in self.declared[first:first + count]:
+            s = signals[strings[name]] = cls(strings[name], strings[t], strings[value])
+            if start >= 0:
+                s.setSpan(start, end)
+        return signals
+
+    def components(self, first, count):
+        components = {}
+        for index in self.refs[first:first + count]:
+            entity = self.entity(index)
+            components[entity.getName()] = entity
+        return components
+
+def _setSpan(spanned, start, end):
+    if start >= 0:
+        spanned.setSpan(start, end)
+
+class EntityView(object):
+    """
+    An entity of a ModelView. Its fields are read from the buffer each time
+    they are asked for.
+    """
+
+    __slots__ = ("_view", "_index")
+
+    def __init__(self, view, index):
+        self._view = view
+        self._index = index
+
+    def _field(self, i):
+        return self._view._record("entities", self._index)[i]
+
+    def getName(self):
+        return self._view.string(self._field(0))
+
+    def getSpan(self):
+        start, end = self._view._record("entities", self._index)[8:]
+        return (start, end) if start >= 0 else None
+
+    @property
+    def clk(self):
+        return self._view.string(self._field(5))
+
+    @property
+    def rst(self):
+        return self._view.string(self._field(6))
+
+    @property
+    def rstActiveLow(self):
+        return bool(self._field(7))
+
+    def ports(self):
+        """
+        Returns the PortRecords of the entity, in declaration order.
+        """
+        record = self._view._record("entities", self._index)
+        ports = []
+        for i in range(record[1], record[1] + record[2]):
+            name, mode, t, value, start, end = self._view._record("ports", i)
+            ports.append(PortRecord(self._view.string(name), PORT_MODES[mode], self._view.string(t),
+                                    self._view.string(value), (start, end) if start >= 0 else None))
+        return ports
+
+    def generics(self):
+        """
+        Returns the GenericRecords of the entity, in declaration order.
+        """
+        record = self._view._record("entities", self._index)
+        generics = []
+        for i in range(record[3], record[3] + record[4]):
+            name, t, value, start, end = self._view._record("declarations", i)
+            generics.append(GenericRecord(self._view.string(name), self._view.string(t), self._view.string(value),
+                                          (start, end) if start >= 0 else None))
+        return generics
+
+    def toEntity(self):
+        """
+        Builds the vhdl.Entity.
+        """
+        name, _, _, _, _, clk, rst, low, start, end = self._view._record("entities", self._index)
+        entity = Entity(self._view.string(name))
+        for p in self.ports():
+            port = Port(p.name, p.mode, p.type)
+            port.setValue(p.value)
+            if p.span is not None:
+                port.setSpan(*p.span)
+            entity.addPort(port)
+        for g in self.generics():
+            generic = Generic(g.name, g.type, g.value)
+            if g.span is not None:
+                generic.setSpan(*g.span)
+            entity.addGeneric(generic)
+        entity.clk = self._view.string(clk)
+        entity.rst = self._view.string(rst)
+        entity.rstActiveLow = bool(low)
+        _setSpan(entity, start, end)
+        return entity
+
+def toSharedMemory(vhdl):
+    """
+    Serializes 'vhdl' into a new ``multiprocessing.shared_memory``
+    SharedMemory block and returns it. Other processes attach to it by its
+    ``name`` and read it through a ModelView of its ``buf``; the caller
+    closes and unlinks it.
+    """
+    from multiprocessing import shared_memory
+
+    data = to_bytes(vhdl)
+    block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    block.buf[:len(data)] = data
+    return block
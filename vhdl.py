@@ -8,12 +8,88 @@ VHDL Classes
 .. moduleauthor:: Jordi Masip <jordi@masip.cat>
 """
 
+import threading
+from contextlib import contextmanager
+from sys import intern
+from vLexer import TokenStream, SUBPROGRAMS, joinTokens, splitTokens, tokenEnd
+import tbProfile
+
+PORT_MODES = ("in", "out", "inout", "buffer", "linkage")
+
+_PORT_MODE_SET = dict((m, m) for m in PORT_MODES)
+
+_COMPOSITE_TYPES = ("record", "protected", "units")
+
+class VHDLError(Exception):
+    """
+    A source that can't be read or parsed. 'filename' and 'offset' locate the
+    problem when they are known.
+    """
+
+    def __init__(self, message, filename=None, offset=None):
+        Exception.__init__(self, message)
+        self.message = message
+        self.filename = filename
+        self.offset = offset
+
+class ParseError(VHDLError):
+    pass
+
+_diagnostics = threading.local()
+
+def report(message):
+    """
+    Reports a problem that does not stop parsing or generation: it is printed,
+    unless the current thread is collecting them.
+    """
+    messages = getattr(_diagnostics, "messages", None)
+    if messages is None:
+        print(message)
+    else:
+        messages.append(message)
+
+@contextmanager
+def collecting():
+    """
+    Collects the problems reported by the current thread in the enclosed
+    block instead of printing them, and yields the list they are added to.
+    """
+    previous = getattr(_diagnostics, "messages", None)
+    _diagnostics.messages = messages = []
+    try:
+        yield messages
+    finally:
+        _diagnostics.messages = previous
+
+class Spanned(object):
+    """
+    Base of the model objects that know the ``(start, end)`` byte span of
+    their source text, or None when they weren't parsed from a source.
+    """
+
+    __slots__ = ()
+
+    def getSpan(self):
+        return self._span
+
+    def setSpan(self, start, end):
+        self._span = (start, end)
+
+    def shiftSpan(self, delta):
+        """
+        Moves the span by 'delta', for text inserted or removed before it.
+        """
+        if self._span is not None:
+            self._span = (self._span[0] + delta, self._span[1] + delta)
+
 class VHDL(object):
 
     def __init__(self):
         self._libs = []
         self._entities = {}
         self._archs = {}
+        self._packages = {}
+        self._units = None
 
     def setEntity(self, ent):
         if isinstance(ent, Entity):
@@ -28,17 +104,33 @@ class VHDL(object):
         return False
 
     def setArchitecture(self, arch):
+        # keyed by entity, as different entities often use the same arch names
         if isinstance(arch, Architecture):
-            self._archs[arch.getName()] = arch
+            self._archs[arch.getEntity().getName().lower()] = arch
 
     def getArchitectures(self):
         return self._archs.values()
 
     def getArchitectureByName(self, arch_name):
-        if arch_name in self._arch.keys():
-            return self._arch[arch_name]
+        for arch in self._archs.values():
+            if arch.getName() == arch_name:
+                return arch
         return False
 
+    def getArchitectureOf(self, ent_name):
+        return self._archs.get(ent_name.lower(), False)
+
+    def addPackage(self, package):
+        # keyed by name, case insensitive; the first one declared wins
+        if isinstance(package, Package):
+            self._packages.setdefault(package.getName().lower(), package)
+
+    def getPackages(self):
+        return self._packages.values()
+
+    def getPackage(self, name):
+        return self._packages.get(name.lower())
+
     def addLibrary(self, lib):
         if isinstance(lib, Library):
             if lib not in self._libs:
@@ -59,23 +151,45 @@ class VHDL(object):
         """
         return self._libs
 
+    def setUnits(self, units):
+        """
+        Sets the context items and design units the model was built from, in
+        source order (see vParser.reparseVHDL).
+        """
+        self._units = units
+
+    def getUnits(self):
+        return self._units
+
+    def __reduce__(self):
+        # pickled in the compact form of vSerial, e.g. back from a process pool
+        import vSerial
+        return (vSerial.from_bytes, (vSerial.to_bytes(self),))
+
     def __str__(self):
         return "\n".join([str(l) for l in self._libs])
 
-class Library(object):
+class Library(Spanned):
+
+    __slots__ = ("_lib", "_packages", "_span")
 
     def __init__(self, value):
         self._lib = value
-        self._packages = []
+        self._packages = {} # used as an ordered set
+        self._span = None # of the library clause
 
     def addPackage(self, package_name):
-        if self._lib + "." + package_name not in self._packages:
-            self._packages += [self._lib + "." + package_name]
+        package = self._lib + "." + package_name
+        if package not in self._packages:
+            self._packages[package] = None
         else:
-            print("error: the package '{0}' is already in the library".format(package_name))
+            report("error: the package '{0}' is already in the library".format(package_name))
+
+    def hasPackage(self, package_name):
+        return self._lib + "." + package_name in self._packages
 
     def getPackages(self):
-        return self._packages
+        return list(self._packages)
 
     def getName(self):
         return self._lib
@@ -88,7 +202,9 @@ class Library(object):
     def __str__(self):
         return "<Library %s>" % self._lib
 
-class Entity(object):
+class Entity(Spanned):
+
+    __slots__ = ("_name", "_port", "_generic", "rst", "rstActiveLow", "clk", "_span")
 
     def __init__(self, name):
         self._name = name
@@ -97,10 +213,18 @@ class Entity(object):
         self.rst = ""
         self.rstActiveLow = True
         self.clk = ""
+        self._span = None
 
     def getName(self):
         return self._name
 
+    def shiftSpan(self, delta):
+        Spanned.shiftSpan(self, delta)
+        for p in self._port.values():
+            p.shiftSpan(delta)
+        for g in self._generic.values():
+            g.shiftSpan(delta)
+
     def setPortList(self, p):
         if isinstance(p, PortList):
             self._port = p.getPorts()
@@ -110,6 +234,9 @@ class Entity(object):
     def getPorts(self):
         return self._port
 
+    def addPort(self, port):
+        self._port[port.getName()] = port
+
     def setGenericList(self, p):
         if isinstance(p, GenericList):
             self._generic = p.getGenerics()
@@ -119,20 +246,29 @@ class Entity(object):
     def getGenerics(self):
         return self._generic
 
+    def addGeneric(self, generic):
+        self._generic[generic.getName()] = generic
+
     def __str__(self):
         return "<Entity %s>" % self._name
 
     def __eq__(self, other):
         return self._name == other.getName() if isinstance(other, Entity) else False
 
-class Signal(object):
+class Signal(Spanned):
+
+    __slots__ = ("_name", "_type", "_value", "_span")
 
     _obj_name = "signal"
-    _name = ""
-    _type = ""
-    _value = ""
 
     def __init__(self, name, t, value=""):
+        self._span = None # of its whole declaration, shared by the names it declares
+        if isinstance(name, str) and isinstance(t, str):
+            self._name = name
+            self._type = intern(t) # types repeat a lot, share them
+            self._value = value
+            return
+        self._name = self._type = ""
         self.setName(name)
         self.setType(t)
         self.setValue(value)
@@ -144,7 +280,7 @@ class Signal(object):
         if isinstance(n, str):
             self._name = n
         else:
-            print("error: the name '%s' must be a string" % self._obj_name)
+            report("error: the name '%s' must be a string" % self._obj_name)
 
     def setValue(self, val):
         self._value = val
@@ -157,9 +293,9 @@ class Signal(object):
 
     def setType(self, t):
         if isinstance(t, str):
-            self._type = t
+            self._type = intern(t)
         else:
-            print("error: the type '%s' must be a string" % self._obj_name)
+            report("error: the type '%s' must be a string" % self._obj_name)
 
     def __str__(self):
         if self._value == "":
@@ -172,64 +308,86 @@ class Signal(object):
             return self._name == other.getName() and self._type == other.getType()
         return False
 
+def _parseComponent(ts):
+    """
+    Reads a component declaration following its 'component' keyword and
+    returns it as an Entity, or None if it has no name.
+    """
+    name = ts.accept("id")
+    ts.accept("is")
+    component = Entity(name.value) if name is not None else None
+    while ts.peekKind() in ("generic", "port"):
+        kind = ts.next().kind
+        clause = ts.collectGroup()
+        ts.accept(";")
+        if component is None:
+            continue
+        if kind == "generic":
+            component.setGenericList(GenericList(clause))
+        else:
+            component.setPortList(PortList(clause))
+    while ts.peek() is not None:
+        if ts.next().kind == "end" and ts.accept("component"):
+            break
+    ts.skipPast(";")
+    return component
+
 class SignalList(object):
 
     def __init__(self, signal_str):
-        self._signals = self._getSignalFromString(signal_str.strip())
+        self._components = {}
+        self._signals = self._getSignalFromTokens(signal_str)
+        tbProfile.count("signals", len(self._signals))
 
     def getSignals(self):
         return self._signals
 
-    def _getSignalFromString(self, s):
+    def getComponents(self):
+        return self._components
+
+    def _getSignalFromTokens(self, source):
+        """
+        Reads the signal and constant declarations of a declarative region,
+        given as text or as tokens, along with its component declarations.
+        Subprograms and composite type definitions are skipped.
+        """
         signals = {}
-        while s.find("component") != -1:
-            comp = getBetween(s, "component", "end component;")
-            if comp:
-                s = s[0:s.find("component")] + s[comp[1] + len("end component;"):]
-        try:
-            for signal in s.split(";"):
-                signal = signal.strip()
-                if signal == "":
-                    break
-                isSignalWithAssignation = ":=" in signal
-                if isSignalWithAssignation:
-                    left, assignation = signal.split(":=")
-                else:
-                    left = signal
-                if ":" not in left:
-                    print("warning: line '%s' was ignored" % left.strip())
-                    continue
-                port_prefix, t = left.strip().split(":")
-                port_prefix = port_prefix.strip()
-                for i in range(len(port_prefix)):
-                    if port_prefix[i] == " ":
-                        variable_type = port_prefix[:i].strip()
-                        port_prefix = port_prefix[i+1:].strip()
+        ts = TokenStream(source)
+        while ts.peek() is not None:
+            kind = ts.next().kind
+            if kind == "component":
+                component = _parseComponent(ts)
+                if component is not None:
+                    self._components[component.getName()] = component
+                continue
+            if kind in SUBPROGRAMS:
+                ts.skipSubprogram()
+                continue
+            decl = ts.collect((";",))
+            if any(t.kind in _COMPOSITE_TYPES for t in decl):
+                while ts.peek() is not None:
+                    if ts.next().kind == "end" and ts.peekKind() in _COMPOSITE_TYPES:
                         break
-                else:
-                    print("error: the signal '%s' is invalid" % signal)
-                    return signals
-                if variable_type == "type":
-                    continue
-                t = t.strip()
-                if "," in port_prefix:
-                    for n in port_prefix.split(","):
-                        n = n.strip()
-                        signal = Signal(n, t)
-                        if isSignalWithAssignation:
-                            signal.setValue(assignation)
-                        signals[n] = signal
-                else:
-                    signal = Signal(port_prefix, t)
-                    if isSignalWithAssignation:
-                        signal.setValue(assignation)
-                    signals[port_prefix] = signal
-        except Exception as e:
-            print("error: cannot read 'signal': %s" % e)
+            ts.skipPast(";")
+            if kind not in ("signal", "constant", "variable", "shared"):
+                continue
+            declaration = _splitDeclaration(decl)
+            if declaration is None:
+                report("warning: line '%s' was ignored" % joinTokens(decl))
+                continue
+            names, t, value = declaration
+            t = joinTokens(t)
+            for n in names:
+                signal = Signal(n, t)
+                if value:
+                    signal.setValue(value)
+                signals[n] = signal
         return signals
 
 class Generic(Signal):
 
+    __slots__ = ()
+
     _obj_name = "generic"
 
     def __init__(self, name, t, value):
@@ -242,18 +400,22 @@ class Generic(Signal):
 
 class Port(Signal):
 
+    __slots__ = ("_port_type",)
+
     _obj_name = "port"
-    _port_type = "in"
 
     def __init__(self, name, port_type, t):
         Signal.__init__(self, name, t)
-        self.setPortType(port_type)
+        self._port_type = _PORT_MODE_SET.get(port_type)
+        if self._port_type is None:
+            self._port_type = "in"
+            self.setPortType(port_type)
 
     def setPortType(self, t):
-        if t in ["in", "out", "inout", "buffer", "linkage"]:
-            self._port_type = t
+        if t in _PORT_MODE_SET:
+            self._port_type = _PORT_MODE_SET[t]
         else:
-            print("error: '%s' is an invalid port type for %s '%s'" % (str(t), self._obj_name, self._name))
+            report("error: '%s' is an invalid port type for %s '%s'" % (str(t), self._obj_name, self._name))
 
     def getPortType(self):
         return self._port_type
@@ -269,132 +431,80 @@ class Port(Signal):
 class PortList(object):
 
     def __init__(self, port_str):
-        self._ports = self._getPortFromString(port_str.strip())
+        self._ports = self._getPortFromTokens(port_str)
         if self._ports == None:
             self._ports = {}
+        tbProfile.count("ports", len(self._ports))
 
     def getPorts(self):
         return self._ports
 
-    def _getPortFromString(self, s):
+    def _getPortFromTokens(self, source):
         ports = {}
-        counting = False
-        skip_times, bracket_count = 0, 0
-        between_port = ""
-        for i in range(len(s)):
-            if skip_times > 0:
-                skip_times -= 1
+        for element in _interfaceElements(source, "port"):
+            declaration = _splitDeclaration(element)
+            if declaration is None:
+                report("error: illegal port definition '%s'" % joinTokens(element))
                 continue
-            elif s[i:i+4] == "port":
-                counting = True
-                skip_times = 3
-                continue
-            elif s[i] == "(":
-                bracket_count += 1
-            elif s[i] == ")":
-                bracket_count -= 1
-                if bracket_count == 0:
-                    break
-            if counting:
-                between_port += s[i]
-        port = between_port.strip()[1:].strip()
-        for p in port.split("\n"):
-            port_name, t = p.split(":")
-            port_name = port_name.strip()
-            port_name = port_name.strip("signal") # Remove the optional leading signal
-            semi = t.find(";")
-            if semi != -1:
-                t = t[:semi] # remove semicolon and later
-            comment = t.find("--")
-            if comment != -1:
-                t = t[:comment] # remove semicolon and later
-
-            if port_name[0:2] == "--":
-                continue
-            t = t.strip()
-            for i in range(len(t)):
-                if t[i] == " ":
-                    port_type = t[:i].strip()
-                    variable_type = t[i+1:].strip()
-                    break
-            if "," in port_name:
-                for n in port_name.split(","):
-                    n = n.strip()
-                    ports[n] = Port(n, port_type, variable_type)
-            else:
-                ports[port_name] = Port(port_name, port_type, variable_type)
+            names, t, value = declaration
+            port_type = "in"
+            if t and t[0].kind in PORT_MODES:
+                port_type = t[0].kind
+                t = t[1:]
+            variable_type = joinTokens(t)
+            for n in names:
+                ports[n] = Port(n, port_type, variable_type)
+                ports[n].setSpan(element[0].pos, tokenEnd(element[-1]))
+                if value:
+                    ports[n].setValue(value)
         return ports
 
 class GenericList(object):
 
     def __init__(self, generic_str):
-        self._generics = self._getGenericFromString(generic_str.strip())
+        self._generics = self._getGenericFromTokens(generic_str)
         if self._generics == None:
             self._generics = {}
+        tbProfile.count("generics", len(self._generics))
 
     def getGenerics(self):
         return self._generics
 
-    def _getGenericFromString(self, s):
+    def _getGenericFromTokens(self, source):
         generics = {}
-        counting = False
-        skip_times, bracket_count = 0, 0
-        between_generic = ""
-        for i in range(len(s)):
-            if skip_times > 0:
-                skip_times -= 1
+        for element in _interfaceElements(source, "generic"):
+            if element[0].kind in ("type", "package", "pure", "impure") or element[0].kind in SUBPROGRAMS:
+                continue # VHDL-2008 generic types, packages and subprograms
+            declaration = _splitDeclaration(element)
+            if declaration is None:
+                report("error: the generic is malformed")
                 continue
-            elif s[i:i+7] == "generic":
-                counting = True
-                skip_times = 6
-                continue
-            elif s[i] == "(":
-                bracket_count += 1
-            elif s[i] == ")":
-                bracket_count -= 1
-                if bracket_count == 0:
-                    break
-            if counting:
-                between_generic += s[i]
-        try:
-            generic = between_generic.strip()[1:].replace("\n", "")
-            for p in generic.split(";"):
-                isGenericWithAssignment = ":=" in p
-                if isGenericWithAssignment:
-                    left, assignment = p.split(":=")
-                else:
-                    left = generic
-                generic_name, t = left.split(":")
-                generic_name = generic_name.strip()
-                if generic_name[0:2] == "--":
-                    continue
-                t = t.strip()
-                assignment = assignment.strip()
-                if "," in generic_name:
-                    for n in generic_name.split(","):
-                        n = n.strip()
-                        generics[n] = Generic(n, t, assignment)
-                else:
-                    generics[generic_name] = Generic(generic_name, t, assignment)
-        except Exception as e:
-            print("error: the generic is malformed")
+            names, t, value = declaration
+            t = joinTokens(t)
+            for n in names:
+                generics[n] = Generic(n, t, value)
+                generics[n].setSpan(element[0].pos, tokenEnd(element[-1]))
         return generics
 
-class Architecture(object):
+class Architecture(Spanned):
 
-    _begin = ""
-    _name = ""
-    _archOf = None
+    __slots__ = ("_name", "_archOf", "_signals", "_components", "_declarations", "_span")
 
     def __init__(self, name, ent):
+        self._name = ""
+        self._archOf = None
+        self._signals = {}
+        self._components = {}
+        self._declarations = None
+        self._span = None
         if isinstance(name, str):
             self._name = name
         else:
-            print("error: the arch '%s' must be a string" % name)
+            report("error: the arch '%s' must be a string" % name)
         if isinstance(ent, Entity):
             self._archOf = ent
         else:
-            print("error: architecture '%s' has an invalid entity" % self._name)
+            report("error: architecture '%s' has an invalid entity" % self._name)
 
     def getName(self):
         return self._name
@@ -404,23 +514,215 @@ class Architecture(object):
 
     def setSignalList(self, sl):
         if isinstance(sl, SignalList):
-            self._signals = sl.getSignals()
+            self.setDeclared(sl.getSignals(), sl.getComponents())
             return True
         return False
 
+    def setDeclared(self, signals, components):
+        """
+        Sets the signals and components (entities) declared by the
+        architecture, by name.
+        """
+        self._signals = signals
+        self._components = components
+        self._declarations = None
+
+    def setDeclarations(self, source, start, end):
+        """
+        Sets the span of the declarative region in 'source'. It is only parsed
+        into the signal list and components the first time either is asked
+        for.
+        """
+        self._declarations = (source, start, end)
+
+    def getUnparsedDeclarations(self):
+        """
+        Returns the (source, start, end) span of the declarative region if it
+        wasn't parsed yet, or None.
+        """
+        return self._declarations
+
+    def _parse(self):
+        if self._declarations is not None:
+            source, start, end = self._declarations
+            self.setSignalList(SignalList(source[start:end]))
+
+    def shiftSpan(self, delta, source=None):
+        """
+        Moves the span by 'delta', along with the declarative region if it
+        wasn't parsed yet, which then refers to the edited 'source' if given.
+        """
+        Spanned.shiftSpan(self, delta)
+        if self._declarations is not None:
+            old, start, end = self._declarations
+            self._declarations = (source if source is not None else old, start + delta, end + delta)
+
     def getSignalList(self):
+        self._parse()
         return self._signals
 
-    def getEntity(self):
-        return self._archOf
+    def getComponents(self):
+        """
+        Returns the components declared by the architecture, as entities by
+        name.
+        """
+        self._parse()
+        return self._components
 
     def __str__(self):
         return "<Architecture %s of %s>" % (self._name, self._archOf.getName())
 
-def getBetween(s, pref, suf):
-    try:
-        start = 0 if pref == "" else s.index(pref)
-        end = len(s) if suf == "" else s[start:].index(suf)
-        return (s[start + len(pref):start+end], start+end)
-    except Exception:
-        return ("", -1)
+class Constant(Signal):
+
+    __slots__ = ()
+
+    _obj_name = "constant"
+
+class Package(Spanned):
+    """
+    Declarations of a package: its constants, its types and subtypes (by
+    name, with the text of their definition, or just ``record``,
+    ``protected`` or ``units`` for composite types) and its components (as
+    entities). Like the signals of an architecture, they are only parsed the
+    first time they are asked for.
+    """
+
+    __slots__ = ("_name", "_path", "_stamp", "_constants", "_types", "_components", "_declarations", "_span")
+
+    def __init__(self, name, path=None, stamp=None):
+        self._name = name
+        self._path = path
+        self._stamp = stamp
+        self._constants = {}
+        self._types = {}
+        self._components = {}
+        self._declarations = None
+        self._span = None
+
+    def getName(self):
+        return self._name
+
+    def getPath(self):
+        """
+        Returns the file the package is declared in, if known.
+        """
+        return self._path
+
+    def getStamp(self):
+        """
+        Returns the (mtime, size, sha1) of the file the package was parsed
+        from, if known.
+        """
+        return self._stamp
+
+    def setDeclarations(self, source, start, end):
+        self._declarations = (source, start, end)
+
+    def getUnparsedDeclarations(self):
+        return self._declarations
+
+    def setDeclared(self, constants, types, components):
+        """
+        Sets the constants, types and components of the package, by name.
+        """
+        self._constants = constants
+        self._types = types
+        self._components = components
+        self._declarations = None
+
+    def shiftSpan(self, delta, source=None):
+        """
+        Same as Architecture.shiftSpan.
+        """
+        Spanned.shiftSpan(self, delta)
+        if self._declarations is not None:
+            old, start, end = self._declarations
+            self._declarations = (source if source is not None else old, start + delta, end + delta)
+
+    def getConstants(self):
+        self._parse()
+        return self._constants
+
+    def getTypes(self):
+        self._parse()
+        return self._types
+
+    def getComponents(self):
+        self._parse()
+        return self._components
+
+    def _parse(self):
+        if self._declarations is None:
+            return
+        source, start, end = self._declarations
+        self._declarations = None
+        ts = TokenStream(source[start:end])
+        while True:
+            tok = ts.next()
+            if tok is None or tok.kind == "end":
+                return # end of the package
+            kind = tok.kind
+            if kind in SUBPROGRAMS:
+                ts.skipSubprogram()
+            elif kind == "component":
+                component = _parseComponent(ts)
+                if component is not None:
+                    self._components[component.getName()] = component
+            elif kind in ("type", "subtype") and ts.peekKind() == "id" and ts.peekKind(1) == "is":
+                name = ts.next().value
+                ts.next()
+                decl = ts.collect((";",))
+                composite = [t.kind for t in decl if t.kind in _COMPOSITE_TYPES]
+                if composite:
+                    while ts.peek() is not None:
+                        if ts.next().kind == "end" and ts.peekKind() in _COMPOSITE_TYPES:
+                            break
+                ts.skipPast(";")
+                self._types[name] = composite[0] if composite else joinTokens(decl)
+            elif kind == "constant":
+                decl = ts.collect((";",))
+                ts.skipPast(";")
+                declaration = _splitDeclaration(decl)
+                if declaration is None:
+                    report("warning: line '%s' was ignored" % joinTokens(decl))
+                    continue
+                names, t, value = declaration
+                for n in names:
+                    self._constants[n] = Constant(n, joinTokens(t), value)
+            else:
+                ts.skipPast(";")
+
+    def __str__(self):
+        return "<Package %s>" % self._name
+
+def _interfaceElements(source, keyword):
+    """
+    Returns the elements of a port or generic clause as lists of tokens. The
+    clause may be given as text or tokens, with or without its keyword and
+    parentheses.
+    """
+    ts = TokenStream(source)
+    ts.accept(keyword)
+    if ts.peekKind() == "(":
+        tokens = ts.collectGroup()
+    else:
+        tokens = list(ts)
+    return [e for e in splitTokens(tokens, ";") if e]
+
+def _splitDeclaration(tokens):
+    """
+    Splits '[class] a, b : <subtype> [:= value]' into the list of names, the
+    tokens after the colon and the text of the default value.
+    """
+    parts = splitTokens(tokens, ":")
+    if len(parts) != 2:
+        return None
+    names = [t.value for t in parts[0] if t.kind == "id"]
+    if not names:
+        return None
+    t, value = parts[1], ""
+    for i in range(len(t)):
+        if t[i].kind == ":=":
+            t, value = t[:i], joinTokens(t[i+1:])
+            break
+    return (names, t, value)